@@ -1,17 +1,34 @@
 from __future__ import absolute_import
 
-from .pubsub import PublisherSync, SubscriberSync
-from .rpc import RpcClient, RpcServer
+import sys
+
+from .pubsub import PublisherSync, SubscriberSync, MultiSubscriber
+from .rpc import RpcClient, RpcServer, RpcServiceHost
 from .amqp_transport import Credentials, ConnectionParameters
-from .timer import Timer
-from .rate import Rate
+from .amqp_transport import SharedConnection, ConnectionPool
+from .timer import Timer, TimerScheduler
+from .rate import Rate, RateEstimator
 from .msg import Message, HeaderMessage, FileMessage
 from .events import Event, EventEmitterOptions, EventEmitter
 from .events import RabbitMQEventListener, InternalEventType
+from .file_transfer import FileSender, FileReceiver
+from .cache import ResponseCache, ReplayCache
+from .fake_broker import InMemoryBroker
 
 __all__ = [
-    'PublisherSync', 'SubscriberSync', 'RpcClient', 'RpcServer', 'Credentials',
-    'ConnectionParameters', 'Timer', 'Rate', 'Message',
-    'HeaderMessage', 'FileMessage', 'Event', 'EventEmitter',
-    'EventEmitterOptions', 'RabbitMQEventListener', 'InternalEventType'
+    'PublisherSync', 'SubscriberSync', 'MultiSubscriber', 'RpcClient',
+    'RpcServer', 'RpcServiceHost', 'Credentials', 'ConnectionParameters',
+    'SharedConnection', 'ConnectionPool', 'Timer', 'TimerScheduler',
+    'Rate', 'RateEstimator', 'Message', 'HeaderMessage', 'FileMessage',
+    'Event', 'EventEmitter', 'EventEmitterOptions',
+    'RabbitMQEventListener', 'InternalEventType', 'FileSender',
+    'FileReceiver', 'ResponseCache', 'ReplayCache', 'InMemoryBroker'
 ]
+
+if sys.version_info >= (3, 7):
+    from .aio import (AMQPTransportAsync, AsyncPublisher, AsyncSubscriber,
+                      AsyncRpcClient, AsyncRpcServer)
+    __all__ += [
+        'AMQPTransportAsync', 'AsyncPublisher', 'AsyncSubscriber',
+        'AsyncRpcClient', 'AsyncRpcServer'
+    ]
@@ -0,0 +1,653 @@
+# -*- coding: utf-8 -*-
+# Copyright (C) 2020  Panayiotou, Konstantinos <klpanagi@gmail.com>
+# Author: Panayiotou, Konstantinos <klpanagi@gmail.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""asyncio implementation of the transport, PubSub and RPC endpoints.
+
+Built on pika's AsyncioConnection. All endpoints run on the asyncio event
+loop; no threads are spawned.
+"""
+
+import asyncio
+import functools
+import time
+import uuid
+
+import pika
+from pika.adapters.asyncio_connection import AsyncioConnection
+
+from .amqp_transport import (
+    ConnectionParameters, ExchangeTypes, MessageProperties, DeliveryMeta
+)
+from .r4a_logger import create_logger, LoggingLevel
+from .serializer import serializer_registry
+from .msg import Message
+
+
+def _serialize_data(data, serializer):
+    """Serialize outgoing data.
+
+    Returns:
+        tuple: (payload, content_type, content_encoding)
+    """
+    if isinstance(data, Message):
+        data = data.to_dict()
+    return serializer_registry.serialize(data, serializer)
+
+
+class AMQPTransportAsync(object):
+    """asyncio Broker Interface.
+
+    Base class of the asyncio endpoints. Wraps the callback-based pika
+    channel API into coroutines.
+
+    Args:
+        connection_params (ConnectionParameters): Connection parameters.
+        creds (Credentials): Auth credentials. Overrides the credentials of
+            `connection_params`.
+        logger (logging.Logger): Logger to use.
+        debug (bool): Enable/Disable debug mode.
+        loop (asyncio.AbstractEventLoop): The event loop. Defaults to the
+            running loop at `connect()`.
+        connection_factory (callable): Called with the connection
+            parameters and the callbacks of pika's AsyncioConnection to open
+            the connection. Defaults to the `connection_factory` class
+            attribute. Pass `InMemoryBroker.connect_async` to use the
+            in-process broker.
+    """
+
+    #: Default connection factory of all asyncio endpoints.
+    connection_factory = AsyncioConnection
+
+    def __init__(self, connection_params=None, creds=None, logger=None,
+                 debug=False, loop=None, connection_factory=None):
+        """Constructor."""
+        if connection_factory is None:
+            connection_factory = AMQPTransportAsync.connection_factory
+        self._connection_factory = connection_factory
+        self._connection = None
+        self._channel = None
+        self._closing = False
+        self._loop = loop
+        self._pending = set()
+        # Message handling tasks, cancelled on close()
+        self._tasks = set()
+        self._closed = None
+
+        if logger is None:
+            logger = create_logger('{}-{}'.format(
+                self.__class__.__name__, self._name))
+        self.logger = logger
+        self.debug = debug
+
+        if connection_params is None:
+            connection_params = ConnectionParameters()
+        self.connection_params = connection_params
+        if creds is not None:
+            self.connection_params.credentials = creds
+        self.credentials = self.connection_params.credentials
+
+    @property
+    def channel(self):
+        return self._channel
+
+    @property
+    def connection(self):
+        return self._connection
+
+    @property
+    def debug(self):
+        """Debug mode flag."""
+        return self._debug
+
+    @debug.setter
+    def debug(self, val):
+        if not isinstance(val, bool):
+            raise TypeError('Value should be boolean')
+        self._debug = val
+        if self._debug is True:
+            self.logger.setLevel(LoggingLevel.DEBUG)
+        else:
+            self.logger.setLevel(LoggingLevel.INFO)
+
+    @property
+    def is_open(self):
+        return self._channel is not None and self._channel.is_open
+
+    def _create_future(self):
+        fut = self._loop.create_future()
+        self._pending.add(fut)
+        fut.add_done_callback(self._pending.discard)
+        return fut
+
+    def _create_task(self, coro):
+        """Run a coroutine as a task owned by the endpoint."""
+        task = self._loop.create_task(coro)
+        self._tasks.add(task)
+        task.add_done_callback(self._on_task_done)
+        return task
+
+    def _on_task_done(self, task):
+        self._tasks.discard(task)
+        if not task.cancelled() and task.exception() is not None:
+            self.logger.error('Task raised an exception',
+                              exc_info=task.exception())
+
+    async def _cancel_tasks(self):
+        # close() may be awaited by one of the tasks
+        tasks = [task for task in self._tasks
+                 if task is not asyncio.current_task()]
+        for task in tasks:
+            task.cancel()
+        if tasks:
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+    @staticmethod
+    def _resolve(fut, result=None):
+        if not fut.done():
+            fut.set_result(result)
+
+    def _call(self, method, *args, **kwargs):
+        """Invoke a pika channel method that reports completion through
+        its `callback` argument and return a future of the result."""
+        fut = self._create_future()
+        kwargs['callback'] = functools.partial(self._resolve, fut)
+        method(*args, **kwargs)
+        return fut
+
+    async def connect(self):
+        """Connect to the AMQP broker and open a channel."""
+        if self._loop is None:
+            self._loop = asyncio.get_event_loop()
+        self._closing = False
+        self._closed = self._loop.create_future()
+        opened = self._create_future()
+
+        def _on_open_error(_conn, err):
+            if not opened.done():
+                opened.set_exception(
+                    pika.exceptions.AMQPConnectionError(err))
+
+        self.logger.debug(
+            'Connecting to AMQP broker @ [{}:{}, vhost={}]...'.format(
+                self.connection_params.host,
+                self.connection_params.port,
+                self.connection_params.vhost))
+        self._connection = self._connection_factory(
+            self.connection_params,
+            on_open_callback=functools.partial(self._resolve, opened),
+            on_open_error_callback=_on_open_error,
+            on_close_callback=self._on_connection_closed,
+            custom_ioloop=self._loop)
+        await opened
+        self.logger.info(
+            'Connected to AMQP broker @ [{}:{}, vhost={}]'.format(
+                self.connection_params.host,
+                self.connection_params.port,
+                self.connection_params.vhost))
+
+        ch_opened = self._create_future()
+        self._connection.channel(
+            on_open_callback=functools.partial(self._resolve, ch_opened))
+        self._channel = await ch_opened
+        self._channel.add_on_close_callback(self._on_channel_closed)
+        return self._channel
+
+    def _fail_pending(self, exc):
+        for fut in list(self._pending):
+            if not fut.done():
+                fut.set_exception(exc)
+
+    def _on_channel_closed(self, channel, reason):
+        if not self._closing:
+            self.logger.warning('Channel {} was closed: {}'.format(
+                channel, reason))
+        self._fail_pending(pika.exceptions.ChannelClosed(0, str(reason)))
+        if self._connection is not None and self._connection.is_open:
+            self._connection.close()
+
+    def _on_connection_closed(self, connection, reason):
+        if not self._closing:
+            self.logger.warning('Connection closed: {}'.format(reason))
+        self._fail_pending(pika.exceptions.ConnectionClosed(0, str(reason)))
+        if self._closed is not None and not self._closed.done():
+            self._closed.set_result(reason)
+
+    async def wait_closed(self):
+        """Wait until the connection to the broker is closed."""
+        await self._closed
+
+    async def exchange_exists(self, exchange_name):
+        return await self._call(self._channel.exchange_declare,
+                                exchange=exchange_name, passive=True)
+
+    async def create_exchange(self, exchange_name, exchange_type,
+                              internal=False):
+        """Create a new exchange.
+
+        Args:
+            exchange_name (str): The name of the exchange (e.g. com.logging).
+            exchange_type (str): The type of the exchange (e.g. 'topic').
+            internal (bool): Can only be published to by other exchanges.
+        """
+        await self._call(self._channel.exchange_declare,
+                         exchange=exchange_name,
+                         exchange_type=exchange_type,
+                         durable=True,
+                         internal=internal)
+        self.logger.debug('Created exchange: [name={}, type={}]'.format(
+            exchange_name, exchange_type))
+
+    async def create_queue(self, queue_name='', exclusive=True, queue_size=10,
+                           message_ttl=60000, overflow_behaviour='drop-head',
+                           expires=600000):
+        """Create a new queue. See `AMQPTransportSync.create_queue()`.
+
+        Returns:
+            str: The name of the queue.
+        """
+        args = {
+            'x-max-length': queue_size,
+            'x-overflow': overflow_behaviour,
+            'x-message-ttl': message_ttl,
+            'x-expires': expires
+        }
+        result = await self._call(self._channel.queue_declare,
+                                  queue=queue_name,
+                                  exclusive=exclusive,
+                                  durable=False,
+                                  auto_delete=True,
+                                  arguments=args)
+        queue_name = result.method.queue
+        self.logger.debug('Created queue [{}] [size={}, ttl={}]'.format(
+            queue_name, queue_size, message_ttl))
+        return queue_name
+
+    async def delete_queue(self, queue_name):
+        await self._call(self._channel.queue_delete, queue=queue_name)
+
+    async def bind_queue(self, exchange_name, queue_name, bind_key):
+        """Bind a queue to and exchange using a bind-key.
+
+        Args:
+            exchange_name (str): The name of the exchange.
+            queue_name (str): The name of the queue.
+            bind_key (str): The binding key name.
+        """
+        self.logger.info('Subscribed to topic: {}'.format(bind_key))
+        await self._call(self._channel.queue_bind, queue=queue_name,
+                         exchange=exchange_name, routing_key=bind_key)
+
+    async def set_qos(self, prefetch_count):
+        """Set the consumer prefetch window of the channel."""
+        await self._call(self._channel.basic_qos,
+                         prefetch_count=prefetch_count)
+
+    async def close(self):
+        """Close channel and connection to the broker. Pending message
+        handling tasks are cancelled first."""
+        if self._connection is None or self._closing:
+            return
+        self._closing = True
+        await self._cancel_tasks()
+        if self._connection.is_open:
+            self._connection.close()
+        if self._closed is not None:
+            await self._closed
+
+    async def __aenter__(self):
+        await self.connect()
+        return self
+
+    async def __aexit__(self, exc_type, value, traceback):
+        await self.close()
+
+
+class AsyncPublisher(AMQPTransportAsync):
+    """asyncio Publisher class.
+
+    Args:
+        topic (str): The topic uri to publish data.
+        exchange (str): The exchange to publish data.
+        serializer (Serializer|str): Serializer of structured data, or its
+            content type.
+        **kwargs: The keyword arguments to pass to the base class
+            (AMQPTransportAsync).
+    """
+
+    _SERIALIZER = None
+
+    def __init__(self, topic, exchange='amq.topic', serializer=None,
+                 *args, **kwargs):
+        """Constructor."""
+        self._topic_exchange = exchange
+        self._topic = topic
+        self._name = topic
+        if serializer is not None:
+            self._SERIALIZER = serializer_registry.resolve(serializer)
+        AMQPTransportAsync.__init__(self, *args, **kwargs)
+
+    async def connect(self):
+        await AMQPTransportAsync.connect(self)
+        await self.create_exchange(self._topic_exchange, ExchangeTypes.Topic)
+        return self._channel
+
+    def publish(self, msg):
+        """Publish message once. Does not block; frames are written by
+        the event loop.
+
+        Args:
+            msg (dict|Message|str|bytes): Message/Data to publish.
+        """
+        _payload, _type, _encoding = _serialize_data(msg, self._SERIALIZER)
+        msg_props = MessageProperties(
+            content_type=_type,
+            content_encoding=_encoding,
+            message_id=0,
+        )
+        self._channel.basic_publish(
+            exchange=self._topic_exchange,
+            routing_key=self._topic,
+            properties=msg_props,
+            body=_payload)
+
+
+class AsyncSubscriber(AMQPTransportAsync):
+    """asyncio Subscriber class.
+
+    Incoming messages are either passed to `on_message` or consumed through
+    asynchronous iteration:
+
+        async for msg, meta in sub:
+            ...
+
+    Args:
+        topic (str): The topic uri.
+        on_message (function): Callback or coroutine function fired when
+            messages arrive at the registered topic.
+        exchange (str): The name of the exchange. Defaults to `amq.topic`
+        queue_size (int): The maximum queue size of the topic. Also bounds
+            the local buffer of undelivered messages; oldest are dropped.
+        message_ttl (int): Message Time-to-Live as specified by AMQP.
+        overflow (str): queue overflow behavior. Specified by AMQP Protocol.
+            Defaults to `drop-head`.
+        **kwargs: The keyword arguments to pass to the base class
+            (AMQPTransportAsync).
+    """
+
+    def __init__(self, topic, on_message=None, exchange='amq.topic',
+                 queue_size=10, message_ttl=60000, overflow='drop-head',
+                 *args, **kwargs):
+        """Constructor."""
+        self._name = topic
+        AMQPTransportAsync.__init__(self, *args, **kwargs)
+        self._topic = topic
+        self._topic_exchange = exchange
+        self._queue_name = None
+        self._queue_size = queue_size
+        self._message_ttl = message_ttl
+        self._overflow = overflow
+        self.onmessage = on_message
+        self._inbox = None
+        self._consumer_tag = None
+
+    async def connect(self):
+        await AMQPTransportAsync.connect(self)
+        self._inbox = asyncio.Queue(maxsize=self._queue_size)
+        await self.create_exchange(self._topic_exchange, ExchangeTypes.Topic)
+        self._queue_name = await self.create_queue(
+            queue_size=self._queue_size,
+            message_ttl=self._message_ttl,
+            overflow_behaviour=self._overflow,
+            expires=300000)
+        await self.bind_queue(self._topic_exchange, self._queue_name,
+                              self._topic)
+        return self._channel
+
+    async def run(self):
+        """Start consuming. Returns when the subscriber is closed."""
+        self.start()
+        await self.wait_closed()
+
+    def start(self):
+        """Start consuming without waiting."""
+        if self._consumer_tag is not None:
+            return
+        self._consumer_tag = self._channel.basic_consume(
+            self._queue_name,
+            self._on_msg_callback_wrapper,
+            auto_ack=True)
+
+    def _on_msg_callback_wrapper(self, ch, method, properties, body):
+        try:
+            msg = serializer_registry.deserialize(
+                body, properties.content_type, properties.content_encoding)
+        except Exception:
+            self.logger.error("Could not deserialize data",
+                              exc_info=True)
+            msg = body
+        meta = DeliveryMeta(ch, method, properties)
+
+        if self.onmessage is not None:
+            ret = self.onmessage(msg, meta)
+            if asyncio.iscoroutine(ret):
+                self._create_task(ret)
+            return
+
+        if self._inbox.full():
+            # Same semantics as the drop-head queue on the broker
+            self._inbox.get_nowait()
+        self._inbox.put_nowait((msg, meta))
+
+    def _on_connection_closed(self, connection, reason):
+        AMQPTransportAsync._on_connection_closed(self, connection, reason)
+        if self._inbox is not None:
+            if self._inbox.full():
+                self._inbox.get_nowait()
+            self._inbox.put_nowait(None)
+
+    def __aiter__(self):
+        self.start()
+        return self
+
+    async def __anext__(self):
+        item = await self._inbox.get()
+        if item is None:
+            raise StopAsyncIteration
+        return item
+
+
+class AsyncRpcClient(AMQPTransportAsync):
+    """asyncio RPC Client class.
+
+    Any number of calls may be awaited concurrently; responses are matched
+    by correlation id.
+
+    Args:
+        rpc_name (str): The name of the RPC.
+        serializer (Serializer|str): Serializer of structured data, or its
+            content type.
+        **kwargs: The keyword arguments to pass to the base class
+            (AMQPTransportAsync).
+    """
+
+    _SERIALIZER = None
+
+    def __init__(self, rpc_name, serializer=None, *args, **kwargs):
+        """Constructor."""
+        self._name = rpc_name
+        self._rpc_name = rpc_name
+        if serializer is not None:
+            self._SERIALIZER = serializer_registry.resolve(serializer)
+        AMQPTransportAsync.__init__(self, *args, **kwargs)
+        self._exchange = ExchangeTypes.Default
+        self._calls = {}
+        self._delay = 0
+
+    @property
+    def delay(self):
+        """The last recorded delay of the communication."""
+        return self._delay
+
+    async def connect(self):
+        await AMQPTransportAsync.connect(self)
+        await self._call(self._channel.basic_consume,
+                         'amq.rabbitmq.reply-to',
+                         self._on_response,
+                         auto_ack=True)
+        return self._channel
+
+    def _on_response(self, ch, method, properties, body):
+        fut = self._calls.pop(properties.correlation_id, None)
+        if fut is None or fut.done():
+            return
+        try:
+            msg = serializer_registry.deserialize(
+                body, properties.content_type, properties.content_encoding)
+        except Exception:
+            self.logger.error("Could not deserialize data",
+                              exc_info=True)
+            msg = body
+        fut.set_result(msg)
+
+    async def call(self, msg, timeout=5.0):
+        """Call RPC.
+
+        Args:
+            msg (dict|Message): The message to send.
+            timeout (float): Response timeout.
+        """
+        corr_id = str(uuid.uuid4())
+        _payload, _type, _encoding = _serialize_data(msg, self._SERIALIZER)
+        fut = self._create_future()
+        self._calls[corr_id] = fut
+        _rpc_props = MessageProperties(
+            content_type=_type,
+            content_encoding=_encoding,
+            correlation_id=corr_id,
+            message_id=corr_id,
+            reply_to='amq.rabbitmq.reply-to'
+        )
+        start_t = time.time()
+        self._channel.basic_publish(
+            exchange=self._exchange,
+            routing_key=self._rpc_name,
+            properties=_rpc_props,
+            body=_payload)
+        try:
+            resp = await asyncio.wait_for(fut, timeout)
+        except asyncio.TimeoutError:
+            self._calls.pop(corr_id, None)
+            resp = {'error': 'RPC Response timeout'}
+        self._delay = time.time() - start_t
+        return resp
+
+
+class AsyncRpcServer(AMQPTransportAsync):
+    """asyncio RPC Server class.
+
+    Args:
+        rpc_name (str): The name of the RPC.
+        on_request (function): Callback or coroutine function returning the
+            response of a request.
+        prefetch_count (int): Maximum number of requests handled
+            concurrently.
+        serializer (Serializer|str): Serializer of structured responses, or
+            its content type.
+        **kwargs: The keyword arguments to pass to the base class
+            (AMQPTransportAsync).
+    """
+
+    _SERIALIZER = None
+
+    def __init__(self, rpc_name, on_request=None, prefetch_count=100,
+                 serializer=None, *args, **kwargs):
+        """Constructor."""
+        self._name = rpc_name
+        self._rpc_name = rpc_name
+        if serializer is not None:
+            self._SERIALIZER = serializer_registry.resolve(serializer)
+        AMQPTransportAsync.__init__(self, *args, **kwargs)
+        self._exchange = ExchangeTypes.Default
+        self.on_request = on_request
+        self._prefetch_count = prefetch_count
+        self._rpc_queue = None
+
+    async def connect(self):
+        await AMQPTransportAsync.connect(self)
+        self._rpc_queue = await self.create_queue(self._rpc_name)
+        await self.set_qos(self._prefetch_count)
+        await self._call(self._channel.basic_consume,
+                         self._rpc_queue,
+                         self._on_request_wrapper)
+        self.logger.info('RPC Endpoint ready: {}'.format(self._rpc_name))
+        return self._channel
+
+    async def run(self):
+        """Serve requests. Returns when the server is closed."""
+        if self._channel is None:
+            await self.connect()
+        await self.wait_closed()
+
+    def _on_request_wrapper(self, ch, method, properties, body):
+        self._create_task(self._handle(ch, method, properties, body))
+
+    async def _handle(self, ch, method, properties, body):
+        try:
+            msg = serializer_registry.deserialize(
+                body, properties.content_type, properties.content_encoding)
+        except Exception:
+            self.logger.error("Could not deserialize data",
+                              exc_info=True)
+            msg = body
+
+        if self.on_request is None:
+            resp = {'error': 'Not Implemented', 'status': 501}
+        else:
+            try:
+                resp = self.on_request(msg, DeliveryMeta(ch, method,
+                                                         properties))
+                if asyncio.iscoroutine(resp):
+                    resp = await resp
+            except Exception as exc:
+                self.logger.error('Request handler raised an exception',
+                                  exc_info=True)
+                resp = {
+                    'status': 500,
+                    'error': 'Internal server error: {}'.format(str(exc))
+                }
+
+        try:
+            _payload, _type, _encoding = _serialize_data(resp,
+                                                         self._SERIALIZER)
+        except Exception as exc:
+            self.logger.error("Could not serialize data", exc_info=True)
+            _payload, _type, _encoding = _serialize_data(
+                {'status': 501,
+                 'error': 'Internal server error: {}'.format(str(exc))},
+                self._SERIALIZER)
+
+        if not ch.is_open:
+            return
+        ch.basic_publish(
+            exchange=self._exchange,
+            routing_key=properties.reply_to,
+            properties=MessageProperties(
+                content_type=_type,
+                content_encoding=_encoding,
+                correlation_id=properties.correlation_id),
+            body=_payload)
+        ch.basic_ack(delivery_tag=method.delivery_tag)
@@ -22,15 +22,20 @@ from __future__ import (
     unicode_literals
 )
 
+import functools
 import time
 import atexit
 import signal
 import json
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future
 
 import pika
 #  import ssl
 
 from .r4a_logger import create_logger, LoggingLevel
+from .serializer import serializer_registry
 
 
 class RPCMeta(object):
@@ -44,6 +49,147 @@ class RPCMeta(object):
         self.properties = properties
 
 
+class DeliveryProperties(object):
+    """Properties of a delivered message.
+
+    A view over the pika properties of the message; values are read on
+    access. Supports both attribute and dict-style access
+    (`props['content_type']`).
+    """
+
+    __slots__ = ['_props']
+
+    KEYS = ('content_type', 'content_encoding', 'timestamp_broker',
+            'timestamp_producer', 'delivery_mode', 'correlation_id')
+
+    def __init__(self, properties):
+        self._props = properties
+
+    @property
+    def content_type(self):
+        return self._props.content_type
+
+    @property
+    def content_encoding(self):
+        return self._props.content_encoding
+
+    @property
+    def timestamp_broker(self):
+        """The `timestamp_in_ms` header set by the broker, or None if the
+        broker does not timestamp messages."""
+        headers = self._props.headers
+        if not headers:
+            return None
+        return headers.get('timestamp_in_ms')
+
+    @property
+    def timestamp_producer(self):
+        return self._props.timestamp
+
+    @property
+    def delivery_mode(self):
+        return self._props.delivery_mode
+
+    @property
+    def correlation_id(self):
+        return self._props.correlation_id
+
+    @property
+    def headers(self):
+        return self._props.headers
+
+    @property
+    def raw(self):
+        """The pika properties of the message."""
+        return self._props
+
+    def __getitem__(self, key):
+        if key not in self.KEYS:
+            raise KeyError(key)
+        return getattr(self, key)
+
+    def __contains__(self, key):
+        return key in self.KEYS
+
+    def __iter__(self):
+        return iter(self.KEYS)
+
+    def get(self, key, default=None):
+        if key not in self.KEYS:
+            return default
+        return getattr(self, key)
+
+    def keys(self):
+        return list(self.KEYS)
+
+    def to_dict(self):
+        return {key: getattr(self, key) for key in self.KEYS}
+
+    def __repr__(self):
+        return 'DeliveryProperties({})'.format(self.to_dict())
+
+
+class DeliveryMeta(object):
+    """Metadata of a delivered message, passed to message callbacks.
+
+    Supports both attribute and dict-style access
+    (`meta['properties']['content_type']`).
+
+    Args:
+        channel (pika.channel.Channel): The channel of the delivery.
+        method (pika.spec.Basic.Deliver): The method frame.
+        properties (pika.spec.BasicProperties): The message properties.
+    """
+
+    __slots__ = ['channel', 'method', '_raw_properties', '_properties']
+
+    KEYS = ('channel', 'method', 'properties')
+
+    def __init__(self, channel=None, method=None, properties=None):
+        self.channel = channel
+        self.method = method
+        self._raw_properties = properties
+        self._properties = None
+
+    @property
+    def properties(self):
+        if self._properties is None and self._raw_properties is not None:
+            self._properties = DeliveryProperties(self._raw_properties)
+        return self._properties
+
+    def __getitem__(self, key):
+        if key not in self.KEYS:
+            raise KeyError(key)
+        return getattr(self, key)
+
+    def __contains__(self, key):
+        return key in self.KEYS
+
+    def __iter__(self):
+        return iter(self.KEYS)
+
+    def get(self, key, default=None):
+        if key not in self.KEYS:
+            return default
+        return getattr(self, key)
+
+    def keys(self):
+        return list(self.KEYS)
+
+    def __getstate__(self):
+        # Channels can not cross process boundaries
+        return (self.method, self._raw_properties)
+
+    def __setstate__(self, state):
+        self.channel = None
+        self.method, self._raw_properties = state
+        self._properties = None
+
+    def __repr__(self):
+        return 'DeliveryMeta(method={}, properties={})'.format(
+            self.method, self.properties)
+
+
 class MessageProperties(pika.BasicProperties):
     """Message Properties/Attribures used for sending and receiving messages.
 
@@ -51,11 +197,12 @@ class MessageProperties(pika.BasicProperties):
         content_type (str):
         content_encoding (str):
         timestamp (str):
+        headers (dict): Application headers.
 
     """
     def __init__(self, content_type=None, content_encoding=None,
                  timestamp=None, correlation_id=None, reply_to=None,
-                 message_id=None, user_id=None, app_id=None):
+                 message_id=None, user_id=None, app_id=None, headers=None):
         """Constructor."""
         if timestamp is None:
             timestamp = (time.time() + 0.5) * 1000
@@ -68,7 +215,8 @@ class MessageProperties(pika.BasicProperties):
             reply_to=reply_to,
             message_id=str(message_id) if message_id is not None else None,
             user_id=str(user_id) if user_id is not None else None,
-            app_id=str(app_id) if app_id is not None else None
+            app_id=str(app_id) if app_id is not None else None,
+            headers=headers
         )
 
 
@@ -162,6 +310,339 @@ class AMQPConnection(pika.BlockingConnection):
 
 
 
+class SharedConnection(object):
+    """A single AMQP connection shared by many endpoints.
+
+    Channels are handed out to endpoints (see the `connection` keyword
+    argument of AMQPTransportSync) up to `max_channels`, bounded by the
+    `channel_max` negotiated with the broker. The connection is driven by a
+    single I/O thread; blocking channel operations requested by endpoints
+    from other threads are executed on that thread.
+
+    Args:
+        conn_params (ConnectionParameters): Connection parameters.
+        max_channels (int): Maximum number of channels to hand out.
+            Defaults to the negotiated `channel_max`.
+        start (bool): Start the I/O thread on construction.
+        connection_factory (callable): Called with the connection parameters
+            to open the connection. Defaults to
+            `AMQPTransportSync.connection_factory`.
+    """
+
+    def __init__(self, conn_params=None, max_channels=None, start=True,
+                 connection_factory=None):
+        """Constructor."""
+        if conn_params is None:
+            conn_params = ConnectionParameters()
+        if connection_factory is None:
+            connection_factory = AMQPTransportSync.connection_factory
+        self.connection_params = conn_params
+        self._max_channels = max_channels
+        self._channels = set()
+        # Channels being opened. Counted against the channel limit.
+        self._opening = 0
+        self._lock = threading.Lock()
+        self._io_thread = None
+        self._running = False
+        self.logger = create_logger(self.__class__.__name__)
+        self._connection = connection_factory(self.connection_params)
+        self.logger.info(
+            'Connected to AMQP broker @ [{}:{}, vhost={}]'.format(
+                self.connection_params.host,
+                self.connection_params.port,
+                self.connection_params.vhost))
+        if start:
+            self.start()
+
+    @property
+    def connection(self):
+        return self._connection
+
+    @property
+    def channel_max(self):
+        """Maximum number of channels this connection hands out."""
+        _negotiated = self._connection._impl.params.channel_max
+        if self._max_channels is None:
+            return _negotiated
+        return min(self._max_channels, _negotiated)
+
+    @property
+    def num_channels(self):
+        """Number of channels currently handed out."""
+        return len(self._channels)
+
+    @property
+    def has_capacity(self):
+        return self.is_open and self.num_channels < self.channel_max
+
+    @property
+    def is_open(self):
+        return self._connection.is_open
+
+    @property
+    def is_running(self):
+        """True if the I/O thread drives the connection."""
+        return self._running
+
+    def in_io_thread(self):
+        """True if called from the I/O thread of the connection."""
+        return threading.current_thread() is self._io_thread
+
+    def acquire_channel(self):
+        """Open a new channel on the shared connection.
+
+        Returns:
+            tuple: (SharedConnection, channel)
+
+        Raises:
+            pika.exceptions.NoFreeChannels: The channel limit is reached.
+        """
+        with self._lock:
+            if self.num_channels + self._opening >= self.channel_max:
+                raise pika.exceptions.NoFreeChannels()
+            self._opening += 1
+        try:
+            channel = self.run_sync(self._connection.channel)
+        finally:
+            with self._lock:
+                self._opening -= 1
+        with self._lock:
+            self._channels.add(channel)
+        self.logger.debug('Opened channel {} [{}/{}]'.format(
+            channel.channel_number, self.num_channels, self.channel_max))
+        return self, channel
+
+    def release_channel(self, channel):
+        """Close a channel previously handed out by `acquire_channel()`."""
+        with self._lock:
+            self._channels.discard(channel)
+        if channel.is_open and self.is_open:
+            self.run_sync(channel.close)
+
+    def add_callback_threadsafe(self, callback):
+        self._connection.add_callback_threadsafe(callback)
+
+    def run_sync(self, fn, *args, **kwargs):
+        """Execute a function on the I/O thread and return its result.
+
+        Runs the function directly when called from the I/O thread or when
+        the I/O thread is not running.
+        """
+        if not self._running or self.in_io_thread():
+            return fn(*args, **kwargs)
+        future = Future()
+
+        def _wrapper():
+            if not future.set_running_or_notify_cancel():
+                return
+            try:
+                future.set_result(fn(*args, **kwargs))
+            except Exception as exc:
+                future.set_exception(exc)
+
+        self._connection.add_callback_threadsafe(_wrapper)
+        return future.result()
+
+    def start(self):
+        """Start the I/O thread."""
+        if self._running:
+            return
+        self._running = True
+        self._io_thread = threading.Thread(target=self._io_loop)
+        self._io_thread.daemon = True
+        self._io_thread.start()
+
+    def _io_loop(self):
+        while self._running:
+            try:
+                self._connection.process_data_events(time_limit=None)
+            except Exception:
+                self.logger.error('Shared connection I/O loop failed',
+                                  exc_info=True)
+                self._running = False
+                break
+
+    def stop(self):
+        """Stop the I/O thread."""
+        if not self._running:
+            return
+        self._running = False
+        if self.is_open:
+            # Wake up the I/O thread
+            self._connection.add_callback_threadsafe(lambda: None)
+        if not self.in_io_thread():
+            self._io_thread.join()
+
+    def close(self):
+        """Stop the I/O thread and close the connection."""
+        self.stop()
+        if self.is_open:
+            self._connection.close()
+
+
+class ConnectionPool(object):
+    """A pool of SharedConnection instances.
+
+    Hands out channels from the least loaded connection and opens a new
+    connection when all connections are at their channel limit.
+
+    Args:
+        conn_params (ConnectionParameters): Connection parameters.
+        max_connections (int): Maximum number of connections.
+        channels_per_connection (int): Maximum number of channels per
+            connection. Defaults to the negotiated `channel_max`.
+        connection_factory (callable): Passed to SharedConnection.
+    """
+
+    def __init__(self, conn_params=None, max_connections=4,
+                 channels_per_connection=None, connection_factory=None):
+        """Constructor."""
+        if conn_params is None:
+            conn_params = ConnectionParameters()
+        self.connection_params = conn_params
+        self._connection_factory = connection_factory
+        self._max_connections = max_connections
+        self._channels_per_connection = channels_per_connection
+        self._connections = []
+        self._lock = threading.Lock()
+
+    @property
+    def connections(self):
+        return list(self._connections)
+
+    def acquire_channel(self):
+        """Open a new channel on a pooled connection.
+
+        Returns:
+            tuple: (SharedConnection, channel)
+
+        Raises:
+            pika.exceptions.NoFreeChannels: All connections are at their
+                channel limit and the connection limit is reached.
+        """
+        with self._lock:
+            self._connections = [c for c in self._connections if c.is_open]
+            candidates = [c for c in self._connections if c.has_capacity]
+            if candidates:
+                conn = min(candidates, key=lambda c: c.num_channels)
+            elif len(self._connections) < self._max_connections:
+                conn = SharedConnection(
+                    self.connection_params,
+                    max_channels=self._channels_per_connection,
+                    connection_factory=self._connection_factory)
+                self._connections.append(conn)
+            else:
+                raise pika.exceptions.NoFreeChannels()
+            return conn.acquire_channel()
+
+    def close(self):
+        """Close all pooled connections."""
+        with self._lock:
+            for conn in self._connections:
+                conn.close()
+            self._connections = []
+
+
+class ConfirmTracker(object):
+    """Tracks pipelined publisher confirms of a channel.
+
+    Puts the channel in confirm mode without making publishing synchronous.
+    Delivery tags are assigned in publish order. Broker acks and nacks,
+    including `multiple` ones, resolve the futures of the confirmed
+    messages: acked messages resolve to True, nacked messages raise
+    pika.exceptions.NackError.
+
+    Args:
+        window (int): Maximum number of unconfirmed messages.
+    """
+
+    def __init__(self, window=1000):
+        """Constructor."""
+        self.window = window
+        self.acked = 0
+        self.nacked = 0
+        self._unconfirmed = OrderedDict()
+        # Window slots of messages queued for publishing but not yet
+        # registered
+        self._reserved = 0
+        self._next_tag = 1
+        self._cond = threading.Condition()
+
+    @property
+    def unconfirmed(self):
+        """Number of published but not yet confirmed messages."""
+        return len(self._unconfirmed)
+
+    def has_capacity(self):
+        return len(self._unconfirmed) + self._reserved < self.window
+
+    def reserve(self, count=1):
+        """Take (or, with a negative count, give back) window slots for
+        messages queued for publishing."""
+        with self._cond:
+            self._reserved += count
+            if count < 0:
+                self._cond.notify_all()
+
+    def all_confirmed(self):
+        """True if no message is unconfirmed or queued for publishing."""
+        return not self._unconfirmed and not self._reserved
+
+    def select(self, channel):
+        """Enable confirm mode on a BlockingChannel.
+
+        BlockingChannel.confirm_delivery() waits for the confirm of every
+        published message. The underlying channel is used instead, so that
+        confirms are processed asynchronously.
+        """
+        selected = []
+        channel._impl.confirm_delivery(ack_nack_callback=self._on_ack_nack,
+                                       callback=selected.append)
+        channel._flush_output(lambda: bool(selected))
+
+    def register(self, future):
+        """Assign the next delivery tag to a message about to be published.
+
+        Must be called on the connection thread, right before publishing.
+        """
+        with self._cond:
+            self._unconfirmed[self._next_tag] = future
+            self._next_tag += 1
+
+    def _on_ack_nack(self, frame):
+        method = frame.method
+        acked = isinstance(method, pika.spec.Basic.Ack)
+        tag = method.delivery_tag
+        confirmed = []
+        with self._cond:
+            if method.multiple:
+                while self._unconfirmed:
+                    _tag = next(iter(self._unconfirmed))
+                    if tag != 0 and _tag > tag:
+                        break
+                    confirmed.append(self._unconfirmed.popitem(last=False)[1])
+            elif tag in self._unconfirmed:
+                confirmed.append(self._unconfirmed.pop(tag))
+            if acked:
+                self.acked += len(confirmed)
+            else:
+                self.nacked += len(confirmed)
+            self._cond.notify_all()
+        for future in confirmed:
+            if future is None or future.done():
+                continue
+            if acked:
+                future.set_result(True)
+            else:
+                future.set_exception(pika.exceptions.NackError([]))
+
+    def wait_for(self, predicate, timeout=None):
+        """Block until predicate() is true. For use from threads other than
+        the connection thread."""
+        with self._cond:
+            return self._cond.wait_for(predicate, timeout)
+
+
 class ExchangeTypes(object):
     """AMQP Exchange Types."""
     Topic = 'topic'
@@ -190,14 +671,31 @@ class AMQPTransportSync(object):
 
     Implements commonly used functionalities. Base class of high-level
         implementations such as SubscriberSync and RpcServer.
+
+    Keyword Args:
+        connection (SharedConnection|ConnectionPool): Acquire the channel
+            from a shared connection instead of opening a new connection.
+        connection_params (ConnectionParameters): Connection parameters.
+        creds (Credentials): Auth credentials.
+        logger (logging.Logger): Logger to use.
+        debug (bool): Enable/Disable debug mode.
+        connection_factory (callable): Called with the connection parameters
+            to open a new connection. Defaults to the `connection_factory`
+            class attribute. Pass `InMemoryBroker.connect` to use the
+            in-process broker.
     """
 
+    #: Default connection factory of all endpoints.
+    connection_factory = AMQPConnection
+
     def __init__(self, *args, **kwargs):
         """Constructor."""
         self._connection = None
         self._channel = None
         self._closing = False
         self._debug = False
+        self._shared = None
+        self._confirms = None
         self.logger = None
 
         if 'logger' in kwargs:
@@ -211,7 +709,13 @@ class AMQPTransportSync(object):
         else:
             self.debug = False
 
-        if 'connection_params' in kwargs:
+        self._connection_factory = kwargs.pop(
+            'connection_factory', AMQPTransportSync.connection_factory)
+
+        self._channel_source = kwargs.pop('connection', None)
+        if self._channel_source is not None:
+            self.connection_params = self._channel_source.connection_params
+        elif 'connection_params' in kwargs:
             self.connection_params = kwargs.pop('connection_params')
         else:
             # Default Connection Parameters
@@ -234,6 +738,11 @@ class AMQPTransportSync(object):
     def connection(self):
         return self._connection
 
+    @property
+    def shared(self):
+        """True if the channel belongs to a running SharedConnection."""
+        return self._shared is not None and self._shared.is_running
+
     @property
     def debug(self):
         """Debug mode flag."""
@@ -251,6 +760,13 @@ class AMQPTransportSync(object):
 
     def connect(self):
         """Connect to the AMQP broker. Creates a new channel."""
+        if self._channel_source is not None:
+            if self._shared is not None:
+                self._shared.release_channel(self._channel)
+            self._shared, self._channel = \
+                self._channel_source.acquire_channel()
+            self._connection = self._shared.connection
+            return self._channel
         if self._connection is not None:
             self.logger.debug('Using allready existing connection [{}]'.format(
                 self._connection))
@@ -266,7 +782,8 @@ class AMQPTransportSync(object):
                         self.connection_params.vhost))
             self.logger.debug('Connection parameters:')
             self.logger.debug(self.connection_params)
-            self._connection = AMQPConnection(self.connection_params)
+            self._connection = self._connection_factory(
+                self.connection_params)
             # Create a new communication channel
             self._channel = self._connection.channel()
             self.logger.info(
@@ -286,9 +803,97 @@ class AMQPTransportSync(object):
         return self._channel
 
     def process_amqp_events(self):
-        """Force process amqp events, such as heartbeat packages."""
+        """Force process amqp events, such as heartbeat packages.
+
+        No-op when the connection is driven by a SharedConnection.
+        """
+        if self.shared:
+            return
         self.connection.process_data_events()
 
+    def _deserialize_data(self, data, content_type, content_encoding):
+        """Deserialize wire data. Dispatches on the content type through the
+        serializer registry.
+
+        Args:
+            data (bytes): Data to deserialize.
+            content_type (str): The content type.
+            content_encoding (str): The content encoding. Defaults to `utf8`.
+        """
+        return serializer_registry.deserialize(data, content_type,
+                                               content_encoding)
+
+    def _run_io(self, fn, *args, **kwargs):
+        """Execute a blocking channel operation on the connection thread."""
+        if self._shared is not None:
+            return self._shared.run_sync(fn, *args, **kwargs)
+        return fn(*args, **kwargs)
+
+    def _io_call(self, fn, *args, **kwargs):
+        """Run a channel operation, even while consuming in a thread.
+
+        Unlike `_run_io()`, does not wait for the result when the consumer
+        thread owns the connection.
+        """
+        _thread = getattr(self, 'loop_thread', None)
+        if not self.shared and _thread is not None and \
+                _thread.is_alive() and \
+                threading.current_thread() is not _thread:
+            # The consumer thread owns the connection
+            self._connection.add_callback_threadsafe(
+                functools.partial(fn, *args, **kwargs))
+            return
+        fn(*args, **kwargs)
+
+    @property
+    def confirms(self):
+        """ConfirmTracker of the channel or None if confirms are disabled."""
+        return self._confirms
+
+    def _enable_confirms(self, window):
+        self._confirms = ConfirmTracker(window)
+        self._run_io(self._confirms.select, self._channel)
+
+    def _wait_confirms(self, predicate, timeout=None):
+        if self.shared and not self._shared.in_io_thread():
+            return self._confirms.wait_for(predicate, timeout)
+        if timeout is None:
+            self._channel._flush_output(predicate)
+            return True
+        deadline = time.time() + timeout
+        while not predicate():
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                return False
+            self.connection.process_data_events(
+                time_limit=min(remaining, 0.01))
+        return True
+
+    def _wait_confirm_window(self):
+        """Block while the window of unconfirmed messages is full."""
+        if not self._confirms.has_capacity():
+            self._wait_confirms(self._confirms.has_capacity)
+
+    def wait_for_confirms(self, timeout=None):
+        """Wait until the broker has confirmed all published messages.
+
+        Args:
+            timeout (float): Seconds to wait. None waits forever.
+
+        Returns:
+            bool: True if all messages were confirmed.
+        """
+        if self._confirms is None:
+            raise ValueError('Publisher confirms are not enabled')
+        return self._wait_confirms(self._confirms.all_confirmed, timeout)
+
+    def _wait_closed(self):
+        """Block until the channel is closed. Used in place of
+        start_consuming() when the connection is driven by a
+        SharedConnection."""
+        while self._channel.is_open:
+            time.sleep(0.1)
+
     def _signal_handler(self, signum, frame):
         self.logger.info('Signal received: ', signum)
         self._graceful_shutdown()
@@ -300,12 +905,19 @@ class AMQPTransportSync(object):
             # self.logger.warning('Channel is allready closed')
             return
         self.logger.debug('Invoking a graceful shutdown...')
+        if self._shared is not None:
+            if self._shared.is_open:
+                self._run_io(self._channel.stop_consuming)
+                self._shared.release_channel(self._channel)
+            self.logger.debug('Channel closed!')
+            return
         self._channel.stop_consuming()
         self._channel.close()
         self.logger.debug('Channel closed!')
 
     def exchange_exists(self, exchange_name):
-        resp = self._channel.exchange_declare(
+        resp = self._run_io(
+            self._channel.exchange_declare,
             exchange=exchange_name,
             passive=True,  # Perform a declare or just to see if it exists
         )
@@ -322,7 +934,8 @@ class AMQPTransportSync(object):
         @param exchange_type: The type of the exchange (e.g. 'topic').
         @type exchange_type: string
         """
-        self._channel.exchange_declare(
+        self._run_io(
+            self._channel.exchange_declare,
             exchange=exchange_name,
             durable=True,  # Survive reboot
             passive=False,  # Perform a declare or just to see if it exists
@@ -371,7 +984,8 @@ class AMQPTransportSync(object):
             'x-expires': expires
         }
 
-        result = self._channel.queue_declare(
+        result = self._run_io(
+            self._channel.queue_declare,
             exclusive=exclusive,
             queue=queue_name,
             durable=False,
@@ -383,7 +997,7 @@ class AMQPTransportSync(object):
         return queue_name
 
     def delete_queue(self, queue_name):
-        self._channel.queue_delete(queue=queue_name)
+        self._run_io(self._channel.queue_delete, queue=queue_name)
 
     def _queue_exists_clb(self, arg):
         print(arg)
@@ -400,7 +1014,8 @@ class AMQPTransportSync(object):
         # resp = self._channel.queue_declare(queue_name, passive=True,
         #                                    callback=self._queue_exists_clb)
         try:
-            resp = self._channel.queue_declare(queue_name, passive=True)
+            resp = self._run_io(self._channel.queue_declare, queue_name,
+                                passive=True)
         except pika.exceptions.ChannelClosedByBroker as exc:
             self.connect()
             if exc.reply_code == 404:  # Not Found
@@ -424,207 +1039,37 @@ class AMQPTransportSync(object):
         """
         self.logger.info('Subscribed to topic: {}'.format(bind_key))
         try:
-            self._channel.queue_bind(
+            self._run_io(
+                self._channel.queue_bind,
                 exchange=exchange_name, queue=queue_name, routing_key=bind_key)
         except Exception as exc:
             raise exc
 
-    def close(self):
-        self._graceful_shutdown()
-
-    def disconnect(self):
-        self._graceful_shutdown()
-
-    def __del__(self):
-        self._graceful_shutdown()
-
-
-class AMQPTransportAsync(object):
-    CONNECTION_TIMEOUT_SEC = 5
-
-    def __init__(self, host='127.0.0.1', port='5672', exchange='amq.topic'):
-        self._connection = None
-        self._channel = None
-        self._closing = False
-        self.logger = create_logger(self.__class__.__name__)
-        self._exchange = 'amq.topic'
-        self._host = host
-        self._port = port
-        super(AMQPTransportAsync, self).__init__()
-
-    def connect(self):
-        """This method connects to RabbitMQ, returning the connection handle.
-        When the connection is established, the on_connection_open method
-        will be invoked by pika.
-
-        :rtype: pika.SelectConnection
+    def unbind_queue(self, exchange_name, queue_name, bind_key):
         """
-        self.logger.info("Connecting to AMQP broker @ [{}:{}] ...".format(
-            self._host, self._port))
-        connection = pika.SelectConnection(
-            pika.URLParameters(host=self.host, port=self.port),
-            on_open_callback=self.on_connection_open,
-            on_open_error_callback=self.on_connection_open_error,
-            on_close_callback=self.on_connection_closed,
-            stop_ioloop_on_close=False)
-        self._connection = connection
-        return connection
-
-    def on_connection_open(self, unused_connection):
-        """
-        This method is called by pika once the connection to RabbitMQ has
-        been established. It passes the handle to the connection object in
-        case we need it, but in this case, we'll just mark it unused.
-
-        :type unused_connection: pika.SelectConnection
-
-        """
-        self.logger.info('Connection established!')
-        self.open_channel()
-
-    def add_on_connection_close_callback(self):
-        """
-        This method adds an on close callback that will be invoked by pika
-        when RabbitMQ closes the connection to the publisher unexpectedly.
-
-        """
-        self.logger.info('Adding connection close callback')
-        self._connection.add_on_close_callback(self.on_connection_closed)
-
-    def on_connection_closed(self, connection, reply_code, reply_text):
-        """
-        This method is invoked by pika when the connection to RabbitMQ is
-        closed unexpectedly. Since it is unexpected, we will reconnect to
-        RabbitMQ if it disconnects.
-
-        :param pika.connection.Connection connection: The closed connection obj
-        :param int reply_code: The server provided reply_code if given
-        :param str reply_text: The server provided reply_text if given
-
-        """
-        if self._closing:
-            self._connection.ioloop.stop()
-        else:
-            self.logger.warning(
-                'Connection closed, reopening in 5 seconds: (%s) %s',
-                reply_code, reply_text)
-            self._connection.add_timeout(self.CONNECTION_TIMEOUT_SEC,
-                                         self.reconnect)
-
-    def on_connection_open_error(self, _unused_connection, err):
-        """This method is called by pika if the connection to RabbitMQ
-        can't be established.
-        :param pika.SelectConnection _unused_connection: The connection
-        :param Exception err: The error
-        """
-        self.logger.info('Connection open failed: %s', err)
-        self.reconnect()
-
-    def reconnect(self):
-        """
-        Will be invoked by the IOLoop timer if the connection is
-        closed. See the on_connection_closed method.
-
-        """
-        # This is the old connection IOLoop instance, stop its ioloop
-        self._connection.ioloop.stop()
-
-        if not self._closing:
-            # Create a new connection
-            self._connection = self.connect()
-            # There is now a new connection, needs a new ioloop to run
-            self._connection.ioloop.start()
-
-    def open_channel(self):
-        """
-        Open a new channel with RabbitMQ by issuing the Channel.Open RPC
-        command. When RabbitMQ responds that the channel is open, the
-        on_channel_open callback will be invoked by pika.
-
-        """
-        self.logger.info('Creating a new channel')
-        self._connection.channel(on_open_callback=self.on_channel_open)
-
-    def on_channel_open(self, channel):
-        """This method is invoked by pika when the channel has been opened.
-        The channel object is passed in so we can make use of it.
-
-        Since the channel is now open, we'll declare the exchange to use.
-        IMPLEMENT IN INHERITED CLASSES!!!!!!!!
-
-        :param pika.channel.Channel channel: The channel object
+        Remove the binding of a queue to an exchange.
 
-        """
-        self.logger.info('Channel opened')
-        self._channel = channel
-        self.add_on_channel_close_callback()
-
-
-    def add_on_channel_close_callback(self):
-        """This method tells pika to call the on_channel_closed method if
-        RabbitMQ unexpectedly closes the channel.
-
-        """
-        self.logger.info('Adding channel close callback')
-        self._channel.add_on_close_callback(self.on_channel_closed)
-
-    def on_channel_closed(self, channel, reply_code, reply_text):
-        """Invoked by pika when RabbitMQ unexpectedly closes the channel.
-        Channels are usually closed if you attempt to do something that
-        violates the protocol, such as re-declare an exchange or queue with
-        different parameters. In this case, we'll close the connection
-        to shutdown the object.
-
-        :param pika.channel.Channel: The closed channel
-        :param int reply_code: The numeric reason the channel was closed
-        :param str reply_text: The text reason the channel was closed
-
-        """
-        self.logger.warning('Channel %i was closed: (%s) %s', channel,
-                            reply_code, reply_text)
-        self._connection.close()
-
-    def create_exchange(self, exchange_name, exchange_type, on_declareok):
-        """
-        Declare/Create an exchange.
-
-        @param exchange_name: The name of the exchange
+        @param exchange_name: The name of the exchange (e.g. com.logging).
         @type exchange_name: string
 
-        @param exchange_type: the type of the exchange
-        @type exchange_type:
+        @param queue_name: The name of the queue.
+        @type queue_name: string
+
+        @param bind_key: The binding key name.
+        @type bind_key: string
         """
-        self.logger.debug('Declaring exchange {} [type={}]', exchange_name,
-                exchange_type)
-        cb = functools.partial(
-            on_declareok, userdata=exchange_name)
-        self._channel.exchange_declare(
-            exchange=exchange_name,
-            exchange_type=exchange_type,
-            callback=cb)
+        self.logger.info('Unsubscribed from topic: {}'.format(bind_key))
+        self._run_io(
+            self._channel.queue_unbind,
+            queue=queue_name, exchange=exchange_name, routing_key=bind_key)
 
-    def create_queue(self, queue_name=''):
-        result = self._channel.queue_declare(exclusive=True, queue=queue_name)
-        queue_name = result.method.queue
-        self._queue_name = queue_name
-        self.logger.info("Created queue [{}]".format(queue_name))
-        return queue_name
+    def close(self):
+        self._graceful_shutdown()
 
-    def _bind_queue(self, exchange_name, queue_name, bind_key):
-        try:
-            self._channel.queue_bind(
-                exchange=exchange_name, queue=queue_name, routing_key=bind_key)
-        except Exception:
-            self.logger.exception()
-
-    def set_qos(self, on_ok):
-        """This method sets up the consumer prefetch to only be delivered
-        one message at a time. The consumer must acknowledge this message
-        before RabbitMQ will deliver another one. You should experiment
-        with different prefetch values to achieve desired performance.
-        """
-        self._channel.basic_qos(
-            prefetch_count=self._prefetch_count, callback=on_ok)
+    def disconnect(self):
+        self._graceful_shutdown()
 
     def __del__(self):
-        self._connection.close()
+        # Construction may fail before the transport state is set up
+        if hasattr(self, '_connection'):
+            self._graceful_shutdown()
@@ -0,0 +1,322 @@
+# -*- coding: utf-8 -*-
+# Copyright (C) 2020  Panayiotou, Konstantinos <klpanagi@gmail.com>
+# Author: Panayiotou, Konstantinos <klpanagi@gmail.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+from __future__ import (
+    absolute_import,
+    division,
+    print_function,
+    unicode_literals
+)
+
+import functools
+import threading
+from collections import OrderedDict
+
+from .rate import monotonic
+
+
+class _Entry(object):
+    __slots__ = ['value', 'meta', 'size', 'expires']
+
+    def __init__(self, value, meta, size, expires):
+        self.value = value
+        self.meta = meta
+        self.size = size
+        self.expires = expires
+
+
+class ResponseCache(object):
+    """Client-side cache of RPC responses.
+
+    Entries are keyed by (rpc_name, request bytes) and expire after the TTL
+    of their RPC. The least recently used entries are evicted when the cache
+    exceeds `max_entries` or `max_bytes`. Concurrent identical calls are
+    coalesced: only the first one goes on the wire and the rest get futures
+    of their own, resolved when it completes. Error responses (dicts with
+    an `error` key) are not cached.
+
+    Cached responses are shared by all callers and must not be modified.
+    A cache can be shared by many RpcClient instances.
+
+    Args:
+        ttl (float): Default time-to-live of entries, in seconds. 0 disables
+            caching of the RPCs without a TTL of their own.
+        ttls (dict): Per-RPC time-to-live, by RPC name.
+        max_entries (int): Maximum number of entries.
+        max_bytes (int): Maximum size of the entries, in bytes of request
+            and response payload.
+    """
+
+    def __init__(self, ttl=60.0, ttls=None, max_entries=1024,
+                 max_bytes=16 * 1024 * 1024):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._ttls = dict(ttls or {})
+        self._entries = OrderedDict()
+        # key -> [future of the call, coalesced futures, True while the
+        # caller of the call waits on it]
+        self._inflight = {}
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    @property
+    def nbytes(self):
+        """Size of the cached entries, in bytes."""
+        return self._bytes
+
+    def set_ttl(self, rpc_name, ttl):
+        """Set the time-to-live of the responses of an RPC. 0 disables
+        caching of the RPC."""
+        self._ttls[rpc_name] = ttl
+
+    def ttl_for(self, rpc_name):
+        return self._ttls.get(rpc_name, self.ttl)
+
+    def stats(self):
+        """Cache statistics."""
+        lookups = self.hits + self.misses + self.coalesced
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'coalesced': self.coalesced,
+            'evictions': self.evictions,
+            'entries': len(self._entries),
+            'bytes': self._bytes,
+            'hit_ratio': (
+                (self.hits + self.coalesced) / lookups if lookups else 0.0)
+        }
+
+    def invalidate(self, rpc_name=None):
+        """Drop the cached responses of an RPC, or all of them."""
+        with self._lock:
+            for key in list(self._entries):
+                if rpc_name is None or key[0] == rpc_name:
+                    self._drop(key)
+
+    clear = invalidate
+
+    def acquire(self, key, factory):
+        """Get the future of a call.
+
+        Args:
+            key (tuple): (rpc_name, request bytes).
+            factory (function): Creates a new, unresolved, future.
+
+        Returns:
+            tuple: (future, leader). A resolved future on hit. When `leader`
+                is True the caller must send the request. Otherwise the
+                future is resolved once the call in flight completes, which
+                may be sent and received by another client.
+        """
+        now = monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                if entry.expires > now:
+                    # Move to the most recently used end
+                    del self._entries[key]
+                    self._entries[key] = entry
+                    self.hits += 1
+                    future = factory()
+                    future.meta = entry.meta
+                    future.set_result(entry.value)
+                    return future, False
+                self._drop(key)
+            inflight = self._inflight.get(key)
+            if inflight is not None:
+                self.coalesced += 1
+                future = factory()
+                inflight[1].append(future)
+                return future, False
+            self.misses += 1
+            future = factory()
+            self._inflight[key] = [future, [], True]
+        future.add_done_callback(functools.partial(self._on_done, key))
+        return future, True
+
+    def release(self, key, future):
+        """Stop waiting on a call. The call in flight is cancelled once no
+        caller waits on it."""
+        with self._lock:
+            inflight = self._inflight.get(key)
+            if inflight is None:
+                return False
+            if inflight[0] is future:
+                inflight[2] = False
+            elif future in inflight[1]:
+                inflight[1].remove(future)
+            else:
+                return False
+            leader = inflight[0]
+            abandoned = not inflight[2] and not inflight[1]
+        if future is not leader:
+            future.cancel()
+        if abandoned:
+            return leader.cancel()
+        return future is not leader
+
+    def _on_done(self, key, future):
+        with self._lock:
+            inflight = self._inflight.get(key)
+            followers = []
+            if inflight is not None and inflight[0] is future:
+                del self._inflight[key]
+                followers = inflight[1]
+            if not future.cancelled() and future.exception() is None:
+                self._store(key, future)
+        for follower in followers:
+            self._resolve(follower, future)
+
+    def _store(self, key, future):
+        value = future.result(timeout=0)
+        if isinstance(value, dict) and 'error' in value:
+            return
+        size = len(key[1]) + getattr(future, 'size', 0)
+        if size > self.max_bytes:
+            return
+        if key in self._entries:
+            self._drop(key)
+        self._entries[key] = _Entry(
+            value, future.meta, size, monotonic() + self.ttl_for(key[0]))
+        self._bytes += size
+        while len(self._entries) > self.max_entries or \
+                self._bytes > self.max_bytes:
+            self._drop(next(iter(self._entries)))
+            self.evictions += 1
+
+    @staticmethod
+    def _resolve(follower, future):
+        """Complete a coalesced future with the outcome of the call."""
+        if follower.done():
+            return
+        if future.cancelled():
+            follower.cancel()
+        elif future.exception() is not None:
+            follower.set_exception(future.exception())
+        else:
+            follower.meta = future.meta
+            follower.size = getattr(future, 'size', 0)
+            follower.set_result(future.result(timeout=0))
+
+    def _drop(self, key):
+        self._bytes -= self._entries.pop(key).size
+
+
+class ReplayCache(object):
+    """Server-side cache of recent RPC responses, by request id.
+
+    Used by RpcServer to answer duplicate requests (e.g. redelivered after a
+    connection drop, or retried by the client) with the response of the
+    original request, without handling them again. Entries expire after
+    `ttl` seconds; the least recently stored entries are evicted beyond
+    `max_entries` or `max_bytes`.
+
+    Args:
+        ttl (float): Time-to-live of entries, in seconds.
+        max_entries (int): Maximum number of entries.
+        max_bytes (int): Maximum size of the stored response payloads.
+    """
+
+    def __init__(self, ttl=300.0, max_entries=4096,
+                 max_bytes=64 * 1024 * 1024):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, request_id):
+        return self.get(request_id, count=False) is not None
+
+    @property
+    def nbytes(self):
+        """Size of the stored responses, in bytes."""
+        return self._bytes
+
+    def stats(self):
+        return {
+            'hits': self.hits,
+            'evictions': self.evictions,
+            'entries': len(self._entries),
+            'bytes': self._bytes
+        }
+
+    def get(self, request_id, count=True):
+        """Get the stored response of a request.
+
+        Returns:
+            tuple: (payload, content_type, content_encoding) or None.
+        """
+        with self._lock:
+            entry = self._entries.get(request_id)
+            if entry is None:
+                return None
+            if entry.expires <= monotonic():
+                self._drop(request_id)
+                return None
+            if count:
+                self.hits += 1
+            return entry.value
+
+    def put(self, request_id, reply):
+        """Store the response of a request.
+
+        Args:
+            request_id (str): The id of the request.
+            reply (tuple): (payload, content_type, content_encoding).
+        """
+        size = len(reply[0])
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            if request_id in self._entries:
+                self._drop(request_id)
+            self._entries[request_id] = _Entry(
+                reply, None, size, monotonic() + self.ttl)
+            self._bytes += size
+            # Entries are stored in expiration order
+            now = monotonic()
+            while self._entries:
+                oldest = next(iter(self._entries))
+                if len(self._entries) > self.max_entries or \
+                        self._bytes > self.max_bytes:
+                    self.evictions += 1
+                elif self._entries[oldest].expires > now:
+                    break
+                self._drop(oldest)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def _drop(self, request_id):
+        self._bytes -= self._entries.pop(request_id).size
@@ -28,6 +28,7 @@ import time
 from os import path
 import json
 import uuid
+from concurrent.futures import Future
 
 from .amqp_transport import (AMQPTransportSync,
                              Credentials,
@@ -35,6 +36,7 @@ from .amqp_transport import (AMQPTransportSync,
                              MessageProperties)
 
 from .pubsub import SubscriberSync
+from .serializer import serializer_registry
 
 
 class Event(object):
@@ -89,25 +91,33 @@ class EventEmitterOptions(object):
 
     Args:
         exchange (str): The exchange to send the events.
-        content_type (str): Set the MIME of the contents. Defaults to
+        content_type (str): Set the MIME of the contents. Selects the
+            serializer from the serializer registry. Defaults to
             `application/json`.
-        content_encoding (str): Set the encoding of the contents. Defaults
-            to `utf8`.
+        content_encoding (str): Unused. Events carry the content encoding
+            of the serializer selected by `content_type`.
+        confirm (bool): Enable publisher confirms. `send_event()` returns a
+            future per event, resolved when the broker confirms it.
+        confirm_window (int): Maximum number of unconfirmed events.
     """
 
     __slots__ = [
         'exchange',
         'exchange_type',
         'content_type',
-        'content_encoding'
+        'content_encoding',
+        'confirm',
+        'confirm_window'
     ]
 
     def __init__(self, exchange='events', content_type='application/json',
-                 content_encoding='utf8'):
+                 content_encoding='utf8', confirm=False, confirm_window=1000):
         self.exchange = exchange
         self.exchange_type = ExchangeTypes.Topic
         self.content_type = content_type
         self.content_encoding = content_encoding
+        self.confirm = confirm
+        self.confirm_window = confirm_window
 
 
 class EventEmitter(AMQPTransportSync):
@@ -132,11 +142,24 @@ class EventEmitter(AMQPTransportSync):
                 'options argument should be of type EventEmitterOptions'
             )
         self._name = str(uuid.uuid4())[0:5]
+        self._serializer = serializer_registry.resolve(
+            self.options.content_type)
         AMQPTransportSync.__init__(self, *args, **kwargs)
         self.connect()
         self.create_exchange(self.options.exchange, self.options.exchange_type)
+        if self.options.confirm:
+            self._enable_confirms(self.options.confirm_window)
 
     def send_event(self, event):
+        """Fire an event.
+
+        Args:
+            event (Event): The event to send.
+
+        Returns:
+            concurrent.futures.Future: Confirmation of the event if
+                publisher confirms are enabled, else None.
+        """
         if not isinstance(event, Event):
             raise TypeError(
                 'event argument should be of type Event'
@@ -145,24 +168,37 @@ class EventEmitter(AMQPTransportSync):
         ts = (1.0 * (time.time() + 0.5) * 1000)
         event._inc_seq()
         event._set_timestamp(ts)
+        _payload, _type, _encoding = serializer_registry.serialize(
+            event.to_dict(), self._serializer)
         msg_props = MessageProperties(
-            content_type=self.options.content_type,
-            content_encoding=self.options.content_encoding,
+            content_type=_type,
+            content_encoding=_encoding,
             timestamp=ts)
 
+        future = None
+        if self._confirms is not None:
+            self._wait_confirm_window()
+            self._confirms.reserve()
+            future = Future()
+
         self.connection.add_callback_threadsafe(
-            functools.partial(self._send, event, msg_props))
-        self.connection.process_data_events()
+            functools.partial(self._send, event, _payload, msg_props,
+                              future))
+        self.process_amqp_events()
+        return future
 
-    def _send(self, event, props):
+    def _send(self, event, payload, props, future=None):
         self.logger.debug('Sending event: <{}:{}>'.format(event.name,
                                                           event.payload)
                           )
+        if self._confirms is not None:
+            self._confirms.register(future)
+            self._confirms.reserve(-1)
         self._channel.basic_publish(
             exchange=self.options.exchange,
             routing_key=event.name,
             properties=props,
-            body=json.dumps(event.to_dict())
+            body=payload
         )
 
 
@@ -0,0 +1,922 @@
+# -*- coding: utf-8 -*-
+# Copyright (C) 2020  Panayiotou, Konstantinos <klpanagi@gmail.com>
+# Author: Panayiotou, Konstantinos <klpanagi@gmail.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""In-process, in-memory stand-in of an AMQP broker.
+
+Implements the subset of the broker and of pika's BlockingConnection and
+BlockingChannel used by this library: exchange/queue declaration, bindings,
+basic_publish/consume/ack/nack/qos, publisher confirms, direct reply-to and
+direct/fanout/topic routing. Meant for tests and for measuring the overhead
+of the library itself, without a broker and network in the loop:
+
+    broker = InMemoryBroker()
+    pub = PublisherSync('sensors.imu', connection_factory=broker.connect)
+
+Threading mirrors pika: callbacks of a connection (deliveries, timers and
+threadsafe callbacks) run on the thread processing its events, through
+`process_data_events()` or `start_consuming()`.
+
+Message TTL, queue expiration and exclusivity are not enforced.
+"""
+
+from __future__ import (
+    absolute_import,
+    division,
+    print_function,
+    unicode_literals
+)
+
+import copy
+import functools
+import heapq
+import itertools
+import threading
+import time
+import uuid
+from collections import deque
+
+import pika
+from pika import frame, spec
+
+from .amqp_transport import ConnectionParameters, ExchangeTypes
+
+REPLY_TO = 'amq.rabbitmq.reply-to'
+
+
+def _topic_match(pattern, key):
+    """Match a list of routing key words against a list of binding key
+    words, supporting `*` (exactly one word) and `#` (zero or more words).
+    """
+    if not pattern:
+        return not key
+    head = pattern[0]
+    if head == '#':
+        return any(_topic_match(pattern[1:], key[i:])
+                   for i in range(len(key) + 1))
+    if not key:
+        return False
+    if head == '*' or head == key[0]:
+        return _topic_match(pattern[1:], key[1:])
+    return False
+
+
+class _Exchange(object):
+    __slots__ = ['name', 'type', 'bindings']
+
+    def __init__(self, name, exchange_type):
+        self.name = name
+        self.type = exchange_type
+        # (queue_name, binding_key, binding_key_words)
+        self.bindings = []
+
+    def route(self, routing_key):
+        if self.type == ExchangeTypes.Fanout:
+            return set(b[0] for b in self.bindings)
+        if self.type == ExchangeTypes.Topic:
+            _words = routing_key.split('.')
+            return set(b[0] for b in self.bindings
+                       if _topic_match(b[2], _words))
+        return set(b[0] for b in self.bindings if b[1] == routing_key)
+
+
+class _Queue(object):
+    __slots__ = ['name', 'messages', 'consumers', 'max_length', 'overflow',
+                 'auto_delete', '_rr']
+
+    def __init__(self, name, arguments=None, auto_delete=False):
+        arguments = arguments or {}
+        self.name = name
+        self.messages = deque()
+        self.consumers = []
+        self.max_length = arguments.get('x-max-length')
+        self.overflow = arguments.get('x-overflow', 'drop-head')
+        self.auto_delete = auto_delete
+        self._rr = 0
+
+    def next_consumer(self):
+        """Round-robin over consumers with prefetch capacity."""
+        n = len(self.consumers)
+        for i in range(n):
+            consumer = self.consumers[(self._rr + i) % n]
+            if consumer.has_capacity():
+                self._rr = (self._rr + i + 1) % n
+                return consumer
+        return None
+
+
+class _Consumer(object):
+    __slots__ = ['tag', 'channel', 'queue', 'callback', 'auto_ack',
+                 'unacked', 'active']
+
+    def __init__(self, tag, channel, queue, callback, auto_ack):
+        self.tag = tag
+        self.channel = channel
+        self.queue = queue
+        self.callback = callback
+        self.auto_ack = auto_ack
+        self.unacked = 0
+        self.active = True
+
+    def has_capacity(self):
+        prefetch = self.channel._prefetch_count
+        return self.auto_ack or prefetch == 0 or self.unacked < prefetch
+
+
+class InMemoryBroker(object):
+    """In-memory AMQP broker.
+
+    Pass `connect` as the `connection_factory` of endpoints (or of a
+    SharedConnection) to connect them to this broker.
+
+    Args:
+        message_timestamps (bool): Add the `timestamp_in_ms` header to
+            published messages, like the rabbitmq_message_timestamp plugin.
+    """
+
+    def __init__(self, message_timestamps=False):
+        """Constructor."""
+        self.message_timestamps = message_timestamps
+        self._lock = threading.RLock()
+        self._exchanges = {}
+        self._queues = {}
+        # Direct reply-to token -> (channel, consumer)
+        self._reply_consumers = {}
+        self.published = 0
+        self.delivered = 0
+        for name, _type in (('', ExchangeTypes.Direct),
+                            ('amq.direct', ExchangeTypes.Direct),
+                            ('amq.fanout', ExchangeTypes.Fanout),
+                            ('amq.topic', ExchangeTypes.Topic),
+                            ('amq.rabbitmq.event', ExchangeTypes.Topic)):
+            self._exchanges[name] = _Exchange(name, _type)
+
+    def connect(self, conn_params=None):
+        """Connection factory. Returns a new InMemoryConnection."""
+        return InMemoryConnection(self, conn_params)
+
+    def connect_async(self, conn_params=None, **kwargs):
+        """Connection factory of the asyncio endpoints. Returns a new
+        InMemoryAsyncioConnection."""
+        return InMemoryAsyncioConnection(self, conn_params, **kwargs)
+
+    @property
+    def queues(self):
+        return list(self._queues.keys())
+
+    @property
+    def exchanges(self):
+        return list(self._exchanges.keys())
+
+    def queue_depth(self, queue_name):
+        """Number of ready (not delivered) messages of a queue."""
+        return len(self._queues[queue_name].messages)
+
+    # Operations below are invoked by InMemoryChannel
+
+    def _declare_exchange(self, name, exchange_type, passive):
+        with self._lock:
+            if name in self._exchanges:
+                return
+            if passive:
+                raise pika.exceptions.ChannelClosedByBroker(
+                    404, "NOT_FOUND - no exchange '{}'".format(name))
+            self._exchanges[name] = _Exchange(name, exchange_type)
+
+    def _delete_exchange(self, name):
+        with self._lock:
+            self._exchanges.pop(name, None)
+
+    def _declare_queue(self, name, passive, auto_delete, arguments):
+        with self._lock:
+            if not name:
+                name = 'amq.gen-{}'.format(uuid.uuid4().hex)
+            queue = self._queues.get(name)
+            if queue is None:
+                if passive:
+                    raise pika.exceptions.ChannelClosedByBroker(
+                        404, "NOT_FOUND - no queue '{}'".format(name))
+                queue = _Queue(name, arguments, auto_delete)
+                self._queues[name] = queue
+                # Every queue is bound to the default exchange
+                self._exchanges[''].bindings.append((name, name, None))
+            return queue
+
+    def _delete_queue(self, name):
+        with self._lock:
+            queue = self._queues.pop(name, None)
+            if queue is None:
+                return 0
+            for exchange in self._exchanges.values():
+                exchange.bindings = [b for b in exchange.bindings
+                                     if b[0] != name]
+            for consumer in queue.consumers:
+                consumer.active = False
+            return len(queue.messages)
+
+    def _bind(self, queue_name, exchange_name, routing_key):
+        with self._lock:
+            if queue_name not in self._queues:
+                raise pika.exceptions.ChannelClosedByBroker(
+                    404, "NOT_FOUND - no queue '{}'".format(queue_name))
+            if exchange_name not in self._exchanges:
+                raise pika.exceptions.ChannelClosedByBroker(
+                    404, "NOT_FOUND - no exchange '{}'".format(
+                        exchange_name))
+            binding = (queue_name, routing_key, routing_key.split('.'))
+            exchange = self._exchanges[exchange_name]
+            if binding not in exchange.bindings:
+                exchange.bindings.append(binding)
+
+    def _unbind(self, queue_name, exchange_name, routing_key):
+        with self._lock:
+            exchange = self._exchanges.get(exchange_name)
+            if exchange is not None:
+                exchange.bindings = [
+                    b for b in exchange.bindings
+                    if not (b[0] == queue_name and b[1] == routing_key)]
+
+    def _purge(self, queue_name):
+        with self._lock:
+            queue = self._queues[queue_name]
+            count = len(queue.messages)
+            queue.messages.clear()
+            return count
+
+    def _add_consumer(self, consumer):
+        with self._lock:
+            if consumer.queue == REPLY_TO:
+                self._reply_consumers[consumer.channel._reply_token] = \
+                    consumer
+                return
+            queue = self._queues.get(consumer.queue)
+            if queue is None:
+                raise pika.exceptions.ChannelClosedByBroker(
+                    404, "NOT_FOUND - no queue '{}'".format(consumer.queue))
+            queue.consumers.append(consumer)
+            self._dispatch(queue)
+
+    def _remove_consumer(self, consumer):
+        with self._lock:
+            consumer.active = False
+            if consumer.queue == REPLY_TO:
+                self._reply_consumers.pop(consumer.channel._reply_token, None)
+                return
+            queue = self._queues.get(consumer.queue)
+            if queue is None:
+                return
+            if consumer in queue.consumers:
+                queue.consumers.remove(consumer)
+            if queue.auto_delete and not queue.consumers:
+                self._delete_queue(queue.name)
+
+    def _publish(self, exchange_name, routing_key, properties, body):
+        """Route a message.
+
+        Returns:
+            bool: False if the message was rejected by a queue.
+        """
+        if self.message_timestamps:
+            properties = copy.copy(properties)
+            properties.headers = dict(properties.headers or {})
+            properties.headers['timestamp_in_ms'] = int(time.time() * 1000)
+        with self._lock:
+            self.published += 1
+            if exchange_name == '' and routing_key.startswith(REPLY_TO):
+                consumer = self._reply_consumers.get(
+                    routing_key[len(REPLY_TO) + 1:])
+                if consumer is not None:
+                    consumer.channel._deliver(
+                        consumer, None,
+                        (exchange_name, routing_key, properties, body, False))
+                    self.delivered += 1
+                return True
+            exchange = self._exchanges.get(exchange_name)
+            if exchange is None:
+                raise pika.exceptions.ChannelClosedByBroker(
+                    404, "NOT_FOUND - no exchange '{}'".format(exchange_name))
+            accepted = True
+            msg = (exchange_name, routing_key, properties, body, False)
+            for queue_name in exchange.route(routing_key):
+                queue = self._queues[queue_name]
+                if queue.max_length is not None and \
+                        len(queue.messages) >= queue.max_length:
+                    if queue.overflow == 'reject-publish':
+                        accepted = False
+                        continue
+                    if queue.max_length == 0:
+                        continue
+                    queue.messages.popleft()
+                queue.messages.append(msg)
+                self._dispatch(queue)
+            return accepted
+
+    def _requeue(self, queue_name, messages):
+        """Put messages back to the head of their queue, marked as
+        redelivered."""
+        with self._lock:
+            queue = self._queues.get(queue_name)
+            if queue is None:
+                return
+            for msg in reversed(messages):
+                queue.messages.appendleft(msg[:4] + (True,))
+            self._dispatch(queue)
+
+    def _dispatch_queue(self, queue_name):
+        with self._lock:
+            queue = self._queues.get(queue_name)
+            if queue is not None:
+                self._dispatch(queue)
+
+    def _dispatch(self, queue):
+        while queue.messages:
+            consumer = queue.next_consumer()
+            if consumer is None:
+                return
+            msg = queue.messages.popleft()
+            consumer.channel._deliver(consumer, queue.name, msg)
+            self.delivered += 1
+
+
+class InMemoryChannel(object):
+    """Stand-in of pika.BlockingChannel."""
+
+    def __init__(self, connection, channel_number):
+        self._connection = connection
+        self._broker = connection._broker
+        self._channel_number = channel_number
+        self._impl = self
+        self._open = True
+        self._consumers = {}
+        self._prefetch_count = 0
+        self._next_delivery_tag = 1
+        # delivery_tag -> (consumer, queue_name, message)
+        self._unacked = {}
+        self._reply_token = uuid.uuid4().hex
+        self._confirm_callback = None
+        self._confirming = False
+        self._publish_seq = 0
+
+    def __int__(self):
+        return self._channel_number
+
+    def __repr__(self):
+        return '<{} number={} open={}>'.format(
+            self.__class__.__name__, self._channel_number, self._open)
+
+    @property
+    def channel_number(self):
+        return self._channel_number
+
+    @property
+    def connection(self):
+        return self._connection
+
+    @property
+    def is_open(self):
+        return self._open
+
+    @property
+    def is_closed(self):
+        return not self._open
+
+    @property
+    def consumer_tags(self):
+        return list(self._consumers.keys())
+
+    def _raise_if_closed(self):
+        if not self._open:
+            raise pika.exceptions.ChannelWrongStateError('Channel is closed.')
+
+    def _close_by_broker(self, exc):
+        self._teardown()
+        raise exc
+
+    def _broker_call(self, fn, *args):
+        self._raise_if_closed()
+        try:
+            return fn(*args)
+        except pika.exceptions.ChannelClosedByBroker as exc:
+            self._close_by_broker(exc)
+
+    def _teardown(self):
+        self._open = False
+        for consumer in list(self._consumers.values()):
+            self._broker._remove_consumer(consumer)
+        self._consumers.clear()
+        self._requeue_unacked(list(self._unacked.keys()))
+        self._connection._remove_channel(self)
+
+    def close(self, reply_code=0, reply_text='Normal shutdown'):
+        if self._open:
+            self._teardown()
+
+    def _flush_output(self, *waiters):
+        self._connection._flush_output(*waiters)
+
+    # Declarations
+
+    def exchange_declare(self, exchange, exchange_type='direct',
+                         passive=False, durable=False, auto_delete=False,
+                         internal=False, arguments=None):
+        self._broker_call(self._broker._declare_exchange, exchange,
+                          exchange_type, passive)
+        return frame.Method(self._channel_number, spec.Exchange.DeclareOk())
+
+    def exchange_delete(self, exchange=None, if_unused=False):
+        self._broker_call(self._broker._delete_exchange, exchange)
+        return frame.Method(self._channel_number, spec.Exchange.DeleteOk())
+
+    def queue_declare(self, queue, passive=False, durable=False,
+                      exclusive=False, auto_delete=False, arguments=None):
+        _queue = self._broker_call(self._broker._declare_queue, queue,
+                                   passive, auto_delete, arguments)
+        return frame.Method(
+            self._channel_number,
+            spec.Queue.DeclareOk(_queue.name, len(_queue.messages),
+                                 len(_queue.consumers)))
+
+    def queue_delete(self, queue, if_unused=False, if_empty=False):
+        count = self._broker_call(self._broker._delete_queue, queue)
+        return frame.Method(self._channel_number,
+                            spec.Queue.DeleteOk(count))
+
+    def queue_purge(self, queue):
+        count = self._broker_call(self._broker._purge, queue)
+        return frame.Method(self._channel_number, spec.Queue.PurgeOk(count))
+
+    def queue_bind(self, queue, exchange, routing_key=None, arguments=None):
+        if routing_key is None:
+            routing_key = queue
+        self._broker_call(self._broker._bind, queue, exchange, routing_key)
+        return frame.Method(self._channel_number, spec.Queue.BindOk())
+
+    def queue_unbind(self, queue, exchange=None, routing_key=None,
+                     arguments=None):
+        if routing_key is None:
+            routing_key = queue
+        self._broker_call(self._broker._unbind, queue, exchange, routing_key)
+        return frame.Method(self._channel_number, spec.Queue.UnbindOk())
+
+    # Basic
+
+    def basic_qos(self, prefetch_size=0, prefetch_count=0, global_qos=False):
+        self._raise_if_closed()
+        self._prefetch_count = prefetch_count
+        for consumer in self._consumers.values():
+            self._broker._dispatch_queue(consumer.queue)
+
+    def confirm_delivery(self, ack_nack_callback=None, callback=None):
+        """Enable publisher confirms.
+
+        Supports both the BlockingChannel form (no arguments) and the
+        asynchronous form of the underlying pika channel
+        (ack_nack_callback and Confirm.SelectOk callback).
+        """
+        self._raise_if_closed()
+        self._confirming = True
+        self._confirm_callback = ack_nack_callback
+        if callback is not None:
+            self._connection._post_io(functools.partial(
+                callback, frame.Method(self._channel_number,
+                                       spec.Confirm.SelectOk())))
+
+    def basic_publish(self, exchange, routing_key, body, properties=None,
+                      mandatory=False):
+        self._raise_if_closed()
+        if isinstance(body, str):
+            body = body.encode('utf-8')
+        if properties is None:
+            properties = pika.BasicProperties()
+        if properties.reply_to == REPLY_TO:
+            if self._reply_token not in self._broker._reply_consumers:
+                self._close_by_broker(pika.exceptions.ChannelClosedByBroker(
+                    406, 'PRECONDITION_FAILED - fast reply consumer does '
+                    'not exist'))
+            properties = copy.copy(properties)
+            properties.reply_to = '{}.{}'.format(REPLY_TO, self._reply_token)
+        accepted = self._broker_call(self._broker._publish, exchange,
+                                     routing_key, properties, bytes(body))
+        if not self._confirming:
+            return
+        self._publish_seq += 1
+        if self._confirm_callback is None:
+            if not accepted:
+                raise pika.exceptions.NackError([])
+            return
+        method = spec.Basic.Ack if accepted else spec.Basic.Nack
+        self._connection._post_io(functools.partial(
+            self._confirm_callback,
+            frame.Method(self._channel_number,
+                         method(delivery_tag=self._publish_seq))))
+
+    def basic_consume(self, queue, on_message_callback, auto_ack=False,
+                      exclusive=False, consumer_tag=None, arguments=None):
+        self._raise_if_closed()
+        if consumer_tag is None:
+            consumer_tag = 'ctag{}.{}'.format(self._channel_number,
+                                              uuid.uuid4().hex)
+        consumer = _Consumer(consumer_tag, self, queue, on_message_callback,
+                             auto_ack)
+        self._consumers[consumer_tag] = consumer
+        try:
+            self._broker_call(self._broker._add_consumer, consumer)
+        except pika.exceptions.ChannelClosedByBroker:
+            self._consumers.pop(consumer_tag, None)
+            raise
+        return consumer_tag
+
+    def basic_cancel(self, consumer_tag):
+        consumer = self._consumers.pop(consumer_tag, None)
+        if consumer is not None:
+            self._broker._remove_consumer(consumer)
+        self._connection._wakeup()
+        return []
+
+    def _deliver(self, consumer, queue_name, msg):
+        """Called by the broker (with the broker lock held)."""
+        tag = self._next_delivery_tag
+        self._next_delivery_tag += 1
+        if not consumer.auto_ack:
+            consumer.unacked += 1
+            self._unacked[tag] = (consumer, queue_name, msg)
+        exchange, routing_key, properties, body, redelivered = msg
+        method = spec.Basic.Deliver(consumer.tag, tag, redelivered,
+                                    exchange, routing_key)
+
+        def _dispatch():
+            if consumer.active and self._open:
+                consumer.callback(self, method, properties, body)
+            elif not consumer.auto_ack:
+                self._requeue_unacked([tag])
+
+        self._connection._post_dispatch(_dispatch)
+
+    def _settle(self, delivery_tag, multiple):
+        """Remove settled deliveries. Returns the settled entries."""
+        with self._broker._lock:
+            if multiple:
+                tags = sorted(t for t in self._unacked
+                              if delivery_tag == 0 or t <= delivery_tag)
+            elif delivery_tag in self._unacked:
+                tags = [delivery_tag]
+            else:
+                self._close_by_broker(pika.exceptions.ChannelClosedByBroker(
+                    406, 'PRECONDITION_FAILED - unknown delivery tag '
+                    '{}'.format(delivery_tag)))
+            settled = [self._unacked.pop(t) for t in tags]
+            for consumer, _, _ in settled:
+                consumer.unacked -= 1
+        return settled
+
+    def _requeue_unacked(self, tags):
+        with self._broker._lock:
+            by_queue = {}
+            for tag in sorted(tags):
+                entry = self._unacked.pop(tag, None)
+                if entry is None:
+                    continue
+                consumer, queue_name, msg = entry
+                consumer.unacked -= 1
+                by_queue.setdefault(queue_name, []).append(msg)
+            for queue_name, messages in by_queue.items():
+                self._broker._requeue(queue_name, messages)
+
+    def basic_ack(self, delivery_tag=0, multiple=False):
+        self._raise_if_closed()
+        settled = self._settle(delivery_tag, multiple)
+        for queue_name in set(entry[1] for entry in settled):
+            self._broker._dispatch_queue(queue_name)
+
+    def basic_nack(self, delivery_tag=None, multiple=False, requeue=True):
+        self._raise_if_closed()
+        settled = self._settle(delivery_tag, multiple)
+        if requeue:
+            by_queue = {}
+            for _, queue_name, msg in settled:
+                by_queue.setdefault(queue_name, []).append(msg)
+            for queue_name, messages in by_queue.items():
+                self._broker._requeue(queue_name, messages)
+        else:
+            for queue_name in set(entry[1] for entry in settled):
+                self._broker._dispatch_queue(queue_name)
+
+    def basic_reject(self, delivery_tag=None, requeue=True):
+        self.basic_nack(delivery_tag, multiple=False, requeue=requeue)
+
+    def start_consuming(self):
+        while self._consumers and self._open:
+            self._connection.process_data_events(time_limit=None)
+
+    def stop_consuming(self, consumer_tag=None):
+        if consumer_tag is not None:
+            self.basic_cancel(consumer_tag)
+            return
+        for tag in list(self._consumers.keys()):
+            self.basic_cancel(tag)
+
+
+class _Params(object):
+    """Negotiated connection parameters."""
+
+    def __init__(self, conn_params):
+        self.channel_max = conn_params.channel_max
+
+
+class InMemoryConnection(object):
+    """Stand-in of pika.BlockingConnection, connected to an
+    InMemoryBroker."""
+
+    _channel_class = InMemoryChannel
+
+    def __init__(self, broker, conn_params=None):
+        """Constructor."""
+        if conn_params is None:
+            conn_params = ConnectionParameters()
+        self._broker = broker
+        self._impl = self
+        self.params = _Params(conn_params)
+        self._cond = threading.Condition()
+        # Protocol-level callbacks (e.g. publisher confirms), run by any
+        # I/O processing, including nested ones.
+        self._io_events = deque()
+        # User-level callbacks, run only by non-nested event dispatch.
+        self._dispatch_events = deque()
+        self._timers = []
+        self._timer_seq = itertools.count()
+        self._dispatching = False
+        self._channels = {}
+        self._channel_numbers = itertools.count(1)
+        self._open = True
+
+    def __repr__(self):
+        return '<{} open={} channels={}>'.format(
+            self.__class__.__name__, self._open, len(self._channels))
+
+    @property
+    def is_open(self):
+        return self._open
+
+    @property
+    def is_closed(self):
+        return not self._open
+
+    def channel(self, channel_number=None):
+        if not self._open:
+            raise pika.exceptions.ConnectionWrongStateError(
+                'Connection is closed.')
+        if len(self._channels) >= self.params.channel_max:
+            raise pika.exceptions.NoFreeChannels()
+        if channel_number is None:
+            channel_number = next(self._channel_numbers)
+        channel = self._channel_class(self, channel_number)
+        self._channels[channel_number] = channel
+        return channel
+
+    def _remove_channel(self, channel):
+        self._channels.pop(channel.channel_number, None)
+
+    def close(self, reply_code=200, reply_text='Normal shutdown'):
+        if not self._open:
+            raise pika.exceptions.ConnectionWrongStateError(
+                'Connection is already closed.')
+        for channel in list(self._channels.values()):
+            channel.close()
+        self._open = False
+        self._wakeup()
+
+    def _wakeup(self):
+        with self._cond:
+            self._cond.notify_all()
+
+    def _post_io(self, fn):
+        with self._cond:
+            self._io_events.append(fn)
+            self._cond.notify_all()
+
+    def _post_dispatch(self, fn):
+        with self._cond:
+            self._dispatch_events.append(fn)
+            self._cond.notify_all()
+
+    def add_callback_threadsafe(self, callback):
+        if not self._open:
+            raise pika.exceptions.ConnectionWrongStateError(
+                'BlockingConnection.add_callback_threadsafe() called on '
+                'closed or closing connection.')
+        self._post_dispatch(callback)
+
+    def call_later(self, delay, callback):
+        with self._cond:
+            timer = [time.time() + delay, next(self._timer_seq), callback]
+            heapq.heappush(self._timers, timer)
+            self._cond.notify_all()
+        return timer
+
+    def remove_timeout(self, timeout_id):
+        timeout_id[2] = None
+
+    def _run_io_events(self):
+        while True:
+            with self._cond:
+                if not self._io_events:
+                    return
+                fn = self._io_events.popleft()
+            fn()
+
+    def _pop_ready(self):
+        """Pop the next dispatch event or due timer callback."""
+        with self._cond:
+            if self._dispatch_events:
+                return self._dispatch_events.popleft()
+            while self._timers and self._timers[0][0] <= time.time():
+                callback = heapq.heappop(self._timers)[2]
+                if callback is not None:
+                    return callback
+        return None
+
+    def _has_ready(self):
+        if self._io_events:
+            return True
+        if self._dispatching:
+            return False
+        return bool(self._dispatch_events) or \
+            bool(self._timers and self._timers[0][0] <= time.time())
+
+    def _run_dispatch_events(self):
+        if self._dispatching:
+            return 0
+        count = 0
+        self._dispatching = True
+        try:
+            while True:
+                fn = self._pop_ready()
+                if fn is None:
+                    break
+                fn()
+                count += 1
+                self._run_io_events()
+        finally:
+            self._dispatching = False
+        return count
+
+    def process_data_events(self, time_limit=0):
+        """Dispatch pending events. Waits up to time_limit seconds (forever
+        if None) for events when none are pending."""
+        deadline = None if time_limit is None else time.time() + time_limit
+        while True:
+            self._run_io_events()
+            if self._run_dispatch_events() or not self._open:
+                return
+            with self._cond:
+                if self._has_ready():
+                    continue
+                timeout = None
+                if deadline is not None:
+                    timeout = deadline - time.time()
+                    if timeout <= 0:
+                        return
+                if self._timers and not self._dispatching:
+                    _next = self._timers[0][0] - time.time()
+                    timeout = _next if timeout is None else min(timeout,
+                                                                _next)
+                self._cond.wait(timeout)
+                if self._dispatching and not self._io_events:
+                    # Nested call; only protocol-level events are processed
+                    return
+
+    def _flush_output(self, *waiters):
+        """Process protocol-level events until any waiter is ready."""
+        while True:
+            self._run_io_events()
+            if not waiters or any(ready() for ready in waiters) or \
+                    not self._open:
+                return
+            with self._cond:
+                if not self._io_events:
+                    self._cond.wait(0.1)
+
+    def sleep(self, duration):
+        deadline = time.time() + duration
+        while True:
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                return
+            self.process_data_events(time_limit=remaining)
+
+
+def _async_method(method, reply=None):
+    """Wrap an InMemoryChannel method into the callback form of the
+    asynchronous pika channel. Errors raised by the broker close the
+    channel instead of propagating to the caller."""
+
+    @functools.wraps(method)
+    def _wrapper(self, *args, **kwargs):
+        callback = kwargs.pop('callback', None)
+        try:
+            result = method(self, *args, **kwargs)
+        except pika.exceptions.ChannelClosedByBroker:
+            # Reported to the close callbacks of the channel
+            return None
+        if callback is not None:
+            _frame = result if reply is None else frame.Method(
+                self._channel_number, reply(result))
+            self._connection._post_io(functools.partial(callback, _frame))
+        return result
+    return _wrapper
+
+
+class InMemoryAsyncioChannel(InMemoryChannel):
+    """Stand-in of pika.channel.Channel, as opened by AsyncioConnection."""
+
+    def __init__(self, connection, channel_number):
+        InMemoryChannel.__init__(self, connection, channel_number)
+        self._close_callbacks = []
+
+    def add_on_close_callback(self, callback):
+        self._close_callbacks.append(callback)
+
+    def _teardown(self, reason=None):
+        InMemoryChannel._teardown(self)
+        if reason is None:
+            reason = pika.exceptions.ChannelClosedByClient(
+                200, 'Normal shutdown')
+        for callback in self._close_callbacks:
+            self._connection._post_dispatch(
+                functools.partial(callback, self, reason))
+
+    def _close_by_broker(self, exc):
+        self._teardown(exc)
+        raise exc
+
+    exchange_declare = _async_method(InMemoryChannel.exchange_declare)
+    exchange_delete = _async_method(InMemoryChannel.exchange_delete)
+    queue_declare = _async_method(InMemoryChannel.queue_declare)
+    queue_delete = _async_method(InMemoryChannel.queue_delete)
+    queue_purge = _async_method(InMemoryChannel.queue_purge)
+    queue_bind = _async_method(InMemoryChannel.queue_bind)
+    queue_unbind = _async_method(InMemoryChannel.queue_unbind)
+    basic_qos = _async_method(InMemoryChannel.basic_qos,
+                              lambda _: spec.Basic.QosOk())
+    basic_consume = _async_method(InMemoryChannel.basic_consume,
+                                  spec.Basic.ConsumeOk)
+    basic_publish = _async_method(InMemoryChannel.basic_publish)
+    basic_ack = _async_method(InMemoryChannel.basic_ack)
+    basic_nack = _async_method(InMemoryChannel.basic_nack)
+
+
+class InMemoryAsyncioConnection(InMemoryConnection):
+    """Stand-in of pika's AsyncioConnection, connected to an
+    InMemoryBroker.
+
+    Deliveries and completion callbacks are scheduled on the event loop of
+    the connection, so messages published from other threads (e.g. by
+    endpoints on an InMemoryConnection) reach asyncio consumers safely.
+    """
+
+    _channel_class = InMemoryAsyncioChannel
+
+    def __init__(self, broker, conn_params=None, on_open_callback=None,
+                 on_open_error_callback=None, on_close_callback=None,
+                 custom_ioloop=None):
+        """Constructor."""
+        InMemoryConnection.__init__(self, broker, conn_params)
+        if custom_ioloop is None:
+            import asyncio
+            custom_ioloop = asyncio.get_event_loop()
+        self.ioloop = custom_ioloop
+        self._on_close_callback = on_close_callback
+        if on_open_callback is not None:
+            self.ioloop.call_soon(on_open_callback, self)
+
+    def _post_io(self, fn):
+        self.ioloop.call_soon_threadsafe(fn)
+
+    _post_dispatch = _post_io
+
+    def channel(self, channel_number=None, on_open_callback=None):
+        channel = InMemoryConnection.channel(self, channel_number)
+        if on_open_callback is not None:
+            self._post_io(functools.partial(on_open_callback, channel))
+        return channel
+
+    def close(self, reply_code=200, reply_text='Normal shutdown'):
+        InMemoryConnection.close(self, reply_code, reply_text)
+        if self._on_close_callback is not None:
+            self._post_dispatch(functools.partial(
+                self._on_close_callback, self,
+                pika.exceptions.ConnectionClosedByClient(reply_code,
+                                                         reply_text)))
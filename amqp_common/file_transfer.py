@@ -0,0 +1,493 @@
+# -*- coding: utf-8 -*-
+# Copyright (C) 2020  Panayiotou, Konstantinos <klpanagi@gmail.com>
+# Author: Panayiotou, Konstantinos <klpanagi@gmail.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+from __future__ import (
+    absolute_import,
+    division,
+    print_function,
+    unicode_literals
+)
+
+import functools
+import json
+import mmap
+import os
+import time
+import uuid
+import zlib
+from collections import OrderedDict
+
+from .amqp_transport import MessageProperties
+from .pubsub import PublisherSync, SubscriberSync
+from .serializer import ContentType
+
+
+class ChunkHeaders(object):
+    """Message headers of a file chunk."""
+    TRANSFER_ID = 'x-transfer-id'
+    FILE_NAME = 'x-file-name'
+    FILE_SIZE = 'x-file-size'
+    CHUNK_SIZE = 'x-chunk-size'
+    CHUNK_COUNT = 'x-chunk-count'
+    CHUNK_SEQ = 'x-chunk-seq'
+    CHUNK_OFFSET = 'x-chunk-offset'
+    CHUNK_CRC32 = 'x-chunk-crc32'
+
+
+def _is_int(value):
+    return isinstance(value, int) and not isinstance(value, bool)
+
+
+def _pwrite(fd, data, offset):
+    if hasattr(os, 'pwrite'):
+        return os.pwrite(fd, data, offset)
+    os.lseek(fd, offset, os.SEEK_SET)
+    return os.write(fd, data)
+
+
+class FileSender(PublisherSync):
+    """Streams files to a topic as fixed-size binary chunks.
+
+    Files are read through `mmap`, so only the chunks in flight are held in
+    memory. Publisher confirms are always enabled: the confirm window bounds
+    the number of chunks in flight and nacked chunks are re-sent, after a
+    delay that doubles on each retry.
+
+    Args:
+        topic (str): The topic uri to send files.
+        chunk_size (int): Chunk size in bytes.
+        confirm_window (int): Maximum number of unconfirmed chunks.
+        max_retries (int): Times to re-send chunks nacked by the broker.
+        retry_delay (float): Delay before the first re-send, in seconds.
+        max_retry_delay (float): Upper bound of the re-send delay.
+        **kwargs: The keyword arguments to pass to the base class
+            (PublisherSync).
+    """
+
+    def __init__(self, topic, chunk_size=256 * 1024, confirm_window=16,
+                 max_retries=3, retry_delay=0.1, max_retry_delay=5.0,
+                 *args, **kwargs):
+        """Constructor."""
+        self._chunk_size = chunk_size
+        self._max_retries = max_retries
+        self._retry_delay = retry_delay
+        self._max_retry_delay = max_retry_delay
+        kwargs['confirm'] = True
+        kwargs['confirm_window'] = confirm_window
+        PublisherSync.__init__(self, topic, *args, **kwargs)
+
+    @property
+    def chunk_size(self):
+        return self._chunk_size
+
+    def chunk_count(self, file_size):
+        """Number of chunks of a file of the given size."""
+        return max(1, -(-file_size // self._chunk_size))
+
+    def send_file(self, filepath, transfer_id=None, chunks=None,
+                  filename=None):
+        """Send a file. Blocks until all chunks are confirmed by the broker.
+
+        Args:
+            filepath (str): System Path of the file.
+            transfer_id (str): Id of the transfer. Pass the id of an
+                interrupted transfer to resume it.
+            chunks (list): Sequence numbers of the chunks to send. Defaults
+                to all. Use `FileReceiver.missing_chunks()` to resume.
+            filename (str): File name announced to the receiver. Defaults to
+                the base name of `filepath`.
+
+        Returns:
+            str: The transfer id.
+        """
+        if transfer_id is None:
+            transfer_id = str(uuid.uuid4())
+        if filename is None:
+            filename = os.path.basename(filepath)
+        file_size = os.path.getsize(filepath)
+        chunk_count = self.chunk_count(file_size)
+        pending = list(range(chunk_count)) if chunks is None else list(chunks)
+        self.logger.info('Sending file <{}> [size={}, chunks={}]'.format(
+            filepath, file_size, len(pending)))
+
+        with open(filepath, 'rb') as f:
+            _mm = None
+            if file_size > 0:
+                _mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            try:
+                for attempt in range(self._max_retries + 1):
+                    futures = [
+                        (seq, self._send_chunk(_mm, transfer_id, filename,
+                                               file_size, chunk_count, seq))
+                        for seq in pending
+                    ]
+                    self.wait_for_confirms()
+                    pending = [seq for seq, future in futures
+                               if future.exception() is not None]
+                    if not pending:
+                        break
+                    if attempt == self._max_retries:
+                        continue
+                    delay = self.retry_delay(attempt)
+                    self.logger.warning(
+                        '{} chunks of <{}> were nacked. Re-sending in '
+                        '{:.2f}s...'.format(len(pending), filepath, delay))
+                    self._sleep(delay)
+                else:
+                    raise IOError(
+                        'Could not send {} chunks of <{}>'.format(
+                            len(pending), filepath))
+            finally:
+                if _mm is not None:
+                    _mm.close()
+        return transfer_id
+
+    def retry_delay(self, attempt):
+        """Delay before re-sending the chunks nacked on an attempt."""
+        return min(self._retry_delay * 2 ** attempt, self._max_retry_delay)
+
+    def _sleep(self, duration):
+        # Keep serving the connection of the sender while waiting
+        if self.shared:
+            time.sleep(duration)
+        else:
+            self.connection.sleep(duration)
+
+    def _send_chunk(self, _mm, transfer_id, filename, file_size,
+                    chunk_count, seq):
+        offset = seq * self._chunk_size
+        if _mm is None:
+            body = b''
+        else:
+            body = _mm[offset:offset + self._chunk_size]
+        headers = {
+            ChunkHeaders.TRANSFER_ID: transfer_id,
+            ChunkHeaders.FILE_NAME: filename,
+            ChunkHeaders.FILE_SIZE: file_size,
+            ChunkHeaders.CHUNK_SIZE: self._chunk_size,
+            ChunkHeaders.CHUNK_COUNT: chunk_count,
+            ChunkHeaders.CHUNK_SEQ: seq,
+            ChunkHeaders.CHUNK_OFFSET: offset,
+            ChunkHeaders.CHUNK_CRC32: zlib.crc32(body) & 0xffffffff
+        }
+        msg_props = MessageProperties(
+            content_type=ContentType.raw_bytes,
+            headers=headers)
+        future = self._new_confirm_future()
+        self._schedule(
+            functools.partial(self._send_frames, [(body, msg_props, future)]),
+            True)
+        return future
+
+
+class FileTransfer(object):
+    """State of a file being received.
+
+    Args:
+        transfer_id (str): Id of the transfer.
+        path (str): Path of the destination file.
+        size (int): File size in bytes.
+        chunk_size (int): Chunk size in bytes.
+        chunk_count (int): Number of chunks.
+    """
+
+    __slots__ = ['transfer_id', 'path', 'size', 'chunk_size', 'chunk_count',
+                 'received', 'corrupted', '_fd']
+
+    def __init__(self, transfer_id, path, size, chunk_size, chunk_count):
+        self.transfer_id = transfer_id
+        self.path = path
+        self.size = size
+        self.chunk_size = chunk_size
+        self.chunk_count = chunk_count
+        self.received = set()
+        self.corrupted = 0
+        self._fd = None
+
+    @classmethod
+    def from_progress(cls, progress_path):
+        """Restore an interrupted transfer from its saved progress.
+
+        Returns:
+            FileTransfer: The transfer, not yet opened, or None if the
+                progress file or its partial file is missing or invalid.
+        """
+        try:
+            with open(progress_path) as f:
+                progress = json.load(f)
+            transfer = cls(progress['transfer_id'],
+                           progress_path[:-len('.part.json')],
+                           progress['size'], progress['chunk_size'],
+                           progress['chunk_count'])
+            received = set(progress['received'])
+        except (IOError, OSError, ValueError, TypeError, KeyError):
+            return None
+        if not transfer.valid or not os.path.exists(transfer.part_path) or \
+                not all(_is_int(seq) and 0 <= seq < transfer.chunk_count
+                        for seq in received):
+            return None
+        transfer.received = received
+        return transfer
+
+    @property
+    def part_path(self):
+        return self.path + '.part'
+
+    @property
+    def is_open(self):
+        return self._fd is not None
+
+    @property
+    def progress_path(self):
+        return self.path + '.part.json'
+
+    @property
+    def complete(self):
+        return len(self.received) == self.chunk_count
+
+    @property
+    def valid(self):
+        """True if size, chunk size and chunk count are consistent."""
+        return _is_int(self.size) and _is_int(self.chunk_size) and \
+            _is_int(self.chunk_count) and self.size >= 0 and \
+            self.chunk_size > 0 and \
+            self.chunk_count == max(1, -(-self.size // self.chunk_size))
+
+    def valid_chunk(self, seq, offset, length):
+        """True if a chunk of the given length fits in the announced file
+        at its place in the sequence."""
+        if not _is_int(seq) or not _is_int(offset) or \
+                not 0 <= seq < self.chunk_count or \
+                offset != seq * self.chunk_size:
+            return False
+        return length == min(self.chunk_size, self.size - offset)
+
+    @property
+    def missing(self):
+        """Sequence numbers of the chunks not yet received."""
+        return [seq for seq in range(self.chunk_count)
+                if seq not in self.received]
+
+    def open(self):
+        """Open the partial file, restoring the progress of a previous
+        interrupted run of the same transfer."""
+        progress = self._load_progress()
+        if progress is not None and os.path.exists(self.part_path):
+            self.received = set(progress['received'])
+        self._fd = os.open(self.part_path, os.O_WRONLY | os.O_CREAT, 0o644)
+        os.ftruncate(self._fd, self.size)
+
+    def write_chunk(self, seq, offset, data):
+        if seq in self.received:
+            return
+        _pwrite(self._fd, data, offset)
+        self.received.add(seq)
+
+    def save_progress(self):
+        with open(self.progress_path, 'w') as f:
+            json.dump({
+                'transfer_id': self.transfer_id,
+                'size': self.size,
+                'chunk_size': self.chunk_size,
+                'chunk_count': self.chunk_count,
+                'received': sorted(self.received)
+            }, f)
+
+    def _load_progress(self):
+        try:
+            with open(self.progress_path) as f:
+                progress = json.load(f)
+        except (IOError, OSError, ValueError):
+            return None
+        if progress.get('transfer_id') != self.transfer_id or \
+                progress.get('size') != self.size or \
+                progress.get('chunk_size') != self.chunk_size:
+            return None
+        return progress
+
+    def finalize(self):
+        """Flush and move the completed file to its destination."""
+        os.fsync(self._fd)
+        self.close()
+        os.rename(self.part_path, self.path)
+        if os.path.exists(self.progress_path):
+            os.remove(self.progress_path)
+
+    def close(self):
+        if self._fd is not None:
+            os.close(self._fd)
+            self._fd = None
+
+
+class FileReceiver(SubscriberSync):
+    """Receives files streamed by a FileSender.
+
+    Chunks are written straight into the destination file with `pwrite`,
+    without decoding or buffering. Each chunk is checked against its CRC32;
+    corrupted chunks are dropped and reported by `missing_chunks()`.
+    Progress is saved next to the partial file, so a transfer interrupted on
+    either side can be resumed by re-sending the missing chunks with the same
+    transfer id. The progress saved in `dest_dir` is loaded on construction.
+    Chunks of the last `FINISHED_HISTORY` completed transfers, re-sent after
+    completion, are dropped.
+
+    Args:
+        topic (str): The topic uri to receive files.
+        dest_dir (str): Directory to store received files.
+        on_complete (function): Called with the FileTransfer when a file
+            has been received.
+        checkpoint_interval (int): Save progress every that many chunks.
+        queue_size (int): The maximum queue size, in chunks. Overflowing
+            chunks are rejected, so that the sender re-sends them.
+        **kwargs: The keyword arguments to pass to the base class
+            (SubscriberSync).
+    """
+
+    #: Number of completed transfer ids remembered.
+    FINISHED_HISTORY = 1024
+
+    def __init__(self, topic, dest_dir='.', on_complete=None,
+                 checkpoint_interval=64, queue_size=256, *args, **kwargs):
+        """Constructor."""
+        self._dest_dir = dest_dir
+        self._checkpoint_interval = checkpoint_interval
+        self._transfers = {}
+        self._finished = OrderedDict()
+        self.on_complete = on_complete
+        kwargs['queue_size'] = queue_size
+        kwargs.setdefault('overflow', 'reject-publish')
+        SubscriberSync.__init__(self, topic, *args, **kwargs)
+        self._load_transfers()
+
+    def _load_transfers(self):
+        """Restore the transfers interrupted in a previous run."""
+        try:
+            names = os.listdir(self._dest_dir)
+        except OSError:
+            return
+        for name in names:
+            if not name.endswith('.part.json'):
+                continue
+            transfer = FileTransfer.from_progress(
+                os.path.join(self._dest_dir, name))
+            if transfer is None:
+                continue
+            self._transfers[transfer.transfer_id] = transfer
+            self.logger.info(
+                'Restored transfer of <{}> [{}/{} chunks]'.format(
+                    transfer.path, len(transfer.received),
+                    transfer.chunk_count))
+
+    @property
+    def transfers(self):
+        """Transfers in progress, by transfer id."""
+        return dict(self._transfers)
+
+    def missing_chunks(self, transfer_id):
+        """Sequence numbers of the chunks of a transfer not yet received.
+
+        Returns:
+            list: Missing chunks, empty if the transfer has completed, or
+                None if the transfer is unknown.
+        """
+        transfer = self._transfers.get(transfer_id)
+        if transfer is None:
+            return [] if transfer_id in self._finished else None
+        return transfer.missing
+
+    def _open_transfer(self, headers):
+        transfer_id = headers[ChunkHeaders.TRANSFER_ID]
+        # Never trust paths coming from the wire
+        filename = os.path.basename(headers[ChunkHeaders.FILE_NAME])
+        transfer = FileTransfer(
+            transfer_id,
+            os.path.join(self._dest_dir, filename),
+            headers[ChunkHeaders.FILE_SIZE],
+            headers[ChunkHeaders.CHUNK_SIZE],
+            headers[ChunkHeaders.CHUNK_COUNT])
+        if not transfer.valid:
+            self.logger.warning(
+                'Dropping chunk of <{}> with invalid size headers'.format(
+                    transfer.path))
+            return None
+        transfer.open()
+        self._transfers[transfer_id] = transfer
+        self.logger.info('Receiving file <{}> [size={}, chunks={}]'.format(
+            transfer.path, transfer.size, transfer.chunk_count))
+        return transfer
+
+    def _on_msg_callback_wrapper(self, ch, method, properties, body):
+        headers = properties.headers
+        try:
+            transfer_id = headers[ChunkHeaders.TRANSFER_ID]
+            seq = headers[ChunkHeaders.CHUNK_SEQ]
+            offset = headers[ChunkHeaders.CHUNK_OFFSET]
+            crc = headers[ChunkHeaders.CHUNK_CRC32]
+        except (TypeError, KeyError):
+            self.logger.warning('Dropping message without chunk headers')
+            return
+
+        if transfer_id in self._finished:
+            self.logger.debug(
+                'Dropping chunk {} of completed transfer {}'.format(
+                    seq, transfer_id))
+            return
+
+        try:
+            transfer = self._transfers.get(transfer_id)
+            if transfer is None:
+                transfer = self._open_transfer(headers)
+                if transfer is None:
+                    return
+            elif not transfer.is_open:
+                # Restored from the progress of a previous run
+                transfer.open()
+            if not transfer.valid_chunk(seq, offset, len(body)):
+                transfer.corrupted += 1
+                self.logger.warning(
+                    'Chunk {} of <{}> is out of bounds [offset={}, '
+                    'length={}]'.format(seq, transfer.path, offset,
+                                        len(body)))
+                return
+            if zlib.crc32(body) & 0xffffffff != crc:
+                transfer.corrupted += 1
+                self.logger.warning(
+                    'Chunk {} of <{}> failed integrity check'.format(
+                        seq, transfer.path))
+                return
+            transfer.write_chunk(seq, offset, body)
+        except Exception:
+            self.logger.error('Could not write chunk', exc_info=True)
+            return
+
+        if transfer.complete:
+            transfer.finalize()
+            del self._transfers[transfer_id]
+            self._finished[transfer_id] = None
+            if len(self._finished) > self.FINISHED_HISTORY:
+                self._finished.popitem(last=False)
+            self.logger.info('Received file <{}>'.format(transfer.path))
+            if self.on_complete is not None:
+                self.on_complete(transfer)
+        elif len(transfer.received) % self._checkpoint_interval == 0:
+            transfer.save_progress()
+
+    def close(self):
+        for transfer in self._transfers.values():
+            transfer.save_progress()
+            transfer.close()
+        return super(FileReceiver, self).close()
@@ -23,16 +23,21 @@ from __future__ import (
 )
 
 import functools
-from threading import Thread, Semaphore
-from collections import deque
+import threading
+from threading import Thread, Lock
+from collections import OrderedDict, deque
 import json
 import time
+from concurrent.futures import (
+    Future, ThreadPoolExecutor, ProcessPoolExecutor
+)
 
 from .amqp_transport import (AMQPTransportSync, Credentials, ExchangeTypes,
-                             MessageProperties)
-from .rate import Rate
+                             MessageProperties, DeliveryMeta)
+from .rate import Rate, RateEstimator, monotonic
 from .msg import Message
-from .serializer import JSONSerializer, ContentType
+from .serializer import serializer_registry
+from .topics import TopicTrie
 
 
 class PublisherSync(AMQPTransportSync):
@@ -41,72 +46,282 @@ class PublisherSync(AMQPTransportSync):
     Args:
         topic (str): The topic uri to publish data.
         exchange (str): The exchange to publish data.
+        serializer (Serializer|str): Serializer of structured data, or its
+            content type. Defaults to the default of the serializer
+            registry (JSON).
+        batch_size (int): Enable auto-batching. Messages passed to
+            `publish()` are buffered and sent together once `batch_size`
+            messages are pending.
+        batch_interval (float): Enable auto-batching. Pending messages are
+            sent at most `batch_interval` seconds after the first one was
+            buffered. The deadline is served while connection events are
+            processed (see `process_amqp_events()`).
+        confirm (bool): Enable publisher confirms. Publishing methods
+            return a future per message, resolved when the broker confirms
+            the message.
+        confirm_window (int): Maximum number of unconfirmed messages.
+            Publishing blocks while the window is full.
         **kwargs: The keyword arguments to pass to the base class
             (AMQPTransportSync).
     """
 
-    _SERIALIZER = JSONSerializer
+    _SERIALIZER = None
 
     def __init__(self, topic, exchange='amq.topic', serializer=None,
-                 *args, **kwargs):
+                 batch_size=None, batch_interval=None, confirm=False,
+                 confirm_window=1000, *args, **kwargs):
         """Constructor."""
         self._topic_exchange = exchange
         self._topic = topic
         self._name = topic
         if serializer is not None:
-            self._SERIALIZER = serializer
+            self._SERIALIZER = serializer_registry.resolve(serializer)
         AMQPTransportSync.__init__(self, *args, **kwargs)
+        self._batch_size = batch_size
+        self._batch_interval = batch_interval
+        self._batch = []
+        self._batch_t0 = None
+        self._batch_lock = Lock()
+        self._batch_timer = None
+        self._rate = None
         self.connect()
         self.create_exchange(self._topic_exchange, ExchangeTypes.Topic)
+        if confirm:
+            self._enable_confirms(confirm_window)
+
+    @property
+    def batching(self):
+        """True if auto-batching is enabled."""
+        return self._batch_size is not None or \
+            self._batch_interval is not None
+
+    @property
+    def pending(self):
+        """Number of buffered messages waiting for the next flush."""
+        return len(self._batch)
+
+    @property
+    def rate(self):
+        """The Rate of `pub_loop()`. Exposes the achieved rate, overruns and
+        jitter. None if `pub_loop()` has not been called."""
+        return self._rate
 
     def publish(self, msg, thread_safe=True):
         """ Publish message once.
 
+        In auto-batching mode the message is buffered until the batch is
+        flushed.
+
         Args:
             msg (dict|Message|str|bytes): Message/Data to publish.
+
+        Returns:
+            concurrent.futures.Future: Confirmation of the message if
+                publisher confirms are enabled, else None.
         """
+        future = self._new_confirm_future(thread_safe)
+        if self.batching:
+            _payload, msg_props = self._serialize(msg)
+            self._enqueue((_payload, msg_props, future), thread_safe)
+            return future
         if isinstance(msg, Message):
             data = msg.to_dict()
         else:
             data = msg
 
-        if thread_safe:
-            self.connection.add_callback_threadsafe(
-                functools.partial(self._send_data, data))
+        self._schedule(functools.partial(self._send_data, data, future),
+                       thread_safe)
+        return future
+
+    def publish_many(self, msgs, thread_safe=True):
+        """Publish many messages at once.
+
+        Messages are serialized by the caller thread and written to the
+        connection in one go, using a single wakeup of the connection
+        thread and a single flush of the output buffer.
+
+        Args:
+            msgs (iterable): Messages/Data to publish.
+
+        Returns:
+            list: Confirmation futures of the messages if publisher confirms
+                are enabled, else None.
+        """
+        frames = []
+        chunk = []
+        for msg in msgs:
+            future = None
+            if self._confirms is not None:
+                if not self._confirms.has_capacity():
+                    # Send the messages that fit in the window and wait for
+                    # their confirms
+                    self._send_chunk(chunk, thread_safe)
+                    chunk = []
+                    self._wait_confirm_window()
+                self._confirms.reserve()
+                future = Future()
+            frame = self._serialize(msg) + (future,)
+            chunk.append(frame)
+            frames.append(frame)
+        if not frames:
+            return None
+        self._send_chunk(chunk, thread_safe)
+        if self._confirms is None:
+            return None
+        return [frame[2] for frame in frames]
+
+    def _send_chunk(self, frames, thread_safe):
+        if frames:
+            self._schedule(functools.partial(self._send_frames, frames),
+                           thread_safe)
+
+    def flush(self, thread_safe=True):
+        """Send all messages buffered by auto-batching."""
+        frames = self._take_batch()
+        if frames:
+            self._schedule(functools.partial(self._flush_frames, frames),
+                           thread_safe)
+
+    def wait_for_confirms(self, timeout=None):
+        """Flush the messages buffered by auto-batching and wait until the
+        broker has confirmed all published messages.
+
+        Args:
+            timeout (float): Seconds to wait. None waits forever.
+
+        Returns:
+            bool: True if all messages were confirmed.
+        """
+        self.flush()
+        return super(PublisherSync, self).wait_for_confirms(timeout)
+
+    def close(self):
+        if self._batch:
+            self.flush()
+        super(PublisherSync, self).close()
+
+    def _new_confirm_future(self, thread_safe=True):
+        """Reserve a confirm window slot for a message about to be
+        published, blocking while the window is full."""
+        if self._confirms is None:
+            return None
+        if not self._confirms.has_capacity():
+            # Buffered messages hold window slots. Send them before waiting
+            # for their confirms.
+            self.flush(thread_safe)
+            self._wait_confirm_window()
+        self._confirms.reserve()
+        return Future()
+
+    def _schedule(self, fn, thread_safe):
+        if thread_safe or self.shared:
+            self.connection.add_callback_threadsafe(fn)
         else:
-            self._send_data(data)
-        self.connection.process_data_events()
-
-    def _send_data(self, data):
-        _payload = None
-        _encoding = None
-        _type = None
-
-        if isinstance(data, dict):
-            _payload = self._SERIALIZER.serialize(data).encode('utf-8')
-            _encoding = self._SERIALIZER.CONTENT_ENCODING
-            _type = self._SERIALIZER.CONTENT_TYPE
-        elif isinstance(data, str):
-            _type = 'text/plain'
-            _encoding = 'utf8'
-            _payload = data
-        elif isinstance(data, bytes):
-            _type = 'application/octet-stream'
-            _encoding = 'utf8'
-            _payload = data
+            fn()
+        self.process_amqp_events()
+
+    def _enqueue(self, frame, thread_safe):
+        with self._batch_lock:
+            self._batch.append(frame)
+            first = len(self._batch) == 1
+            if first:
+                self._batch_t0 = time.time()
+            full = self._batch_size is not None and \
+                len(self._batch) >= self._batch_size
+            expired = self._batch_interval is not None and \
+                time.time() - self._batch_t0 >= self._batch_interval
+        if full or expired:
+            self.flush(thread_safe)
+        elif first and self._batch_interval is not None:
+            # Arm the deadline timer on the connection thread
+            self.connection.add_callback_threadsafe(self._arm_batch_timer)
+
+    def _take_batch(self):
+        with self._batch_lock:
+            frames = self._batch
+            self._batch = []
+            self._batch_t0 = None
+        return frames
+
+    def _arm_batch_timer(self):
+        with self._batch_lock:
+            t0 = self._batch_t0
+        # The batch may have been flushed before the timer was armed
+        if t0 is None or self._batch_timer is not None:
+            return
+        delay = max(self._batch_interval - (time.time() - t0), 0)
+        self._batch_timer = self.connection.call_later(
+            delay, self._on_batch_timer)
+
+    def _on_batch_timer(self):
+        self._batch_timer = None
+        frames = self._take_batch()
+        if frames:
+            self._send_frames(frames)
+
+    def _flush_frames(self, frames):
+        """Send a flushed batch and cancel its deadline timer. Must run on
+        the connection thread."""
+        if self._batch_timer is not None:
+            self.connection.remove_timeout(self._batch_timer)
+            self._batch_timer = None
+        self._send_frames(frames)
+
+    def _serialize(self, data):
+        """Serialize a message.
+
+        Returns:
+            tuple: (payload, properties)
+        """
+        if isinstance(data, Message):
+            data = data.to_dict()
+        _payload, _type, _encoding = serializer_registry.serialize(
+            data, self._SERIALIZER)
 
         msg_props = MessageProperties(
             content_type=_type,
             content_encoding=_encoding,
             message_id=0,
         )
+        return _payload, msg_props
 
+    def _send_data(self, data, future=None):
+        _payload, msg_props = self._serialize(data)
+        if self._confirms is not None:
+            self._confirms.register(future)
+            self._confirms.reserve(-1)
         self._channel.basic_publish(
             exchange=self._topic_exchange,
             routing_key=self._topic,
             properties=msg_props,
             body=_payload)
-        self.logger.debug('Sent message to topic <{}>'.format(self._topic))
+        self.logger.debug('Sent message to topic <%s>', self._topic)
+
+    def _send_frames(self, frames):
+        """Publish serialized messages with a single flush of the output
+        buffer. Must run on the connection thread.
+
+        Args:
+            frames (list): (payload, properties, future) tuples. With
+                publisher confirms, each frame holds a reserved slot of the
+                confirm window.
+        """
+        # BlockingChannel.basic_publish() flushes the output buffer on each
+        # call. Queue the frames on the underlying channel and flush once.
+        _impl = self._channel._impl
+        for _payload, msg_props, future in frames:
+            if self._confirms is not None:
+                self._confirms.register(future)
+            _impl.basic_publish(
+                exchange=self._topic_exchange,
+                routing_key=self._topic,
+                body=_payload,
+                properties=msg_props)
+        if self._confirms is not None:
+            self._confirms.reserve(-len(frames))
+        self._channel._flush_output()
+        self.logger.debug('Sent %d messages to topic <%s>', len(frames),
+                          self._topic)
 
     def pub_loop(self, data_bind, hz):
         """Publish message frequenntly.
@@ -125,7 +340,10 @@ class PublisherSync(AMQPTransportSync):
         while True:
             try:
                 self.publish(data_bind)
-                self._rate.sleep()
+                if not self._rate.sleep():
+                    self.logger.debug(
+                        'pub_loop overrun: publishing slower than %s Hz',
+                        hz)
             except KeyboardInterrupt:
                 self.logger.exception('Process received keyboard interrupt')
                 break
@@ -144,17 +362,60 @@ class SubscriberSync(AMQPTransportSync):
         message_ttl (int): Message Time-to-Live as specified by AMQP.
         overflow (str): queue overflow behavior. Specified by AMQP Protocol.
             Defaults to `drop-head`.
+        conflate (bool): Latest-value-only mode. Of the messages received
+            since the last callback, only the newest per routing key is
+            decoded and passed to the callback; older ones are dropped.
+        conflate_hz (float): Maximum rate of callbacks per routing key in
+            conflation mode. Defaults to no limit.
+        on_batch (function): Batch mode. Called with a list of decoded
+            messages and the list of their DeliveryMeta, instead of
+            `on_message`. Each batch is acked with a single multiple-ack.
+        batch_size (int): Maximum number of messages per batch.
+        batch_interval (float): Maximum time, in seconds, to wait for a
+            batch to fill up after its first message.
+        reliable (bool): At-least-once mode. Deliveries are acked once the
+            callback returns and nacked when it raises.
+        manual_ack (bool): Reliable mode where the application acks each
+            message itself, with `ack(meta)` or `nack(meta)`, from any
+            thread.
+        requeue_on_error (bool): Requeue messages nacked on callback errors.
+            Messages that fail again after redelivery are not requeued.
+        workers (int): Number of workers executing `on_message`. When 0
+            (default) the callback runs on the connection thread. Messages
+            are decoded on the connection thread and acked once handled, so
+            the prefetch window bounds the messages queued to the workers.
+        executor (str): Worker type, `thread` or `process`. Process workers
+            require a picklable `on_message` and receive a DeliveryMeta
+            without channel and method.
+        ordered (bool): Preserve the order of messages with the same routing
+            key, by hashing routing keys to workers. Otherwise messages are
+            handled by any free worker.
+        prefetch_count (int): Maximum number of unacknowledged deliveries.
+            Defaults to no limit, to `CONFLATE_PREFETCH` in conflation
+            mode (where it must be positive), to twice the batch size in batch mode, to
+            `RELIABLE_PREFETCH` in reliable mode and to
+            `WORKER_PREFETCH` per worker in worker mode.
         **kwargs: The keyword arguments to pass to the base class
             (AMQPTransportSync).
     """
 
     FREQ_CALC_SAMPLES_MAX = 100
+    CONFLATE_PREFETCH = 100
+    RELIABLE_PREFETCH = 100
+    WORKER_PREFETCH = 4
+
+    onmessage = None
 
     def __init__(self, topic, on_message=None, exchange='amq.topic',
                  queue_size=10, message_ttl=60000, overflow='drop-head',
+                 conflate=False, conflate_hz=None, on_batch=None,
+                 batch_size=100, batch_interval=0.1, reliable=False,
+                 manual_ack=False, requeue_on_error=True, workers=0,
+                 executor='thread', ordered=True, prefetch_count=None,
                  *args, **kwargs):
         """Constructor."""
-        self._name = topic
+        if not hasattr(self, '_name'):
+            self._name = topic
         AMQPTransportSync.__init__(self, *args, **kwargs)
         self._topic = topic
         self._topic_exchange = exchange
@@ -162,6 +423,64 @@ class SubscriberSync(AMQPTransportSync):
         self._queue_size = queue_size
         self._message_ttl = message_ttl
         self._overflow = overflow
+        if conflate and on_batch is not None:
+            raise ValueError('Conflation and batch modes are exclusive')
+        if on_batch is not None and batch_size < 1:
+            raise ValueError('Batch size must be >= 1')
+        if on_batch is not None and \
+                (batch_interval is None or batch_interval <= 0):
+            raise ValueError('Batch interval must be > 0')
+        if conflate and prefetch_count is not None and prefetch_count < 1:
+            # Deliveries are acked in bulk, once half of the window is in use
+            raise ValueError('Conflation mode requires a prefetch count >= 1')
+        if workers < 0:
+            raise ValueError('Number of workers must be >= 0')
+        if executor not in ('thread', 'process'):
+            raise ValueError(
+                'Executor must be either "thread" or "process"')
+        if workers and (conflate or on_batch is not None or manual_ack):
+            raise ValueError('Workers can not be used in conflation, batch '
+                             'or manual ack mode')
+        self._conflate = conflate
+        self._conflate_period = 1.0 / conflate_hz if conflate_hz else 0.0
+        self.on_batch = on_batch
+        self._batch_size = batch_size
+        self._batch_interval = batch_interval
+        if prefetch_count is None:
+            if conflate:
+                prefetch_count = self.CONFLATE_PREFETCH
+            elif on_batch is not None:
+                prefetch_count = 2 * batch_size
+            elif workers:
+                prefetch_count = self.WORKER_PREFETCH * workers
+            elif reliable or manual_ack:
+                prefetch_count = self.RELIABLE_PREFETCH
+        self._prefetch_count = prefetch_count
+        self._workers = workers
+        self._executor_type = executor
+        self._ordered = ordered
+        self._executors = []
+        self._reliable = reliable or manual_ack
+        self._manual_ack = manual_ack
+        self._requeue_on_error = requeue_on_error
+        # Reliable mode. Delivery tag -> acked, in delivery order. Touched
+        # only by the consumer thread.
+        self._pending_acks = OrderedDict()
+        self._acks_held = 0
+        self._ack_flush_scheduled = False
+        # Acks/nacks requested by other threads: (tag, ack, requeue)
+        self._ack_queue = deque()
+        self._ack_lock = Lock()
+        self._ack_drain_scheduled = False
+        self._io_thread = None
+        # Conflation/batching state. Touched only by the consumer thread.
+        self._latest = OrderedDict()
+        self._batch_msgs = []
+        self._batch_metas = []
+        self._last_tag = 0
+        self._unacked = 0
+        self._flush_timer = None
+        self._last_flush = 0.0
         self.connect()
 
         if on_message is not None:
@@ -179,23 +498,40 @@ class SubscriberSync(AMQPTransportSync):
             expires=300000)
 
         # Bind queue to the Topic exchange
-        self.bind_queue(self._topic_exchange, self._queue_name, self._topic)
-        self._last_msg_ts = None
-        self._msg_freq_fifo = deque(maxlen=self.FREQ_CALC_SAMPLES_MAX)
-        self._hz = 0
-        self._sem = Semaphore()
+        if self._topic is not None:
+            self.bind_queue(self._topic_exchange, self._queue_name,
+                            self._topic)
+        self._rate_estimator = RateEstimator(self.FREQ_CALC_SAMPLES_MAX)
+
+    @property
+    def workers(self):
+        """Number of workers executing the callback. 0 means inline."""
+        return self._workers
 
     @property
     def hz(self):
         """Incoming message frequency."""
-        return self._hz
+        return self._rate_estimator.hz
+
+    @property
+    def stats(self):
+        """Incoming message statistics: rate, byte rate, inter-arrival
+        jitter, totals and windowed counts (see `RateEstimator.stats()`)."""
+        return self._rate_estimator.stats()
 
     def run(self):
         """Start Subscriber. Blocking method."""
         self._consume()
 
     def run_threaded(self):
-        """Execute subscriber in a separate thread."""
+        """Execute subscriber in a separate thread.
+
+        When the connection is driven by a SharedConnection the consumer is
+        served by its I/O thread and no thread is started.
+        """
+        if self.shared:
+            self._start_consumer()
+            return
         self.loop_thread = Thread(target=self.run)
         self.loop_thread.daemon = True
         self.loop_thread.start()
@@ -205,15 +541,63 @@ class SubscriberSync(AMQPTransportSync):
             self.logger.info('Invoked close() on an already closed channel')
             return False
         self.delete_queue(self._queue_name)
+        self._stop_executors()
         super(SubscriberSync, self).close()
 
-    def _consume(self, reliable=False):
-        """Start AMQP consumer."""
-        self._channel.basic_consume(
+    def _start_executors(self):
+        if self._workers == 0 or self._executors:
+            return
+        if self._executor_type == 'process':
+            _executor_cls = ProcessPoolExecutor
+        else:
+            _executor_cls = ThreadPoolExecutor
+        if self._ordered:
+            # One single-worker executor per worker, so that messages of a
+            # routing key are always handled, in order, by the same worker
+            self._executors = [_executor_cls(max_workers=1)
+                               for _ in range(self._workers)]
+        else:
+            self._executors = [_executor_cls(max_workers=self._workers)]
+        self.logger.info('Started {} {} workers'.format(
+            self._workers, self._executor_type))
+
+    def _stop_executors(self):
+        for _executor in self._executors:
+            _executor.shutdown(wait=False)
+        self._executors = []
+
+    def _start_consumer(self, reliable=False):
+        self._start_executors()
+        if self._prefetch_count:
+            self._run_io(self._channel.basic_qos,
+                         prefetch_count=self._prefetch_count)
+        if self._conflate:
+            callback = self._on_msg_conflate
+            reliable = True
+        elif self.on_batch is not None:
+            callback = self._on_msg_batch
+            reliable = True
+        elif self._workers:
+            callback = self._on_msg_dispatch
+            reliable = True
+        elif reliable or self._reliable:
+            callback = self._on_msg_reliable
+            reliable = True
+        else:
+            callback = self._on_msg_callback_wrapper
+        self._run_io(
+            self._channel.basic_consume,
             self._queue_name,
-            self._on_msg_callback_wrapper,
+            callback,
             exclusive=False,
             auto_ack=(not reliable))
+
+    def _consume(self, reliable=False):
+        """Start AMQP consumer."""
+        self._start_consumer(reliable)
+        if self.shared:
+            self._wait_closed()
+            return
         try:
             self._channel.start_consuming()
         except KeyboardInterrupt as exc:
@@ -224,94 +608,316 @@ class SubscriberSync(AMQPTransportSync):
             raise exc
 
     def _on_msg_callback_wrapper(self, ch, method, properties, body):
-        msg = {}
-        _ctype = None
-        _cencoding = None
-        _ts_send = None
-        _ts_broker = None
-        _dmode = None
-        try:
-            _ctype = properties.content_type
-            _ctype = 'application/json' if _ctype is None else _ctype
-        except Exception as exc:
-            _ctype = 'application/json'
-            self.logger.warn('Could not retrieve content_type from headers',
-                             exc_info=True)
-        try:
-            _cencoding = properties.content_encoding
-            _cencoding = 'application/json' if _cencoding is None else _ctype
-        except Exception as exc:
-            _cencoding = 'utf8'
-            self.logger.warn('Could not retrieve content_encoding from headers',
-                             exc_info=True)
-        try:
-            _dmode = properties.delivery_mode
-            _ts_broker = properties.headers['timestamp_in_ms']
-            _ts_send = properties.timestamp
-            # _ts_broker = properties.timestamp
-        except Exception:
-            self.logger.error("Could not calculate latency",
-                              exc_info=True)
+        self._rate_estimator.update(len(body))
+        self._handle_message(ch, method, properties, body)
+
+    def _handle_message(self, ch, method, properties, body):
+        """Decode a message and pass it to the callback."""
+        msg = self._decode(body, properties)
+        if self.onmessage is not None:
+            self.onmessage(msg, DeliveryMeta(ch, method, properties))
 
+    def _decode(self, body, properties):
         try:
-            msg = self._deserialize_data(body, _ctype, _cencoding)
+            return self._deserialize_data(body, properties.content_type,
+                                          properties.content_encoding)
         except Exception:
             self.logger.error("Could not deserialize data",
                               exc_info=True)
             # Return data as is. Let callback handle with encoding...
-            msg = body
-
+            return body
+
+    def _on_msg_batch(self, ch, method, properties, body):
+        """Consumer callback of batch mode."""
+        self._rate_estimator.update(len(body))
+        self._batch_msgs.append(self._decode(body, properties))
+        self._batch_metas.append(DeliveryMeta(ch, method, properties))
+        self._last_tag = method.delivery_tag
+        self._unacked += 1
+        if len(self._batch_msgs) >= self._batch_size:
+            self._flush_batch()
+        elif self._flush_timer is None:
+            self._flush_timer = self._connection.call_later(
+                self._batch_interval, self._on_batch_timer)
+
+    def _on_batch_timer(self):
+        self._flush_timer = None
+        self._flush_batch()
+
+    def _flush_batch(self):
+        """Pass the pending batch to the callback and ack it."""
+        if self._flush_timer is not None:
+            self._connection.remove_timeout(self._flush_timer)
+            self._flush_timer = None
+        if not self._batch_msgs:
+            return
+        msgs, metas = self._batch_msgs, self._batch_metas
+        self._batch_msgs = []
+        self._batch_metas = []
         try:
-            self._sem.acquire()
-            self._calc_msg_frequency()
-            self._sem.release()
+            self.on_batch(msgs, metas)
         except Exception:
-            self.logger.error("Could not calculate message rate",
+            self.logger.error('Batch callback raised an exception',
                               exc_info=True)
+            if self._channel.is_open:
+                requeue = self._requeue_on_error and \
+                    not any(meta.method.redelivered for meta in metas)
+                self._channel.basic_nack(delivery_tag=self._last_tag,
+                                         multiple=True, requeue=requeue)
+                self._unacked = 0
+            return
+        if self._channel.is_open:
+            self._ack_all()
 
-        if self.onmessage is not None:
-            meta = {
-                'channel': ch,
-                'method': method,
-                'properties': {
-                    'content_type': _ctype,
-                    'content_encoding': _cencoding,
-                    'timestamp_broker': _ts_broker,
-                    'timestamp_producer': _ts_send,
-                    'delivery_mode': _dmode
-                }
-            }
-            self.onmessage(msg, meta)
-
-    def _calc_msg_frequency(self):
-        ts = time.time()
-        if self._last_msg_ts is not None:
-            diff = ts - self._last_msg_ts
-            if diff < 10e-3:
-                self._last_msg_ts = ts
+    def ack(self, meta):
+        """Acknowledge a message in reliable mode. Thread-safe.
+
+        Acks are coalesced into multiple-acks: consecutive acked deliveries
+        are acknowledged with a single frame.
+
+        Args:
+            meta (DeliveryMeta): Metadata of the message.
+        """
+        self._settle_threadsafe(meta.method.delivery_tag, True, False)
+
+    def nack(self, meta, requeue=True):
+        """Reject a message in reliable mode. Thread-safe.
+
+        Args:
+            meta (DeliveryMeta): Metadata of the message.
+            requeue (bool): Put the message back to the queue.
+        """
+        self._settle_threadsafe(meta.method.delivery_tag, False, requeue)
+
+    def _settle_threadsafe(self, tag, ack, requeue):
+        if threading.current_thread() is self._io_thread:
+            self._settle(tag, ack, requeue)
+            return
+        with self._ack_lock:
+            self._ack_queue.append((tag, ack, requeue))
+            if self._ack_drain_scheduled:
                 return
-            else:
-                hz = 1.0 / float(diff)
-                self._msg_freq_fifo.appendleft(hz)
-                hz_list = [s for s in self._msg_freq_fifo if s != 0]
-                _sum = sum(hz_list)
-                self._hz = _sum / len(hz_list)
-        self._last_msg_ts = ts
-
-    def _deserialize_data(self, data, content_type, content_encoding):
+            self._ack_drain_scheduled = True
+        # One callback drains all the acks queued until it runs
+        self._connection.add_callback_threadsafe(self._drain_acks)
+
+    def _drain_acks(self):
+        with self._ack_lock:
+            items = list(self._ack_queue)
+            self._ack_queue.clear()
+            self._ack_drain_scheduled = False
+        for tag, ack, requeue in items:
+            self._settle(tag, ack, requeue)
+        self._flush_acks()
+
+    def _settle(self, tag, ack, requeue):
+        """Settle a delivery. Consumer thread only."""
+        if tag not in self._pending_acks:
+            return
+        if ack:
+            if not self._pending_acks[tag]:
+                self._pending_acks[tag] = True
+                self._acks_held += 1
+            if self._prefetch_count and \
+                    self._acks_held * 2 >= self._prefetch_count:
+                self._flush_acks()
+            elif not self._ack_flush_scheduled:
+                # Flush once the deliveries at hand have been dispatched
+                self._ack_flush_scheduled = True
+                self._connection.call_later(0, self._flush_acks)
+            return
+        # Acks of earlier deliveries go first, so that the multiple-ack
+        # never covers the rejected delivery
+        self._flush_acks()
+        del self._pending_acks[tag]
+        if self._channel.is_open:
+            self._channel.basic_nack(delivery_tag=tag, multiple=False,
+                                     requeue=requeue)
+
+    def _flush_acks(self):
+        """Send the pending acks. Consecutive acked deliveries, from the
+        oldest outstanding one, are acked with a single multiple-ack."""
+        self._ack_flush_scheduled = False
+        pending = self._pending_acks
+        last = None
+        while pending:
+            tag = next(iter(pending))
+            if not pending[tag]:
+                break
+            pending.popitem(last=False)
+            self._acks_held -= 1
+            last = tag
+        if not self._channel.is_open:
+            return
+        if last is not None:
+            self._channel.basic_ack(delivery_tag=last, multiple=True)
+        if self._prefetch_count and \
+                self._acks_held * 2 >= self._prefetch_count:
+            # Acks held behind a slow delivery fill the prefetch window
+            for tag in [t for t, acked in pending.items() if acked]:
+                del pending[tag]
+                self._channel.basic_ack(delivery_tag=tag)
+            self._acks_held = 0
+
+    def _on_msg_reliable(self, ch, method, properties, body):
+        """Consumer callback of reliable mode."""
+        self._io_thread = threading.current_thread()
+        self._rate_estimator.update(len(body))
+        tag = method.delivery_tag
+        self._pending_acks[tag] = False
+        try:
+            self._handle_message(ch, method, properties, body)
+        except Exception:
+            self.logger.error('Message callback raised an exception',
+                              exc_info=True)
+            # With manual acks the callback may have settled it already
+            if self._pending_acks.get(tag) is False:
+                self._settle(tag, False,
+                             self._requeue_on_error and not method.redelivered)
+        else:
+            if not self._manual_ack:
+                self._settle(tag, True, False)
+
+    def _on_msg_dispatch(self, ch, method, properties, body):
+        """Consumer callback of worker mode. Hands the decoded message to a
+        worker. It is acked, or nacked, once the worker is done."""
+        self._io_thread = threading.current_thread()
+        self._rate_estimator.update(len(body))
+        self._pending_acks[method.delivery_tag] = False
+        msg = self._decode(body, properties)
+        if self._executor_type == 'process':
+            # Channel and method frame can not cross process boundaries
+            meta = DeliveryMeta(properties=properties)
+        else:
+            meta = DeliveryMeta(ch, method, properties)
+        if len(self._executors) == 1:
+            _executor = self._executors[0]
+        else:
+            _executor = self._executors[
+                hash(method.routing_key) % len(self._executors)]
+        try:
+            future = _executor.submit(self.onmessage, msg, meta)
+        except RuntimeError:
+            # Executor shut down while closing
+            self._settle(method.delivery_tag, False, True)
+            return
+        future.add_done_callback(
+            functools.partial(self._on_worker_done, method))
+
+    def _on_worker_done(self, method, future):
+        """Called by the worker when a message has been handled."""
+        if future.exception() is None:
+            self._settle_threadsafe(method.delivery_tag, True, False)
+            return
+        self.logger.error('Message callback raised an exception',
+                          exc_info=future.exception())
+        self._settle_threadsafe(
+            method.delivery_tag, False,
+            self._requeue_on_error and not method.redelivered)
+
+    def _on_msg_conflate(self, ch, method, properties, body):
+        """Consumer callback of conflation mode.
+
+        Keeps the newest undecoded delivery per routing key until the next
+        flush. Deliveries are acked in bulk, with a single multiple-ack,
+        once half of the prefetch window is in use, so that the broker
+        keeps pushing newer messages.
         """
-        Deserialize wire data.
+        self._rate_estimator.update(len(body))
+        self._latest.pop(method.routing_key, None)
+        self._latest[method.routing_key] = (ch, method, properties, body)
+        self._last_tag = method.delivery_tag
+        self._unacked += 1
+        if self._unacked * 2 >= self._prefetch_count:
+            self._ack_all()
+        if self._flush_timer is None:
+            delay = self._last_flush + self._conflate_period - \
+                monotonic()
+            self._flush_timer = self._connection.call_later(
+                max(0, delay), self._flush_latest)
+
+    def _ack_all(self):
+        if self._unacked:
+            self._channel.basic_ack(delivery_tag=self._last_tag,
+                                    multiple=True)
+            self._unacked = 0
+
+    def _flush_latest(self):
+        """Pass the newest message of each routing key to the callback."""
+        self._flush_timer = None
+        self._last_flush = monotonic()
+        latest = self._latest
+        self._latest = OrderedDict()
+        for ch, method, properties, body in latest.values():
+            try:
+                self._handle_message(ch, method, properties, body)
+            except Exception:
+                self.logger.error('Message callback raised an exception',
+                                  exc_info=True)
+        if self._channel.is_open:
+            self._ack_all()
 
-        @param data: Data to deserialize.
-        @type data: dict|int|bool
+
+class MultiSubscriber(SubscriberSync):
+    """Subscriber of many topics over a single queue and consumer.
+
+    All topic patterns are bound to one queue. Each delivery is decoded
+    once and dispatched to the callbacks of every matching pattern through
+    a TopicTrie, which supports the `*` and `#` wildcards.
+
+    Args:
+        topics (dict): Initial subscriptions, {topic pattern: callback}.
+        exchange (str): The name of the exchange. Defaults to `amq.topic`
+        queue_size (int): The maximum queue size, shared by all topics.
+        **kwargs: The keyword arguments to pass to the base class
+            (SubscriberSync). Only thread workers are supported, since
+            dispatching needs the routing key of each delivery.
+    """
+
+    def __init__(self, topics=None, exchange='amq.topic', queue_size=100,
+                 *args, **kwargs):
+        """Constructor."""
+        if kwargs.get('executor') == 'process':
+            # Checked before the queue is declared, so that nothing leaks
+            raise ValueError(
+                'MultiSubscriber does not support process workers')
+        self._name = 'multi'
+        self._trie = TopicTrie()
+        SubscriberSync.__init__(self, None, None, exchange, queue_size,
+                                *args, **kwargs)
+        for topic, callback in (topics or {}).items():
+            self.subscribe(topic, callback)
+
+    @property
+    def topics(self):
+        """Subscribed topic patterns."""
+        return self._trie.patterns
+
+    def subscribe(self, topic, callback):
+        """Subscribe a callback to a topic pattern.
+
+        Args:
+            topic (str): Topic pattern. Supports `*` and `#` wildcards.
+            callback (function): Called with (msg, meta) for each message
+                whose routing key matches the pattern.
         """
-        _data = None
-        if content_encoding is None:
-            content_encoding = 'utf8'
-        if content_type == ContentType.json:
-            _data = JSONSerializer.deserialize(data)
-        elif content_type == ContentType.text:
-            _data = data.decode(content_encoding)
-        elif content_type == ContentType.raw_bytes:
-            _data = data
-        return _data
+        if self._trie.add(topic, callback):
+            self._io_call(self.bind_queue, self._topic_exchange,
+                          self._queue_name, topic)
+
+    def unsubscribe(self, topic, callback=None):
+        """Remove a callback, or all callbacks, of a topic pattern. The
+        pattern is unbound from the queue once it has no callbacks."""
+        if topic not in self._trie:
+            return
+        if self._trie.remove(topic, callback):
+            self._io_call(self.unbind_queue, self._topic_exchange,
+                          self._queue_name, topic)
+
+    def onmessage(self, msg, meta):
+        for callback in self._trie.match(meta.method.routing_key):
+            try:
+                callback(msg, meta)
+            except Exception:
+                self.logger.error('Topic callback raised an exception',
+                                  exc_info=True)
@@ -16,13 +16,317 @@
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
 
+from __future__ import division
+
+import math
 import time
 
+# Monotonic clock. Not affected by system clock updates.
+monotonic = getattr(time, 'monotonic', time.time)
+
+
+class Rate(object):
+    """Run a loop at a fixed rate.
+
+    Holds an absolute deadline on the monotonic clock and `sleep()` sleeps
+    only for the time remaining until it, so the time spent in the loop body
+    does not accumulate into drift. When the loop body overruns the period,
+    `sleep()` returns immediately; missed cycles are skipped, keeping the
+    loop in phase with its original schedule.
+
+    Args:
+        hz (float): Desired rate in Hz.
+        sleep_fn (function): Function to sleep for the given number of
+            seconds. Defaults to `time.sleep`.
+    """
 
-class Rate:
-    def __init__(self, hz):
+    # Smoothing factor of the achieved rate estimate
+    EWMA_ALPHA = 0.1
+
+    def __init__(self, hz, sleep_fn=time.sleep):
+        if hz <= 0:
+            raise ValueError('Rate must be > 0 Hz')
         self._hz = hz
         self._tsleep = 1.0 / hz
+        self._sleep_fn = sleep_fn
+        self.reset()
+
+    def reset(self):
+        """Restart the schedule from now and clear statistics."""
+        self._start = monotonic()
+        self._deadline = self._start + self._tsleep
+        self._last_deadline = None
+        self._last_wake = None
+        self._period_avg = None
+        self.cycles = 0
+        self.overruns = 0
+        self.missed = 0
+        # Wake-up lateness (Welford's running mean/variance), in seconds
+        self._lat_mean = 0.0
+        self._lat_m2 = 0.0
+        self._lat_max = 0.0
+
+    @property
+    def hz(self):
+        """Desired rate."""
+        return self._hz
+
+    @property
+    def period(self):
+        return self._tsleep
+
+    @property
+    def deadline(self):
+        """Next deadline, on the monotonic clock."""
+        return self._deadline
+
+    @property
+    def last_deadline(self):
+        """Deadline of the last cycle, on the monotonic clock."""
+        return self._last_deadline
+
+    @property
+    def achieved_hz(self):
+        """Achieved rate, averaged over recent cycles."""
+        if not self._period_avg:
+            return 0.0
+        return 1.0 / self._period_avg
+
+    @property
+    def jitter(self):
+        """Standard deviation of the wake-up lateness, in seconds."""
+        if self.cycles < 2:
+            return 0.0
+        return math.sqrt(self._lat_m2 / (self.cycles - 1))
+
+    @property
+    def jitter_mean(self):
+        """Mean wake-up lateness, in seconds."""
+        return self._lat_mean
+
+    @property
+    def jitter_max(self):
+        """Maximum wake-up lateness, in seconds."""
+        return self._lat_max
+
+    def remaining(self):
+        """Time left until the next deadline, in seconds. Negative if the
+        deadline has passed."""
+        return self._deadline - monotonic()
 
     def sleep(self):
-        time.sleep(self._tsleep)
+        """Sleep until the next deadline.
+
+        Returns:
+            bool: False if the deadline had already passed (overrun).
+        """
+        remaining = self._deadline - monotonic()
+        if remaining > 0:
+            self._sleep_fn(remaining)
+        now = monotonic()
+        deadline = self._deadline
+        met = remaining > 0
+        if not met:
+            self.overruns += 1
+            # Skip the cycles missed while overrunning
+            behind = int((now - deadline) // self._tsleep)
+            self.missed += behind
+            deadline += behind * self._tsleep
+        self._update_stats(now, now - deadline)
+        self._last_deadline = deadline
+        self._deadline = deadline + self._tsleep
+        return met
+
+    def _update_stats(self, now, lateness):
+        if self._last_wake is not None:
+            period = now - self._last_wake
+            if self._period_avg is None:
+                self._period_avg = period
+            else:
+                self._period_avg += self.EWMA_ALPHA * (
+                    period - self._period_avg)
+        self._last_wake = now
+        self.cycles += 1
+        delta = lateness - self._lat_mean
+        self._lat_mean += delta / self.cycles
+        self._lat_m2 += delta * (lateness - self._lat_mean)
+        if lateness > self._lat_max:
+            self._lat_max = lateness
+
+    def stats(self):
+        """Loop statistics.
+
+        Returns:
+            dict: hz, achieved_hz, cycles, overruns, missed (skipped cycles)
+                and jitter_mean, jitter_std, jitter_max in seconds.
+        """
+        return {
+            'hz': self._hz,
+            'achieved_hz': self.achieved_hz,
+            'cycles': self.cycles,
+            'overruns': self.overruns,
+            'missed': self.missed,
+            'jitter_mean': self.jitter_mean,
+            'jitter_std': self.jitter,
+            'jitter_max': self.jitter_max
+        }
+
+
+class RateEstimator(object):
+    """Streaming estimator of the rate of incoming events.
+
+    Keeps the last `window` inter-arrival times (and event sizes) in ring
+    buffers with running sums, so each `update()` costs O(1) and takes no
+    lock. Meant to be updated by a single thread (e.g. the consumer
+    thread) and read from any thread.
+
+    Args:
+        window (int): Number of inter-arrival samples to average.
+        buckets (int): Number of one-second buckets kept for windowed
+            counts (see `count_last()`).
+    """
+
+    def __init__(self, window=100, buckets=60):
+        self._window = window
+        self._dt = [0.0] * window
+        self._size = [0] * window
+        self._idx = 0
+        self._n = 0
+        self._dt_sum = 0.0
+        self._dt_sq_sum = 0.0
+        self._size_sum = 0
+        self._last = None
+        self._nbuckets = buckets
+        self._bucket_sec = [None] * buckets
+        self._bucket_count = [0] * buckets
+        self._bucket_bytes = [0] * buckets
+        self.count = 0
+        self.bytes = 0
+
+    def update(self, size=0, ts=None):
+        """Record an event.
+
+        Args:
+            size (int): Size of the event (e.g. message length in bytes).
+            ts (float): Monotonic timestamp of the event. Defaults to now.
+        """
+        if ts is None:
+            ts = monotonic()
+        self.count += 1
+        self.bytes += size
+
+        sec = int(ts)
+        b = sec % self._nbuckets
+        if self._bucket_sec[b] != sec:
+            self._bucket_sec[b] = sec
+            self._bucket_count[b] = 0
+            self._bucket_bytes[b] = 0
+        self._bucket_count[b] += 1
+        self._bucket_bytes[b] += size
+
+        last = self._last
+        self._last = ts
+        if last is None:
+            return
+        dt = ts - last
+        i = self._idx
+        if self._n == self._window:
+            old = self._dt[i]
+            self._dt_sum -= old
+            self._dt_sq_sum -= old * old
+            self._size_sum -= self._size[i]
+        else:
+            self._n += 1
+        self._dt[i] = dt
+        self._size[i] = size
+        self._dt_sum += dt
+        self._dt_sq_sum += dt * dt
+        self._size_sum += size
+        i += 1
+        if i == self._window:
+            i = 0
+            # Drop the rounding error accumulated by the running sums
+            self._dt_sum = math.fsum(self._dt)
+            self._dt_sq_sum = math.fsum(d * d for d in self._dt)
+        self._idx = i
+
+    def reset(self):
+        self.__init__(self._window, self._nbuckets)
+
+    def _span(self):
+        """Time covered by the window, extended by the part of the ongoing
+        silence that exceeds the mean inter-arrival time."""
+        n = self._n
+        if n == 0:
+            return 0.0
+        span = self._dt_sum
+        excess = monotonic() - self._last - span / n
+        if excess > 0:
+            span += excess
+        return span
+
+    @property
+    def hz(self):
+        """Event rate over the window. Decays when events stop."""
+        span = self._span()
+        return self._n / span if span > 0 else 0.0
+
+    @property
+    def byte_rate(self):
+        """Bytes per second over the window."""
+        span = self._span()
+        return self._size_sum / span if span > 0 else 0.0
+
+    @property
+    def mean_interval(self):
+        """Mean inter-arrival time in seconds."""
+        return self._dt_sum / self._n if self._n else 0.0
+
+    @property
+    def jitter(self):
+        """Standard deviation of the inter-arrival time in seconds."""
+        n = self._n
+        if n < 2:
+            return 0.0
+        mean = self._dt_sum / n
+        var = (self._dt_sq_sum - n * mean * mean) / (n - 1)
+        return math.sqrt(var) if var > 0 else 0.0
+
+    def count_last(self, seconds=1):
+        """Number of events and bytes within the last `seconds` whole
+        seconds, including the current one.
+
+        Returns:
+            tuple: (count, bytes)
+        """
+        seconds = min(seconds, self._nbuckets)
+        now = int(monotonic())
+        count = 0
+        nbytes = 0
+        for sec in range(now - seconds + 1, now + 1):
+            b = sec % self._nbuckets
+            if self._bucket_sec[b] == sec:
+                count += self._bucket_count[b]
+                nbytes += self._bucket_bytes[b]
+        return count, nbytes
+
+    def stats(self):
+        """Rate statistics.
+
+        Returns:
+            dict: hz, byte_rate, jitter and mean_interval in seconds, total
+                count and bytes, and counts within the last 1 and 10
+                seconds.
+        """
+        count_1s, _ = self.count_last(1)
+        count_10s, _ = self.count_last(10)
+        return {
+            'hz': self.hz,
+            'byte_rate': self.byte_rate,
+            'jitter': self.jitter,
+            'mean_interval': self.mean_interval,
+            'count': self.count,
+            'bytes': self.bytes,
+            'count_1s': count_1s,
+            'count_10s': count_10s
+        }
@@ -25,6 +25,7 @@ from __future__ import (
 
 import sys
 import functools
+import inspect
 
 if sys.version_info[0] >= 3:
     unicode = str
@@ -33,13 +34,32 @@ import time
 import uuid
 import json
 import threading
+from collections import OrderedDict, deque
+from concurrent.futures import (
+    Future, ThreadPoolExecutor, ProcessPoolExecutor, CancelledError,
+    TimeoutError as FutureTimeoutError, wait as futures_wait
+)
+
+import pika
 
 from .amqp_transport import (
-    AMQPTransportSync, ExchangeTypes, MessageProperties
+    AMQPTransportSync, ExchangeTypes, MessageProperties, DeliveryMeta
 )
 
-from .serializer import JSONSerializer, ContentType
+from .serializer import serializer_registry
 from .msg import Message
+from .cache import ResponseCache, ReplayCache
+
+
+class StreamHeaders(object):
+    """Message headers of streamed RPC responses."""
+    SEQ = 'x-stream-seq'
+    END = 'x-stream-end'
+    ERROR = 'x-stream-error'
+
+
+# Result of a worker that has streamed its response
+_STREAMED = object()
 
 
 class RpcServer(AMQPTransportSync):
@@ -51,26 +71,82 @@ class RpcServer(AMQPTransportSync):
         exchange (str): The exchange to bind the RPC.
             Defaults to (AMQT default).
         on_request (function): The on-request callback function to register.
+        serializer (Serializer|str): Serializer of structured responses, or
+            its content type. Defaults to the default of the serializer
+            registry (JSON).
+        workers (int): Number of workers executing `on_request`. When 0
+            (default), requests are handled inline on the connection thread.
+        executor (str): Worker type, `thread` or `process`. Process workers
+            require a picklable (module-level) `on_request` and receive
+            metadata without the `channel` and `method` entries.
+        prefetch_count (int): Number of unacknowledged requests the broker
+            may deliver. Defaults to the number of workers.
+        queue_size (int): Maximum number of requests waiting in the RPC
+            queue. Beyond that the oldest requests are dropped.
+        broadcast_exchange (str): Also serve the requests broadcasted to this
+            fanout exchange (see `RpcClient.broadcast()`). Every server
+            joining the exchange gets a copy of each request.
+        replay_cache (ReplayCache|bool): Answer duplicate requests, with the
+            same `message_id` (or `correlation_id`, if the message id is
+            unset or 0), with the response of the original request instead
+            of handling them again. Pass True for a cache with the default
+            settings.
         **kwargs: Keyword arguments for the constructor of the base class
             (AMQPTransportSync).
     """
 
-    _SERIALIZER = JSONSerializer
+    _SERIALIZER = None
+    STREAM_WINDOW = 16
 
     def __init__(self, rpc_name, exchange='', on_request=None,
-                 serializer=None, *args, **kwargs):
+                 serializer=None, workers=0, executor='thread',
+                 prefetch_count=None, queue_size=1000,
+                 broadcast_exchange=None, replay_cache=None, *args, **kwargs):
         """Constructor. """
         self._name = rpc_name
         self._rpc_name = rpc_name
 
         if serializer is not None:
-            self._SERIALIZER = serializer
+            self._SERIALIZER = serializer_registry.resolve(serializer)
 
         AMQPTransportSync.__init__(self, *args, **kwargs)
         self._exchange = exchange
         # Bind on_request callback
         self.on_request = on_request
 
+        if workers < 0:
+            raise ValueError('Number of workers must be >= 0')
+        if executor not in ('thread', 'process'):
+            raise ValueError(
+                'Executor type must be one of [thread, process]')
+        self._workers = workers
+        self._executor_type = executor
+        self._executor = None
+        if prefetch_count is None:
+            prefetch_count = max(1, workers)
+        self._prefetch_count = prefetch_count
+        self._queue_size = max(queue_size, prefetch_count)
+        self._broadcast_exchange = broadcast_exchange
+        self._broadcast_queue = None
+        if replay_cache is True:
+            replay_cache = ReplayCache()
+        elif replay_cache is False:
+            replay_cache = None
+        self._replay_cache = replay_cache
+        # Duplicates of requests being handled, by request id. Touched only
+        # by the connection thread.
+        self._in_progress = {}
+
+    @property
+    def workers(self):
+        """Number of workers executing requests. 0 means inline."""
+        return self._workers
+
+    @property
+    def replay_cache(self):
+        """The ReplayCache of the server, or None."""
+        return self._replay_cache
+
     def is_alive(self):
         """Returns True if connection is alive and False otherwise."""
         if self.connection is None:
@@ -87,9 +163,16 @@ class RpcServer(AMQPTransportSync):
             raise ValueError(
                 'RPC <{}> allready registered on broker.'.format(
                     self._rpc_name))
-        self._rpc_queue = self.create_queue(self._rpc_name)
-        self._channel.basic_qos(prefetch_count=1, global_qos=False)
+        self._rpc_queue = self.create_queue(self._rpc_name,
+                                            queue_size=self._queue_size)
+        self._run_io(self._channel.basic_qos,
+                     prefetch_count=self._prefetch_count,
+                     global_qos=False)
+        self._start_executor()
         self._consume()
+        if self.shared:
+            self._wait_closed()
+            return
         try:
             self._channel.start_consuming()
         except Exception as exc:
@@ -97,13 +180,26 @@ class RpcServer(AMQPTransportSync):
             raise exc
 
     def run_threaded(self, raise_if_exists=True):
-        """Run RPC Server in a separate thread."""
+        """Run RPC Server in a separate thread.
+
+        When the connection is driven by a SharedConnection, requests are
+        served by its I/O thread and no thread is started.
+        """
         self.connect()
         _exists = self._rpc_exists()
         if _exists and raise_if_exists:
             raise ValueError(
                 'RPC <{}> allready registered on broker.'.format(
                     self._rpc_name))
+        if self.shared:
+            self._rpc_queue = self.create_queue(self._rpc_name,
+                                                queue_size=self._queue_size)
+            self._run_io(self._channel.basic_qos,
+                         prefetch_count=self._prefetch_count,
+                         global_qos=False)
+            self._start_executor()
+            self._consume()
+            return
         self.loop_thread = threading.Thread(target=self.run)
         self.loop_thread.daemon = True
         self.loop_thread.start()
@@ -115,126 +211,270 @@ class RpcServer(AMQPTransportSync):
         return self.queue_exists(self._rpc_name)
 
     def _consume(self):
-        self.consumer_tag = self._channel.basic_consume(
+        self.consumer_tag = self._run_io(
+            self._channel.basic_consume,
             self._rpc_queue,
             self._on_request_wrapper)
+        if self._broadcast_exchange is not None:
+            self.create_exchange(self._broadcast_exchange,
+                                 ExchangeTypes.Fanout)
+            self._broadcast_queue = self.create_queue(
+                queue_size=self._queue_size)
+            self.bind_queue(self._broadcast_exchange, self._broadcast_queue,
+                            '')
+            self._run_io(self._channel.basic_consume,
+                         self._broadcast_queue,
+                         self._on_request_wrapper)
         self.logger.info('RPC Endpoint ready: {}'.format(self._rpc_name))
 
+    def _start_executor(self):
+        if self._workers == 0 or self._executor is not None:
+            return
+        if self._executor_type == 'process':
+            self._executor = ProcessPoolExecutor(max_workers=self._workers)
+        else:
+            self._executor = ThreadPoolExecutor(max_workers=self._workers)
+        self.logger.info('Started {} {} workers'.format(
+            self._workers, self._executor_type))
+
     def _on_request_wrapper(self, ch, method, properties, body):
-        _msg = {}
-        _ctype = None
-        _cencoding = None
-        _ts_send = None
-        _ts_broker = None
-        _dmode = None
-        _corr_id = None
-        try:
-            _corr_id = properties.correlation_id
-            _ctype = properties.content_type
-            _cencoding = properties.content_encoding
-            _ts_broker = properties.headers['timestamp_in_ms']
-            _dmode = properties.delivery_mode
-            _ts_send = properties.timestamp
-            # _ts_broker = properties.timestamp
-        except Exception:
-            self.logger.error("Could not calculate latency",
-                              exc_info=True)
+        _req_id = None
+        if self._replay_cache is not None:
+            _req_id = self._request_id(properties)
+        if _req_id is not None:
+            _reply = self._replay_cache.get(_req_id)
+            if _reply is not None:
+                self.logger.debug('Replaying response to request <%s>',
+                                  _req_id)
+                self._send_response(ch, method, properties, *_reply)
+                return
+            if _req_id in self._in_progress:
+                # Answered once the original request is handled. Requeued
+                # if its response is streamed
+                self._in_progress[_req_id].append((ch, method, properties))
+                return
+            self._in_progress[_req_id] = []
 
         try:
-            _msg = self._deserialize_data(body, _ctype, _cencoding)
+            _msg = self._deserialize_data(body, properties.content_type,
+                                          properties.content_encoding)
         except Exception:
             self.logger.error("Could not deserialize data",
                               exc_info=True)
             # Return data as is. Let callback handle with encoding...
             _msg = body
 
-
-        if self.on_request is not None:
-            _meta = {
-                'channel': ch,
-                'method': method,
-                'properties': {
-                    'content_type': _ctype,
-                    'content_encoding': _cencoding,
-                    'timestamp_broker': _ts_broker,
-                    'timestamp_producer': _ts_send,
-                    'delivery_mode': _dmode,
-                    'correlation_id': _corr_id
-                }
-            }
-            self.logger.debug(_msg)
-            self.logger.debug(_meta)
-            resp = self.on_request(_msg, _meta)
-        else:
+        _handler = self._get_handler(method)
+        if _handler is None:
             resp = {
                 'error': 'Not Implemented',
                 'status': 501
             }
+            self._complete(_req_id, ch, method, properties,
+                           self._serialize_response(resp), False)
+            return
+
+        _meta = DeliveryMeta(ch, method, properties)
+
+        if self._executor is None:
+            try:
+                resp = _handler(_msg, _meta)
+            except Exception:
+                self._in_progress.pop(_req_id, None)
+                raise
+            if inspect.isgenerator(resp):
+                self._stream(_req_id, ch, method, properties, resp, False)
+                return
+            self._complete(_req_id, ch, method, properties,
+                           self._serialize_response(resp))
+            return
+
+        if self._executor_type == 'process':
+            # Channel and method frame can not cross process boundaries.
+            # Neither can generators, responses are not streamed.
+            _meta = DeliveryMeta(properties=properties)
+            future = self._executor.submit(_handler, _msg, _meta)
+        else:
+            future = self._executor.submit(
+                self._run_handler, _handler, _req_id, ch, method, properties,
+                _msg, _meta)
+        future.add_done_callback(
+            functools.partial(self._on_worker_done, _req_id, ch, method,
+                              properties))
+
+    def _get_handler(self, method):
+        """The handler of a request."""
+        return self.on_request
+
+    @staticmethod
+    def _request_id(properties):
+        """Id of a request, for the replay cache.
+
+        Clients of older versions send a constant `message_id` of 0, which
+        can not tell requests apart. The correlation id is used instead.
+        """
+        _msg_id = properties.message_id
+        if _msg_id in (None, '', '0', 0):
+            return properties.correlation_id
+        return _msg_id
+
+    def _run_handler(self, handler, req_id, ch, method, properties, msg,
+                     meta):
+        """Run a handler in a thread worker. Generator responses are
+        streamed from the worker."""
+        resp = handler(msg, meta)
+        if inspect.isgenerator(resp):
+            self._stream(req_id, ch, method, properties, resp, True)
+            return _STREAMED
+        return resp
+
+    def _stream(self, req_id, ch, method, properties, gen, threadsafe):
+        """Publish the items of a generator as sequenced chunks, followed by
+        an end-of-stream, or error, frame.
+
+        Args:
+            threadsafe (bool): Called outside the connection thread. Chunks
+                are handed to the connection thread, at most
+                `STREAM_WINDOW` at a time.
+        """
+        _window = threading.Semaphore(self.STREAM_WINDOW) if threadsafe \
+            else None
+        seq = 0
+        try:
+            for item in gen:
+                self._send_frame(ch, method, properties, req_id,
+                                 self._serialize_response(item),
+                                 {StreamHeaders.SEQ: seq}, False, _window)
+                seq += 1
+            _headers = {StreamHeaders.SEQ: seq, StreamHeaders.END: True}
+            _reply = self._serialize_response({'chunks': seq})
+        except Exception as exc:
+            self.logger.error('Request handler raised an exception',
+                              exc_info=True)
+            _headers = {StreamHeaders.SEQ: seq, StreamHeaders.ERROR: True}
+            _reply = self._serialize_response({
+                'status': 500,
+                'error': 'Internal server error: {}'.format(str(exc))
+            })
+        self._send_frame(ch, method, properties, req_id, _reply, _headers,
+                         True, _window)
+
+    def _send_frame(self, ch, method, properties, req_id, reply, headers,
+                    final, window):
+        if window is None:
+            self._publish_frame(ch, method, properties, req_id, reply,
+                                headers, final)
+            return
+        window.acquire()
+        try:
+            self.connection.add_callback_threadsafe(
+                functools.partial(self._publish_frame, ch, method,
+                                  properties, req_id, reply, headers, final,
+                                  window))
+        except Exception:
+            window.release()
+            self.logger.error('Could not schedule response on connection',
+                              exc_info=True)
+
+    def _publish_frame(self, ch, method, properties, req_id, reply, headers,
+                       final, window=None):
+        """Publish a chunk of a streamed response. The request is acked
+        with the final frame. Must run on the connection thread.
+        """
+        if window is not None:
+            window.release()
+        self._publish_reply(ch, properties, reply, headers)
+        if not final:
+            return
+        ch.basic_ack(delivery_tag=method.delivery_tag)
+        # Streamed responses are not replayed. Duplicates are handled again
+        for _ch, _method, _ in self._in_progress.pop(req_id, ()):
+            _ch.basic_nack(delivery_tag=_method.delivery_tag, requeue=True)
+
+    def _on_worker_done(self, req_id, ch, method, properties, future):
+        """Called by the worker when a request has been handled.
 
+        Serializes the response on the worker side and hands publishing and
+        acknowledgement back to the connection thread.
+        """
+        _failed = False
         try:
-            _payload = None
-            _encoding = None
-            _type = None
-
-            if isinstance(resp, dict):
-                _payload = self._SERIALIZER.serialize(resp).encode('utf-8')
-                _encoding = self._SERIALIZER.CONTENT_ENCODING
-                _type = self._SERIALIZER.CONTENT_TYPE
-            elif isinstance(data, str):
-                _type = 'text/plain'
-                _encoding = 'utf8'
-                _payload = data
-            elif isinstance(msg, bytes):
-                _type = 'application/octet-stream'
-                _encoding = 'utf8'
-                _payload = data
+            resp = future.result()
+            if resp is _STREAMED:
+                return
+        except Exception as exc:
+            self.logger.error('Request handler raised an exception',
+                              exc_info=True)
+            resp = {
+                'status': 500,
+                'error': 'Internal server error: {}'.format(str(exc))
+            }
+            _failed = True
+        _reply = self._serialize_response(resp)
+        try:
+            self.connection.add_callback_threadsafe(
+                functools.partial(self._complete, req_id, ch, method,
+                                  properties, _reply, not _failed))
+        except Exception:
+            self.logger.error('Could not schedule response on connection',
+                              exc_info=True)
+
+    def _serialize_response(self, resp):
+        """Serialize a response.
 
+        Returns:
+            tuple: (payload, content_type, content_encoding)
+        """
+        try:
+            _payload, _type, _encoding = serializer_registry.serialize(
+                resp, self._SERIALIZER)
         except Exception as e:
-            self.logger.error("Could not deserialize data",
+            self.logger.error("Could not serialize data",
                               exc_info=True)
-            _payload = {
+            _payload, _type, _encoding = serializer_registry.serialize({
                 'status': 501,
                 'error': 'Internal server error: {}'.format(str(e))
-            }
+            })
+        return _payload, _type, _encoding
 
+    def _complete(self, req_id, ch, method, properties, reply,
+                  cacheable=True):
+        """Respond to a handled request and to its duplicates received in
+        the meantime. Must run on the connection thread.
+        """
+        self._send_response(ch, method, properties, *reply)
+        if req_id is None:
+            return
+        if cacheable:
+            self._replay_cache.put(req_id, reply)
+        for _ch, _method, _props in self._in_progress.pop(req_id, ()):
+            self._send_response(_ch, _method, _props, *reply)
+
+    def _send_response(self, ch, method, properties, payload, content_type,
+                       content_encoding):
+        """Publish the response and ack the request.
+
+        Must run on the connection thread.
+        """
+        self._publish_reply(ch, properties,
+                            (payload, content_type, content_encoding))
+        # Acknowledge receiving the message.
+        ch.basic_ack(delivery_tag=method.delivery_tag)
+
+    def _publish_reply(self, ch, properties, reply, headers=None):
+        payload, content_type, content_encoding = reply
         _msg_props = MessageProperties(
-            content_type=_type,
-            content_encoding=_encoding,
-            correlation_id=_corr_id
+            content_type=content_type,
+            content_encoding=content_encoding,
+            correlation_id=properties.correlation_id,
+            headers=headers
         )
 
         ch.basic_publish(
             exchange=self._exchange,
             routing_key=properties.reply_to,
             properties=_msg_props,
-            body=_payload)
-        # Acknowledge receiving the message.
-        ch.basic_ack(delivery_tag=method.delivery_tag)
-
-    def _deserialize_data(self, data, content_type, content_encoding):
-        """Deserialize wire data.
-
-        Args:
-            data (str|dict): Data to deserialize.
-            content_encoding (str): The content encoding.
-            content_type (str): The content type. Defaults to `utf8`.
-        """
-        _data = None
-        if content_encoding is None:
-            content_encoding = 'utf8'
-        if content_type == ContentType.json:
-            _data = JSONSerializer.deserialize(data)
-        elif content_type == ContentType.text:
-            _data = data.decode(content_encoding)
-        elif content_type == ContentType.raw_bytes:
-            _data = data
-        else:
-            self.logger.warning(
-                    'Content-Type was not set in headers or is invalid!' + \
-                            ' Deserializing using default JSON serializer')
-            ## TODO: Not the proper way!!!!
-            _data = JSONSerializer.deserialize(data)
-        return _data
+            body=payload)
 
     def close(self):
         """Stop RPC Server.
@@ -245,9 +485,17 @@ class RpcServer(AMQPTransportSync):
         if self._channel.is_closed:
             self.logger.warning('Channel was already closed!')
             return False
-        self._channel.stop_consuming()
+        self._run_io(self._channel.stop_consuming)
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
+            self._executor = None
         # super(RpcServer, self).close()
         self.delete_queue(self._rpc_queue)
+        if self._broadcast_queue is not None:
+            self.delete_queue(self._broadcast_queue)
+        if self._shared is not None:
+            # Hand the channel back to the shared connection
+            self._shared.release_channel(self._channel)
         return True
 
     def stop(self):
@@ -263,31 +511,440 @@ class RpcServer(AMQPTransportSync):
         self.close()
 
 
+class RpcServiceHost(RpcServer):
+    """Hosts many RPCs on a single connection and channel.
+
+    The queues of all the registered RPCs are consumed by the same I/O loop
+    and requests are dispatched to their handlers by consumer tag. Workers,
+    prefetch window and replay cache are shared by all the RPCs.
+
+    Args:
+        handlers (dict): RPC name -> on-request callback.
+        name (str): Name of the host, used for logging.
+        **kwargs: Keyword arguments for the constructor of the base class
+            (RpcServer), except `rpc_name`, `on_request` and
+            `broadcast_exchange`. `prefetch_count` applies per RPC.
+    """
+
+    def __init__(self, handlers=None, name='rpc_host', *args, **kwargs):
+        """Constructor."""
+        RpcServer.__init__(self, name, *args, **kwargs)
+        self._handlers = OrderedDict(handlers or {})
+        # consumer tag -> RPC name
+        self._consumers = {}
+        # RPC name -> (queue name, consumer tag)
+        self._served = {}
+        self._running = False
+        # Thread driving the connection, when not shared
+        self._io_thread = None
+
+    @property
+    def procedures(self):
+        """Names of the hosted RPCs."""
+        return list(self._handlers)
+
+    def register(self, rpc_name, on_request):
+        """Host an RPC. Can be called while running.
+
+        Args:
+            rpc_name (str): The name of the RPC.
+            on_request (function): The on-request callback of the RPC.
+
+        Raises:
+            ValueError: The host is running and the RPC is already
+                registered on the broker. The other RPCs keep being served.
+        """
+        _new = rpc_name not in self._handlers
+        self._handlers[rpc_name] = on_request
+        if not (_new and self._running):
+            return
+        future = Future()
+        self._host_call(self._serve_guarded, rpc_name, future)
+        try:
+            future.result()
+        except Exception:
+            self._handlers.pop(rpc_name, None)
+            raise
+
+    def unregister(self, rpc_name):
+        """Stop hosting an RPC. Can be called while running."""
+        if self._handlers.pop(rpc_name, None) is not None and self._running:
+            self._host_call(self._unserve, rpc_name)
+
+    def _host_call(self, fn, *args):
+        """Run a channel operation on the thread driving the connection.
+
+        Channel operations of a SharedConnection are forwarded to its I/O
+        thread by `_run_io()`.
+        """
+        if self.shared or threading.current_thread() is self._io_thread:
+            fn(*args)
+            return
+        self._connection.add_callback_threadsafe(functools.partial(fn, *args))
+
+    def run(self):
+        """Run the host. Blocking function.
+
+        Raises:
+            ValueError: An RPC is already registered on the broker.
+        """
+        self.connect()
+        self._check_free()
+        self._run()
+
+    def run_async(self):
+        """Start serving without blocking. The connection is driven by the
+        caller, e.g. with `connection.process_data_events()`, or by the
+        SharedConnection.
+
+        Raises:
+            ValueError: An RPC is already registered on the broker.
+        """
+        self.connect()
+        self._check_free()
+        if not self.shared:
+            self._io_thread = threading.current_thread()
+        self._start()
+
+    def _run(self):
+        if not self.shared:
+            self._io_thread = threading.current_thread()
+        self._start()
+        if self.shared:
+            self._wait_closed()
+            return
+        try:
+            self._channel.start_consuming()
+        except Exception as exc:
+            self.logger.error(exc, exc_info=True)
+            raise exc
+
+    def run_threaded(self):
+        """Run the host in a separate thread.
+
+        When the connection is driven by a SharedConnection, requests are
+        served by its I/O thread and no thread is started.
+
+        Raises:
+            ValueError: An RPC is already registered on the broker.
+        """
+        self.connect()
+        self._check_free()
+        if self.shared:
+            self._start()
+            return
+        self.loop_thread = threading.Thread(target=self._run)
+        self.loop_thread.daemon = True
+        self.loop_thread.start()
+
+    def _start(self):
+        self._run_io(self._channel.basic_qos,
+                     prefetch_count=self._prefetch_count,
+                     global_qos=False)
+        self._start_executor()
+        for rpc_name in list(self._handlers):
+            self._serve(rpc_name)
+        self._running = True
+        self.logger.info('RPC host ready: {} procedures'.format(
+            len(self._served)))
+
+    def _serve(self, rpc_name):
+        if rpc_name in self._served or rpc_name not in self._handlers:
+            return
+        _queue = self.create_queue(rpc_name, queue_size=self._queue_size)
+        _tag = self._run_io(self._channel.basic_consume, _queue,
+                            self._on_request_wrapper)
+        self._consumers[_tag] = rpc_name
+        self._served[rpc_name] = (_queue, _tag)
+
+    def _rpc_taken(self, rpc_name):
+        """Check whether the queue of an RPC exists on the broker.
+
+        The queue is looked up on a throwaway channel: a failing declaration
+        closes the channel it is made on, which would stop all the RPCs of
+        the host.
+        """
+        if self._shared is not None:
+            _, _probe = self._shared.acquire_channel()
+        else:
+            _probe = self._connection.channel()
+        try:
+            self._run_io(_probe.queue_declare, rpc_name, passive=True)
+            return True
+        except pika.exceptions.ChannelClosedByBroker as exc:
+            # 404 when free, 405 when exclusive to another connection
+            return exc.reply_code != 404
+        finally:
+            if self._shared is not None:
+                self._shared.release_channel(_probe)
+            elif _probe.is_open:
+                _probe.close()
+
+    def _check_free(self):
+        """Raise if any of the initial RPCs is served by someone else."""
+        for rpc_name in self._handlers:
+            if rpc_name not in self._served and self._rpc_taken(rpc_name):
+                raise ValueError(
+                    'RPC <{}> allready registered on broker.'.format(
+                        rpc_name))
+
+    def _serve_guarded(self, rpc_name, future):
+        """Serve an RPC registered while running."""
+        try:
+            if self._rpc_taken(rpc_name):
+                raise ValueError(
+                    'RPC <{}> allready registered on broker.'.format(
+                        rpc_name))
+            self._serve(rpc_name)
+        except Exception as exc:
+            future.set_exception(exc)
+        else:
+            future.set_result(None)
+
+    def _unserve(self, rpc_name):
+        _served = self._served.pop(rpc_name, None)
+        if _served is None:
+            return
+        _queue, _tag = _served
+        self._run_io(self._channel.basic_cancel, _tag)
+        self._consumers.pop(_tag, None)
+        self.delete_queue(_queue)
+
+    def _get_handler(self, method):
+        return self._handlers.get(self._consumers.get(method.consumer_tag))
+
+    def close(self):
+        """Stop the host.
+        Safely close channel and connection to the broker.
+        """
+        if not self._channel:
+            return
+        if self._channel.is_closed:
+            self.logger.warning('Channel was already closed!')
+            return False
+        self._running = False
+        self._run_io(self._channel.stop_consuming)
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
+            self._executor = None
+        for _queue, _ in self._served.values():
+            self.delete_queue(_queue)
+        self._served.clear()
+        self._consumers.clear()
+        if self._shared is not None:
+            # Hand the channel back to the shared connection
+            self._shared.release_channel(self._channel)
+        return True
+
+
+class RpcFuture(Future):
+    """Future of an in-flight RPC call.
+
+    Resolved by the RpcClient when the response carrying the matching
+    correlation id arrives. Waiting on the result drives the I/O loop of the
+    client connection.
+
+    Args:
+        client (RpcClient): The client that issued the call.
+        corr_id (str): The correlation id of the call.
+    """
+
+    def __init__(self, client, corr_id):
+        super(RpcFuture, self).__init__()
+        self._client = client
+        self.corr_id = corr_id
+        self.meta = None
+        self.size = 0
+        self.t_sent = time.time()
+        # Resolved by an identical call in flight, through the cache
+        self.coalesced = False
+
+    def result(self, timeout=None):
+        """Wait for the response and return it.
+
+        Args:
+            timeout (float): Seconds to wait. None waits forever.
+
+        Raises:
+            concurrent.futures.TimeoutError: No response within timeout.
+        """
+        self._client.wait([self], timeout)
+        return super(RpcFuture, self).result(timeout=0)
+
+    def cancel(self):
+        """Stop waiting for the response of this call."""
+        self._client._discard_pending(self.corr_id)
+        return super(RpcFuture, self).cancel()
+
+
+class RpcGather(Future):
+    """Responses of a broadcasted RPC call.
+
+    Resolved when the expected number of responses has arrived. Responses
+    are added from the connection thread.
+
+    Args:
+        count (int): Number of responses to wait for. None waits until the
+            gather is abandoned.
+    """
+
+    def __init__(self, count=None):
+        super(RpcGather, self).__init__()
+        self.count = count
+        self.responses = []
+
+    def add(self, msg, meta):
+        self.responses.append((msg, meta))
+        if self.count is not None and len(self.responses) >= self.count \
+                and not self.done():
+            self.set_result(self.responses)
+
+
+class RpcStream(object):
+    """Iterator over the chunks of a streamed RPC response.
+
+    Chunks are yielded in sequence order as they arrive. An error frame, or
+    a timeout waiting for the next chunk, yields the error response and ends
+    the iteration. A plain (non-streamed) response is yielded as a single
+    chunk.
+
+    Args:
+        client (RpcClient): The client that issued the call.
+        corr_id (str): The correlation id of the call.
+        timeout (float): Seconds to wait for each chunk. None waits forever.
+    """
+
+    def __init__(self, client, corr_id, timeout=None):
+        self._client = client
+        self.corr_id = corr_id
+        self.timeout = timeout
+        self.meta = None
+        self.error = None
+        self._chunks = deque()
+        # Frames received out of order. seq -> (msg, headers)
+        self._buffer = {}
+        self._next_seq = 0
+        self._done = False
+        self._cond = threading.Condition()
+
+    @property
+    def done(self):
+        """True once the end of the stream has been received."""
+        return self._done
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        deadline = None if self.timeout is None else \
+            time.time() + self.timeout
+        while True:
+            with self._cond:
+                if self._chunks:
+                    return self._chunks.popleft()
+                if self._done:
+                    self.close()
+                    raise StopIteration
+                remaining = None if deadline is None else \
+                    deadline - time.time()
+                if remaining is not None and remaining <= 0:
+                    self.close()
+                    self.error = {'error': 'RPC Response timeout'}
+                    return self.error
+                if self._client.shared:
+                    # Frames are dispatched by the I/O thread
+                    self._cond.wait(remaining)
+                    continue
+            self._client._connection.process_data_events(
+                time_limit=remaining)
+
+    next = __next__
+
+    def close(self):
+        """Stop receiving the stream."""
+        self._done = True
+        self._client._streams.pop(self.corr_id, None)
+
+    def _on_frame(self, msg, meta, headers):
+        """Called by the client on the connection thread."""
+        headers = headers or {}
+        seq = headers.get(StreamHeaders.SEQ)
+        with self._cond:
+            self.meta = meta
+            if seq is None:
+                # Plain response of a non-streaming RPC
+                self._chunks.append(msg)
+                self._done = True
+            else:
+                self._buffer[seq] = (msg, headers)
+            while self._next_seq in self._buffer:
+                msg, headers = self._buffer.pop(self._next_seq)
+                self._next_seq += 1
+                if headers.get(StreamHeaders.END):
+                    self._done = True
+                elif headers.get(StreamHeaders.ERROR):
+                    self.error = msg
+                    self._chunks.append(msg)
+                    self._done = True
+                else:
+                    self._chunks.append(msg)
+            self._cond.notify_all()
+
+
 class RpcClient(AMQPTransportSync):
     """AMQP RPC Client class.
 
+    Calls are matched to responses by correlation id, so many calls can be
+    in flight at the same time over the single direct reply-to consumer
+    (see `call_async()`).
+
     Args:
         rpc_name (str): The name of the RPC.
+        use_corr_id (bool): Deprecated. Correlation ids are always used.
+        serializer (Serializer|str): Serializer of structured requests, or
+            its content type. Defaults to the default of the serializer
+            registry (JSON).
+        cache (ResponseCache|bool): Cache responses of idempotent RPCs.
+            Pass True for a cache with the default settings, or a
+            ResponseCache, which may be shared by many clients.
         **kwargs: The Keyword arguments to pass to  the base class
             (AMQPTransportSync).
     """
-    _SERIALIZER = JSONSerializer
+    _SERIALIZER = None
 
-    def __init__(self, rpc_name, use_corr_id=False, *args, **kwargs):
+    def __init__(self, rpc_name, use_corr_id=False, serializer=None,
+                 cache=None, *args, **kwargs):
         """Constructor."""
         self._name = rpc_name
         self._rpc_name = rpc_name
+        if serializer is not None:
+            self._SERIALIZER = serializer_registry.resolve(serializer)
         AMQPTransportSync.__init__(self, *args, **kwargs)
         self.connect()
         self.corr_id = None
         self._response = None
+        self._response_meta = None
         self._exchange = ExchangeTypes.Default
         self._mean_delay = 0
         self._delay = 0
         self.onresponse = None
         self.use_corr_id = use_corr_id
+        # In-flight calls. correlation_id -> RpcFuture
+        self._pending = {}
+        self._pending_lock = threading.Lock()
+        # In-flight streamed calls. correlation_id -> RpcStream
+        self._streams = {}
+        # In-flight broadcasts. correlation_id -> RpcGather
+        self._broadcasts = {}
+        self._broadcast_exchanges = set()
+        if cache is True:
+            cache = ResponseCache()
+        elif cache is False:
+            cache = None
+        self._cache = cache
 
-        self._consumer_tag = self._channel.basic_consume(
+        self._consumer_tag = self._run_io(
+            self._channel.basic_consume,
             'amq.rabbitmq.reply-to',
             self._on_response,
             exclusive=False,
@@ -306,61 +963,293 @@ class RpcClient(AMQPTransportSync):
         """
         return self._delay
 
-    def _on_response(self, ch, method, properties, body):
-        _ctype = None
-        _cencoding = None
-        _ts_send = None
-        _ts_broker = 0
-        _dmode = None
-        _msg = None
-        _meta = None
-        try:
-            if self.use_corr_id:
-                _corr_id = properties.correlation_id
-                if self.corr_id != _corr_id:
-                    return
-            _ctype = properties.content_type
-            _cencoding = properties.content_encoding
-            if hasattr(self, 'headers'):
-                if 'timestamp_in_ms' in properties.headers:
-                    _ts_broker = properties.headers['timestamp_in_ms']
-
-            _dmode = properties.delivery_mode
-            _ts_send = properties.timestamp
-
-            _meta = {
-                'channel': ch,
-                'method': method,
-                'properties': {
-                    'content_type': _ctype,
-                    'content_encoding': _cencoding,
-                    'timestamp_broker': _ts_broker,
-                    'timestamp_producer': _ts_send,
-                    'delivery_mode': _dmode
-                }
-            }
-        except Exception:
-            self.logger.error("Error parsing response from rpc server.",
-                              exc_info=True)
+    @property
+    def pending(self):
+        """Number of in-flight calls."""
+        return len(self._pending)
 
-        try:
-            _msg = self._deserialize_data(body, _ctype, _cencoding)
-        except Exception:
-            self.logger.error("Could not deserialize data",
-                              exc_info=True)
-            _msg = body
+    @property
+    def cache(self):
+        """The ResponseCache of the client, or None."""
+        return self._cache
+
+    def _pop_pending(self, corr_id):
+        with self._pending_lock:
+            future = self._pending.pop(corr_id, None)
+            if future is None and corr_id is None and \
+                    len(self._pending) == 1:
+                # Server does not echo correlation ids. Only safe to match
+                # when a single call is in flight.
+                _, future = self._pending.popitem()
+        return future
+
+    def _discard_pending(self, corr_id):
+        with self._pending_lock:
+            self._pending.pop(corr_id, None)
+
+    def _on_response(self, ch, method, properties, body):
+        _corr_id = properties.correlation_id
+        stream = self._streams.get(_corr_id)
+        if stream is not None:
+            stream._on_frame(self._decode_response(body, properties),
+                             DeliveryMeta(ch, method, properties),
+                             properties.headers)
+            if stream.done:
+                self._streams.pop(_corr_id, None)
+            return
+        gather = self._broadcasts.get(_corr_id)
+        if gather is not None:
+            gather.add(self._decode_response(body, properties),
+                       DeliveryMeta(ch, method, properties))
+            return
+        future = self._pop_pending(_corr_id)
+        if future is None:
+            self.logger.debug(
+                'Dropping response with unknown correlation id <%s>',
+                _corr_id)
+            return
 
+        _msg = self._decode_response(body, properties)
+        _meta = DeliveryMeta(ch, method, properties)
+        future.size = len(body)
 
+        self._delay = time.time() - future.t_sent
         self._response = _msg
         self._response_meta = _meta
 
+        future.meta = _meta
+        if not future.done():
+            future.set_result(_msg)
+
         if self.onresponse is not None:
             self.onresponse(_msg, _meta)
 
+    def _decode_response(self, body, properties):
+        try:
+            return self._deserialize_data(body, properties.content_type,
+                                          properties.content_encoding)
+        except Exception:
+            self.logger.error("Could not deserialize data",
+                              exc_info=True)
+            return body
+
     def gen_corr_id(self):
         """Generate correlationID."""
         return str(uuid.uuid4())
 
+    def call_async(self, msg, rpc_name=None):
+        """Send an RPC request without waiting for the response.
+
+        Args:
+            msg (dict|Message): The message to send.
+            rpc_name (str): The RPC to call. Defaults to the RPC of the
+                client.
+
+        Returns:
+            RpcFuture: Resolved with the response of the call.
+        """
+        return self._start_calls([(rpc_name, msg)])[0][0]
+
+    def _new_future(self):
+        return RpcFuture(self, self.gen_corr_id())
+
+    def _start_calls(self, calls):
+        """Start calls. Requests not served by the cache are sent with a
+        single hop to the I/O thread.
+
+        Args:
+            calls (list): (rpc_name, msg) tuples.
+
+        Returns:
+            list: (future, cache key) tuples. The key is None for calls
+                that bypass the cache.
+        """
+        results = []
+        futures = []
+        requests = []
+        for rpc_name, msg in calls:
+            if rpc_name is None:
+                rpc_name = self._rpc_name
+            if isinstance(msg, Message):
+                msg = msg.to_dict()
+            key = None
+            if self._cache is not None and self._cache.ttl_for(rpc_name):
+                key = (rpc_name, self._canonical_request(msg))
+                future, leader = self._cache.acquire(key, self._new_future)
+                future.coalesced = not leader and not future.done()
+            else:
+                future, leader = self._new_future(), True
+            results.append((future, key))
+            if leader:
+                futures.append(future)
+                requests.append((msg, future.corr_id, rpc_name))
+        if not futures:
+            return results
+        self.corr_id = futures[-1].corr_id
+        with self._pending_lock:
+            for future in futures:
+                self._pending[future.corr_id] = future
+        try:
+            self._run_io(self._send_many, requests)
+        except Exception as exc:
+            for future in futures:
+                self._discard_pending(future.corr_id)
+                # Fails the coalesced calls waiting on it too
+                future.set_exception(exc)
+            raise
+        return results
+
+    def _abandon(self, future, key):
+        """Stop waiting on a call that timed out."""
+        if key is None:
+            future.cancel()
+        else:
+            self._cache.release(key, future)
+
+    def _canonical_request(self, msg):
+        """Request bytes used as cache key. Structured requests are
+        encoded as JSON with sorted keys."""
+        if isinstance(msg, bytes):
+            return msg
+        if isinstance(msg, unicode):
+            return msg.encode('utf8')
+        try:
+            return json.dumps(msg, sort_keys=True,
+                              separators=(',', ':')).encode('utf8')
+        except (TypeError, ValueError):
+            return serializer_registry.serialize(msg, self._SERIALIZER)[0]
+
+    def _send_many(self, requests):
+        for data, corr_id, rpc_name in requests:
+            self._send_data(data, corr_id, rpc_name)
+
+    def call_many(self, calls, timeout=5.0):
+        """Call many RPCs at once.
+
+        All requests are sent before waiting, so the calls are served
+        concurrently and the total wait is bounded by a single deadline.
+
+        Args:
+            calls (list): (rpc_name, msg) tuples.
+            timeout (float): Deadline, in seconds, for all responses.
+
+        Returns:
+            list: The responses, in the order of the calls. Calls not
+                responded within the timeout get an error response, as in
+                `call()`.
+        """
+        calls = list(calls)
+        if not calls:
+            return []
+        results = self._start_calls(calls)
+        self.wait([future for future, _ in results], timeout)
+        resps = []
+        for future, key in results:
+            if future.done() and not future.cancelled():
+                resps.append(future.result(timeout=0))
+            else:
+                self._abandon(future, key)
+                resps.append({'error': 'RPC Response timeout'})
+        return resps
+
+    def call_stream(self, msg, timeout=5.0, rpc_name=None):
+        """Call an RPC whose handler streams its response.
+
+        Args:
+            msg (dict|Message): The message to send.
+            timeout (float): Seconds to wait for each chunk.
+            rpc_name (str): The RPC to call. Defaults to the RPC of the
+                client.
+
+        Returns:
+            RpcStream: Iterator over the chunks of the response.
+        """
+        if rpc_name is None:
+            rpc_name = self._rpc_name
+        if isinstance(msg, Message):
+            msg = msg.to_dict()
+        corr_id = self.gen_corr_id()
+        stream = RpcStream(self, corr_id, timeout)
+        self._streams[corr_id] = stream
+        try:
+            self._run_io(self._send_data, msg, corr_id, rpc_name)
+        except Exception:
+            self._streams.pop(corr_id, None)
+            raise
+        return stream
+
+    def broadcast(self, msg, exchange=None, count=None, timeout=1.0):
+        """Send a request to all the servers of a broadcast exchange and
+        gather their responses.
+
+        Servers join with the `broadcast_exchange` argument of RpcServer.
+
+        Args:
+            msg (dict|Message): The message to send.
+            exchange (str): The broadcast exchange. Defaults to the RPC name
+                of the client.
+            count (int): Return as soon as that many responses arrive.
+                Defaults to gathering until the timeout.
+            timeout (float): Seconds to gather responses.
+
+        Returns:
+            list: (response, meta) tuples, in order of arrival.
+        """
+        if exchange is None:
+            exchange = self._rpc_name
+        if exchange not in self._broadcast_exchanges:
+            self.create_exchange(exchange, ExchangeTypes.Fanout)
+            self._broadcast_exchanges.add(exchange)
+        if isinstance(msg, Message):
+            msg = msg.to_dict()
+        corr_id = self.gen_corr_id()
+        gather = RpcGather(count)
+        self._broadcasts[corr_id] = gather
+        try:
+            self._run_io(self._send_data, msg, corr_id, '', exchange)
+            self.wait([gather], timeout)
+        finally:
+            del self._broadcasts[corr_id]
+        return gather.responses
+
+    submit = call_async
+
+    def wait(self, futures, timeout=None):
+        """Wait for in-flight calls to complete.
+
+        Processes connection events until all futures are resolved or the
+        timeout expires.
+
+        Args:
+            futures (list): RpcFuture instances returned by `call_async()`.
+            timeout (float): Seconds to wait. None waits forever.
+
+        Returns:
+            tuple: (done, not_done) lists of futures.
+        """
+        if self.shared:
+            # Responses are dispatched by the I/O thread of the connection
+            done, not_done = futures_wait(futures, timeout)
+            return list(done), list(not_done)
+        deadline = None if timeout is None else time.time() + timeout
+        while True:
+            not_done = [f for f in futures if not f.done()]
+            if not not_done:
+                break
+            time_limit = None
+            if deadline is not None:
+                time_limit = deadline - time.time()
+                if time_limit <= 0:
+                    break
+            if any(getattr(f, 'coalesced', False) for f in not_done):
+                # Coalesced calls may be resolved by another client, without
+                # events on this connection
+                time_limit = 0.01 if time_limit is None else \
+                    min(time_limit, 0.01)
+            self._connection.process_data_events(time_limit=time_limit)
+        done = [f for f in futures if f.done()]
+        return done, not_done
+
     def call(self, msg, timeout=5.0):
         """Call RPC.
 
@@ -370,82 +1259,34 @@ class RpcClient(AMQPTransportSync):
                 based on application criteria.
         """
         self._response = None
-        if self.use_corr_id:
-            self.corr_id = self.gen_corr_id()
-        if isinstance(msg, Message):
-            data = msg.to_dict()
-        else:
-            data = msg
-        self._send_data(data)
-        start_t = time.time()
-        self._wait_for_response(timeout)
-        ## TODO: Validate correlation_id
-        elapsed_t = time.time() - start_t
-        self._delay = elapsed_t
-
-        if self._response is None:
+        future, key = self._start_calls([(None, msg)])[0]
+        self.logger.debug('Waiting for response from [%s]...', self._rpc_name)
+        try:
+            resp = future.result(timeout)
+        except (FutureTimeoutError, CancelledError):
+            self._abandon(future, key)
             resp = {'error': 'RPC Response timeout'}
-        else:
-            resp = self._response
         return resp
 
-    def _wait_for_response(self, timeout):
-        self.logger.debug('Waiting for response from [%s]...', self._rpc_name)
-        self._connection.process_data_events(time_limit=timeout)
-
-    def _deserialize_data(self, data, content_type, content_encoding):
-        """Deserialize wire data.
-
-        Args:
-            data: Data to deserialize.
-            content_encoding (str): The content encoding.
-            content_type (str): The content type. Defaults to `utf8`
-        """
-        _data = None
-        if content_encoding is None:
-            content_encoding = 'utf8'
-        if content_type == ContentType.json:
-            _data = JSONSerializer.deserialize(data)
-        elif content_type == ContentType.text:
-            _data = data.decode(content_encoding)
-        elif content_type == ContentType.raw_bytes:
-            _data = data
-        return _data
-
-    def _send_data(self, data):
-        _payload = None
-        _encoding = None
-        _type = None
-
-        if isinstance(data, dict):
-            _payload = self._SERIALIZER.serialize(data).encode('utf-8')
-            _encoding = self._SERIALIZER.CONTENT_ENCODING
-            _type = self._SERIALIZER.CONTENT_TYPE
-        elif isinstance(data, str):
-            _type = 'text/plain'
-            _encoding = 'utf8'
-            _payload = data
-        elif isinstance(msg, bytes):
-            _type = 'application/octet-stream'
-            _encoding = 'utf8'
-            _payload = data
+    def _send_data(self, data, corr_id=None, rpc_name=None, exchange=None):
+        _payload, _type, _encoding = serializer_registry.serialize(
+            data, self._SERIALIZER)
 
         # Direct reply-to implementation
         _rpc_props = MessageProperties(
             content_type=_type,
             content_encoding=_encoding,
-            correlation_id=self.corr_id,
+            correlation_id=corr_id,
             # timestamp=(1.0 * (time.time() + 0.5) * 1000),
-            message_id=0,
+            message_id=corr_id,
             # user_id="",
             # app_id="",
             reply_to='amq.rabbitmq.reply-to'
         )
 
         self._channel.basic_publish(
-            exchange=self._exchange,
-            routing_key=self._rpc_name,
+            exchange=self._exchange if exchange is None else exchange,
+            routing_key=self._rpc_name if rpc_name is None else rpc_name,
             mandatory=False,
             properties=_rpc_props,
             body=_payload)
-
@@ -24,6 +24,27 @@ from __future__ import (
 )
 
 import json
+import struct
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+try:
+    import cbor2
+except ImportError:
+    cbor2 = None
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
 
 
 class ContentType(object):
@@ -31,6 +52,10 @@ class ContentType(object):
     json = 'application/json'
     raw_bytes = 'application/octet-stream'
     text = 'plain/text'
+    text_plain = 'text/plain'
+    msgpack = 'application/msgpack'
+    cbor = 'application/cbor'
+    ndarray = 'application/x-ndarray'
 
 
 class Serializer(object):
@@ -47,11 +72,6 @@ class Serializer(object):
         raise NotImplementedError()
 
 
-# class ByteSerializer(Serializer):
-#     CONTENT_TYPE = 'application/octet-stream'
-#     CONTENT_ENCODING = 'utf8'
-
-
 class JSONSerializer(Serializer):
     """Thin wrapper to implement json serializer.
 
@@ -69,3 +89,262 @@ class JSONSerializer(Serializer):
     @staticmethod
     def deserialize(data):
         return json.loads(data)
+
+
+class ORJSONSerializer(Serializer):
+    """JSON serializer using orjson. Requires the `orjson` package.
+
+    Not used by default. Register it to replace the standard library
+    JSON codec:
+
+        serializer_registry.register(ORJSONSerializer)
+    """
+    CONTENT_TYPE = 'application/json'
+    CONTENT_ENCODING = 'utf8'
+
+    @staticmethod
+    def serialize(_dict):
+        if not isinstance(_dict, dict):
+            raise TypeError('Data are not in dict structure.')
+        return orjson.dumps(_dict)
+
+    @staticmethod
+    def deserialize(data):
+        return orjson.loads(data)
+
+
+class TextSerializer(Serializer):
+    """Plain text serializer."""
+    CONTENT_TYPE = 'text/plain'
+    CONTENT_ENCODING = 'utf8'
+
+    @staticmethod
+    def serialize(text):
+        return text.encode('utf8')
+
+    @staticmethod
+    def deserialize(data, encoding='utf8'):
+        return data.decode(encoding)
+
+
+class BytesSerializer(Serializer):
+    """Raw bytes. Data are passed as is."""
+    CONTENT_TYPE = 'application/octet-stream'
+    CONTENT_ENCODING = 'utf8'
+
+    @staticmethod
+    def serialize(data):
+        return data
+
+    @staticmethod
+    def deserialize(data):
+        return data
+
+
+class MsgpackSerializer(Serializer):
+    """MessagePack serializer. Requires the `msgpack` package."""
+    CONTENT_TYPE = 'application/msgpack'
+    CONTENT_ENCODING = 'binary'
+
+    @staticmethod
+    def serialize(_dict):
+        return msgpack.packb(_dict, use_bin_type=True)
+
+    @staticmethod
+    def deserialize(data):
+        return msgpack.unpackb(data, raw=False)
+
+
+class CBORSerializer(Serializer):
+    """CBOR serializer. Requires the `cbor2` package."""
+    CONTENT_TYPE = 'application/cbor'
+    CONTENT_ENCODING = 'binary'
+
+    @staticmethod
+    def serialize(_dict):
+        return cbor2.dumps(_dict)
+
+    @staticmethod
+    def deserialize(data):
+        return cbor2.loads(data)
+
+
+class NDArraySerializer(Serializer):
+    """NumPy ndarray serializer. Requires the `numpy` package.
+
+    Wire format is a small header followed by the raw (C-contiguous) array
+    buffer:
+
+        magic (4 bytes) | ndim (uint8) | len(dtype) (uint8) | dtype |
+        shape (ndim x uint64) | padding to 16 bytes | data
+
+    The dtype is stored as `numpy.dtype.str`, which includes byte order.
+    Deserialized arrays are views over the received body (no copy) and
+    therefore read-only.
+    """
+    CONTENT_TYPE = 'application/x-ndarray'
+    CONTENT_ENCODING = 'binary'
+
+    MAGIC = b'NDA1'
+    _PREFIX = struct.Struct('<4sBB')
+    _ALIGN = 16
+
+    @staticmethod
+    def serialize(arr):
+        if not arr.flags.c_contiguous:
+            arr = np.ascontiguousarray(arr)
+        if arr.dtype.hasobject or arr.dtype.fields is not None:
+            raise TypeError(
+                'Unsupported dtype <{}>. Only plain dtypes can be '
+                'serialized.'.format(arr.dtype))
+        _dtype = arr.dtype.str.encode('ascii')
+        header = NDArraySerializer._PREFIX.pack(
+            NDArraySerializer.MAGIC, arr.ndim, len(_dtype)) + _dtype + \
+            struct.pack('<{}Q'.format(arr.ndim), *arr.shape)
+        header += b'\0' * (-len(header) % NDArraySerializer._ALIGN)
+        return b''.join((header, arr.data))
+
+    @staticmethod
+    def deserialize(data):
+        _prefix = NDArraySerializer._PREFIX
+        magic, ndim, dtype_len = _prefix.unpack_from(data, 0)
+        if magic != NDArraySerializer.MAGIC:
+            raise ValueError('Not an ndarray payload')
+        offset = _prefix.size
+        _dtype = np.dtype(bytes(data[offset:offset + dtype_len]).decode(
+            'ascii'))
+        offset += dtype_len
+        shape = struct.unpack_from('<{}Q'.format(ndim), data, offset)
+        offset += 8 * ndim
+        offset += -offset % NDArraySerializer._ALIGN
+        count = 1
+        for dim in shape:
+            count *= dim
+        return np.frombuffer(data, dtype=_dtype, count=count,
+                             offset=offset).reshape(shape)
+
+
+class SerializerRegistry(object):
+    """Registry of serializers keyed by content-type.
+
+    Senders pick the serializer by the type of the data (e.g. strings are
+    sent as `text/plain` and bytes as `application/octet-stream`), else the
+    requested serializer of structured data (dicts) is used. Receivers
+    dispatch on the `content_type` property of the message.
+
+    Args:
+        default (Serializer): Serializer of structured data when none is
+            requested explicitly.
+    """
+
+    def __init__(self, default=JSONSerializer):
+        self._serializers = {}
+        self._types = []
+        self.default = default
+
+    def register(self, serializer, content_types=None, types=None):
+        """Register a serializer.
+
+        Args:
+            serializer (Serializer): The serializer.
+            content_types (list): Content types to register the serializer
+                for. Defaults to its CONTENT_TYPE.
+            types (tuple): Python types always encoded with this
+                serializer, regardless of the requested one.
+        """
+        if content_types is None:
+            content_types = [serializer.CONTENT_TYPE]
+        for ctype in content_types:
+            self._serializers[ctype] = serializer
+        if types is not None:
+            self._types.append((types, serializer))
+        if self.default is not None and \
+                self.default.CONTENT_TYPE in content_types:
+            self.default = serializer
+
+    def unregister(self, content_type):
+        self._serializers.pop(content_type, None)
+
+    def get(self, content_type):
+        """Return the serializer of a content type or None."""
+        return self._serializers.get(content_type)
+
+    def resolve(self, serializer):
+        """Resolve a serializer given either the serializer itself or its
+        content type. None resolves to the default serializer."""
+        if serializer is None:
+            return self.default
+        if isinstance(serializer, str):
+            _ser = self.get(serializer)
+            if _ser is None:
+                raise ValueError(
+                    'No serializer registered for <{}>'.format(serializer))
+            return _ser
+        return serializer
+
+    @property
+    def content_types(self):
+        return list(self._serializers.keys())
+
+    def __contains__(self, content_type):
+        return content_type in self._serializers
+
+    def serialize(self, data, serializer=None):
+        """Serialize outgoing data.
+
+        Args:
+            data (dict|str|bytes|numpy.ndarray): The data to serialize.
+            serializer (Serializer|str): Serializer of structured data.
+                Defaults to the default serializer of the registry.
+
+        Returns:
+            tuple: (payload, content_type, content_encoding)
+        """
+        for _types, _ser in self._types:
+            if isinstance(data, _types):
+                break
+        else:
+            _ser = self.resolve(serializer)
+        _payload = _ser.serialize(data)
+        if isinstance(_payload, str):
+            _payload = _payload.encode('utf-8')
+        return _payload, _ser.CONTENT_TYPE, _ser.CONTENT_ENCODING
+
+    def deserialize(self, data, content_type=None, content_encoding=None):
+        """Deserialize wire data, dispatching on content type.
+
+        Data without a content type are decoded with the default serializer.
+        Data of unknown content type are returned as is.
+
+        Args:
+            data (bytes): Data to deserialize.
+            content_type (str): The content type.
+            content_encoding (str): The content encoding. Defaults to `utf8`.
+        """
+        if content_type is None:
+            return self.default.deserialize(data)
+        _ser = self._serializers.get(content_type)
+        if _ser is None:
+            return data
+        if _ser is TextSerializer:
+            if content_encoding is None:
+                content_encoding = 'utf8'
+            return _ser.deserialize(data, content_encoding)
+        return _ser.deserialize(data)
+
+
+serializer_registry = SerializerRegistry()
+serializer_registry.register(JSONSerializer)
+serializer_registry.register(TextSerializer,
+                             [ContentType.text_plain, ContentType.text],
+                             types=(str,))
+serializer_registry.register(BytesSerializer,
+                             types=(bytes, bytearray, memoryview))
+if msgpack is not None:
+    serializer_registry.register(
+        MsgpackSerializer,
+        [ContentType.msgpack, 'application/x-msgpack'])
+if cbor2 is not None:
+    serializer_registry.register(CBORSerializer)
+if np is not None:
+    serializer_registry.register(NDArraySerializer, types=(np.ndarray,))
@@ -18,29 +18,32 @@
 
 from __future__ import absolute_import
 
+import heapq
+import itertools
 import threading
 import time
 import sys
 
-from .rate import Rate
+from .rate import Rate, monotonic
+from .r4a_logger import create_logger
+
+
+class TimerEvent:
+    def __init__(self, last_expected, last_real,
+                 current_expected, current_real,
+                 last_duration):
+        self.last_expected = last_expected
+        self.last_real = last_real
+        self.current_expected = current_expected
+        self.current_real = current_real
+        self.last_duration = last_duration
 
 
 if sys.version_info[0] < 3:
     Timer = threading.Timer
 else:
-    class TimerEvent:
-        def __init__(self, last_expected, last_real,
-                     current_expected, current_real,
-                     last_duration):
-            self.last_expected = last_expected
-            self.last_real = last_real
-            self.current_expected = current_expected
-            self.current_real = current_real
-            self.last_duration = last_duration
-
-
     class Timer(threading.Timer):
-        def __init__(self, period, callback, oneshot=False):
+        def __init__(self, period, callback, oneshot=False, scheduler=None):
             """
             Constructor.
             @param period: desired period between callbacks in seconds
@@ -50,23 +53,46 @@ else:
             @param oneshot: if True, fire only once, otherwise fire continuously
                 until shutdown is called [default: False]
             @type oneshot: bool
+            @param scheduler: run on a shared TimerScheduler instead of a
+                dedicated thread [default: None]
+            @type scheduler: TimerScheduler
             """
-            super(Timer, self).__init__()
+            super(Timer, self).__init__(period, callback)
             self._period = period
             self._callback = callback
             self._oneshot = oneshot
             self._shutdown = False
+            self._rate = None
+            self._scheduler = scheduler
+            self._handle = None
             self.setDaemon(True)
 
+        def start(self):
+            if self._scheduler is None:
+                return super(Timer, self).start()
+            self._handle = self._scheduler.add(
+                self._period, self._callback, oneshot=self._oneshot)
+
         def shutdown(self):
             """
             Stop firing callbacks.
             """
             self._shutdown = True
+            if self._handle is not None:
+                self._handle.cancel()
+
+        @property
+        def rate(self):
+            """The Rate driving the timer. Exposes overrun and jitter
+            statistics."""
+            return self._rate
 
         def run(self):
             r = Rate(1.0 / self._period)
-            current_expected = time.time() + self._period
+            self._rate = r
+            # Scheduling runs on the monotonic clock. Offset to report
+            # wall-clock times in TimerEvents.
+            wall_offset = time.time() - monotonic()
             last_expected, last_real, last_duration = None, None, None
             while True:
                 try:
@@ -78,6 +104,7 @@ else:
                     break
                 start = time.time()
                 current_real = start
+                current_expected = r.last_deadline + wall_offset
                 self._callback(TimerEvent(last_expected, last_real,
                                           current_expected,
                                           current_real,
@@ -86,4 +113,218 @@ else:
                     break
                 last_duration = time.time() - start
                 last_expected, last_real = current_expected, current_real
-                current_expected += self._period
+
+
+class ScheduledTimer(object):
+    """Handle of a timer hosted by a TimerScheduler.
+
+    Holds the timing state of the timer and its late-fire statistics.
+    """
+
+    __slots__ = ['period', 'callback', 'oneshot', 'cancelled', 'deadline',
+                 'fires', 'late_fires', 'missed', 'max_lateness',
+                 'total_lateness', 'last_expected', 'last_real',
+                 'last_duration', '_scheduler']
+
+    def __init__(self, scheduler, period, callback, oneshot, deadline):
+        self._scheduler = scheduler
+        self.period = period
+        self.callback = callback
+        self.oneshot = oneshot
+        self.cancelled = False
+        self.deadline = deadline
+        self.fires = 0
+        self.late_fires = 0
+        self.missed = 0
+        self.max_lateness = 0.0
+        self.total_lateness = 0.0
+        self.last_expected = None
+        self.last_real = None
+        self.last_duration = None
+
+    @property
+    def active(self):
+        return not self.cancelled
+
+    def cancel(self):
+        """Stop firing. Safe to call from any thread, including from the
+        callback itself."""
+        self.cancelled = True
+
+    def stats(self):
+        return {
+            'period': self.period,
+            'fires': self.fires,
+            'late_fires': self.late_fires,
+            'missed': self.missed,
+            'mean_lateness': (self.total_lateness / self.fires
+                              if self.fires else 0.0),
+            'max_lateness': self.max_lateness
+        }
+
+
+class TimerScheduler(object):
+    """Runs many periodic and one-shot timers on a single thread.
+
+    Timers are kept in a heap ordered by deadline, on the monotonic clock,
+    so adding or firing a timer costs O(log n) regardless of how many
+    timers are hosted. Periodic timers are rescheduled from their expected
+    fire time, not from the time they actually fired, so they do not
+    drift; cycles missed by a late timer are skipped.
+
+    Callbacks receive a TimerEvent, like Timer callbacks, and are executed
+    in sequence on the scheduler thread. Long-running callbacks delay the
+    other timers and should hand work off to another thread.
+
+    Args:
+        late_threshold (float): A fire later than this many seconds
+            counts as a late fire.
+        start (bool): Start the scheduler thread on construction.
+    """
+
+    def __init__(self, late_threshold=0.005, start=True):
+        self.late_threshold = late_threshold
+        self.logger = create_logger(self.__class__.__name__)
+        self._heap = []
+        self._seq = itertools.count()
+        self._cond = threading.Condition()
+        self._thread = None
+        self._running = False
+        self.fires = 0
+        self.late_fires = 0
+        self.max_lateness = 0.0
+        if start:
+            self.start()
+
+    @property
+    def is_running(self):
+        return self._running
+
+    @property
+    def num_timers(self):
+        """Number of active timers."""
+        with self._cond:
+            return sum(1 for entry in self._heap if not entry[2].cancelled)
+
+    def add(self, period, callback, oneshot=False, delay=None):
+        """Add a timer.
+
+        Args:
+            period (float): Period between callbacks in seconds.
+            callback (function): Callback taking a TimerEvent.
+            oneshot (bool): Fire only once.
+            delay (float): Time to the first fire. Defaults to `period`.
+
+        Returns:
+            ScheduledTimer: Handle of the timer. Use `cancel()` to stop it.
+        """
+        if period <= 0:
+            raise ValueError('Timer period must be > 0')
+        if delay is None:
+            delay = period
+        deadline = monotonic() + delay
+        timer = ScheduledTimer(self, period, callback, oneshot, deadline)
+        self._push(timer)
+        return timer
+
+    def call_later(self, delay, callback):
+        """Fire a callback once after `delay` seconds."""
+        return self.add(max(delay, 1e-9), callback, oneshot=True,
+                        delay=delay)
+
+    def _push(self, timer):
+        with self._cond:
+            heapq.heappush(self._heap,
+                           (timer.deadline, next(self._seq), timer))
+            # Wake up the scheduler if this is the new earliest deadline
+            if self._heap[0][2] is timer:
+                self._cond.notify()
+
+    def start(self):
+        if self._running:
+            return
+        self._running = True
+        self._thread = threading.Thread(target=self.run)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self, wait=True):
+        """Stop the scheduler thread. Timers are kept."""
+        with self._cond:
+            self._running = False
+            self._cond.notify()
+        if wait and self._thread is not None and \
+                self._thread is not threading.current_thread():
+            self._thread.join()
+        self._thread = None
+
+    def run(self):
+        """Scheduler loop. Blocking; `start()` runs it in a thread."""
+        self._running = True
+        wall_offset = time.time() - monotonic()
+        while True:
+            with self._cond:
+                timer = None
+                while self._running:
+                    if not self._heap:
+                        self._cond.wait()
+                        continue
+                    deadline, _, timer = self._heap[0]
+                    if timer.cancelled:
+                        heapq.heappop(self._heap)
+                        timer = None
+                        continue
+                    remaining = deadline - monotonic()
+                    if remaining <= 0:
+                        heapq.heappop(self._heap)
+                        break
+                    timer = None
+                    self._cond.wait(remaining)
+                if not self._running:
+                    return
+            self._fire(timer, wall_offset)
+            if not timer.oneshot and not timer.cancelled:
+                self._push(timer)
+
+    def _fire(self, timer, wall_offset):
+        start = monotonic()
+        lateness = start - timer.deadline
+        current_expected = timer.deadline + wall_offset
+        current_real = start + wall_offset
+        timer.fires += 1
+        self.fires += 1
+        timer.total_lateness += lateness
+        if lateness > timer.max_lateness:
+            timer.max_lateness = lateness
+        if lateness > self.max_lateness:
+            self.max_lateness = lateness
+        if lateness > self.late_threshold:
+            timer.late_fires += 1
+            self.late_fires += 1
+        try:
+            timer.callback(TimerEvent(timer.last_expected, timer.last_real,
+                                      current_expected, current_real,
+                                      timer.last_duration))
+        except Exception:
+            self.logger.error('Timer callback raised an exception',
+                              exc_info=True)
+        end = monotonic()
+        timer.last_duration = end - start
+        timer.last_expected = current_expected
+        timer.last_real = current_real
+        # Next deadline on the original schedule, skipping missed cycles
+        deadline = timer.deadline + timer.period
+        if deadline <= end:
+            behind = int((end - deadline) // timer.period) + 1
+            timer.missed += behind
+            deadline += behind * timer.period
+        timer.deadline = deadline
+
+    def stats(self):
+        """Late-fire statistics of the scheduler."""
+        return {
+            'timers': self.num_timers,
+            'fires': self.fires,
+            'late_fires': self.late_fires,
+            'max_lateness': self.max_lateness
+        }
@@ -0,0 +1,173 @@
+# -*- coding: utf-8 -*-
+# Copyright (C) 2020  Panayiotou, Konstantinos <klpanagi@gmail.com>
+# Author: Panayiotou, Konstantinos <klpanagi@gmail.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+from __future__ import (
+    absolute_import,
+    division,
+    print_function,
+    unicode_literals
+)
+
+import threading
+
+
+class _Node(object):
+    __slots__ = ['children', 'values']
+
+    def __init__(self):
+        self.children = {}
+        # Replaced, never mutated, so that readers need no lock
+        self.values = ()
+
+
+class TopicTrie(object):
+    """Maps AMQP topic patterns to values.
+
+    Patterns are split into words on `.`; `*` matches exactly one word and
+    `#` matches zero or more words, as in AMQP topic exchanges. A routing
+    key is matched against all patterns in a single walk of the trie and
+    results are cached per routing key, so repeated keys are resolved with
+    a dict lookup.
+
+    Mutations are serialized by a lock; `match()` takes no lock and may run
+    concurrently with them.
+
+    Args:
+        cache_size (int): Maximum number of cached routing keys.
+    """
+
+    def __init__(self, cache_size=4096):
+        self._root = _Node()
+        self._lock = threading.Lock()
+        self._cache = {}
+        self._cache_size = cache_size
+        self._patterns = {}
+
+    def __len__(self):
+        return len(self._patterns)
+
+    def __contains__(self, pattern):
+        return pattern in self._patterns
+
+    @property
+    def patterns(self):
+        return list(self._patterns.keys())
+
+    def add(self, pattern, value):
+        """Add a value for a pattern.
+
+        Returns:
+            bool: True if the pattern is new.
+        """
+        with self._lock:
+            node = self._root
+            for word in pattern.split('.'):
+                child = node.children.get(word)
+                if child is None:
+                    child = _Node()
+                    node.children[word] = child
+                node = child
+            node.values = node.values + (value,)
+            is_new = pattern not in self._patterns
+            self._patterns[pattern] = node
+            self._cache = {}
+        return is_new
+
+    def remove(self, pattern, value=None):
+        """Remove a value of a pattern, or all its values if value is None.
+
+        Returns:
+            bool: True if the pattern has no values left.
+        """
+        with self._lock:
+            node = self._patterns.get(pattern)
+            if node is None:
+                return True
+            if value is None:
+                node.values = ()
+            else:
+                node.values = tuple(v for v in node.values if v != value)
+            self._cache = {}
+            if node.values:
+                return False
+            del self._patterns[pattern]
+            self._prune(self._root, pattern.split('.'), 0)
+        return True
+
+    def _prune(self, node, words, i):
+        if i == len(words):
+            return
+        child = node.children.get(words[i])
+        if child is None:
+            return
+        self._prune(child, words, i + 1)
+        if not child.children and not child.values:
+            del node.children[words[i]]
+
+    def match(self, routing_key):
+        """Values of all patterns matching a routing key, without
+        duplicates."""
+        cache = self._cache
+        result = cache.get(routing_key)
+        if result is not None:
+            return result
+        words = routing_key.split('.')
+        nodes = []
+        self._walk(self._root, words, 0, nodes, set())
+        seen = set()
+        result = []
+        for node in nodes:
+            for value in node.values:
+                key = id(value)
+                if key not in seen:
+                    seen.add(key)
+                    result.append(value)
+        if len(cache) >= self._cache_size:
+            cache.clear()
+        cache[routing_key] = result
+        return result
+
+    def _walk(self, node, words, i, out, visited):
+        state = (id(node), i)
+        if state in visited:
+            return
+        visited.add(state)
+        children = node.children
+        hash_node = children.get('#')
+        if i == len(words):
+            if node.values:
+                out.append(node)
+            if hash_node is not None:
+                # '#' matches zero words
+                self._walk(hash_node, words, i, out, visited)
+            return
+        child = children.get(words[i])
+        if child is not None:
+            self._walk(child, words, i + 1, out, visited)
+        child = children.get('*')
+        if child is not None:
+            self._walk(child, words, i + 1, out, visited)
+        if hash_node is not None:
+            for j in range(i, len(words) + 1):
+                self._walk(hash_node, words, j, out, visited)
+
+
+def topic_matches(pattern, routing_key):
+    """True if an AMQP topic pattern matches a routing key."""
+    trie = TopicTrie(cache_size=0)
+    trie.add(pattern, True)
+    return bool(trie.match(routing_key))
@@ -0,0 +1,123 @@
+# -*- coding: utf-8 -*-
+# Copyright (C) 2020  Panayiotou, Konstantinos <klpanagi@gmail.com>
+# Author: Panayiotou, Konstantinos <klpanagi@gmail.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Publish throughput and end-to-end publish->subscribe latency."""
+
+from __future__ import division, print_function
+
+import threading
+import time
+
+from amqp_common import PublisherSync, SubscriberSync
+
+from common import now, percentiles, safe_close
+
+SETTLE_TIME = 0.2
+
+
+class _Sink(object):
+    """Counts deliveries and records their latency."""
+
+    def __init__(self, expected):
+        self.expected = expected
+        self.received = 0
+        self.latencies = []
+        self.done = threading.Event()
+
+    def on_message(self, msg, meta):
+        self.latencies.append(now() - msg['t'])
+        self.received += 1
+        if self.received >= self.expected:
+            self.done.set()
+
+
+def _endpoints(target, prefix, count, **pub_kwargs):
+    topic = target.unique_name(prefix)
+    sink = _Sink(count)
+    sub = SubscriberSync(topic, on_message=sink.on_message,
+                         queue_size=count, **target.endpoint_kwargs())
+    sub.run_threaded()
+    pub = PublisherSync(topic, **target.endpoint_kwargs(**pub_kwargs))
+    time.sleep(SETTLE_TIME)
+    return pub, sub, sink
+
+
+def publish_throughput(target, sizes=(16, 1024, 65536), count=10000,
+                       batch_size=None, timeout=60.0):
+    """Publish `count` messages per payload size as fast as possible.
+
+    Reports the rate at which `publish()` returns and the rate at which
+    messages are delivered to a subscriber.
+    """
+    results = []
+    for size in sizes:
+        pub, sub, sink = _endpoints(target, 'throughput', count,
+                                    batch_size=batch_size)
+        msg = {'t': 0.0, 'data': 'x' * size}
+        try:
+            t0 = now()
+            for _ in range(count):
+                msg['t'] = now()
+                pub.publish(msg)
+            if batch_size is not None:
+                pub.flush()
+            t_publish = now() - t0
+            sink.done.wait(timeout)
+            t_deliver = now() - t0
+        finally:
+            safe_close(pub, sub)
+        results.append({
+            'payload_bytes': size,
+            'batch_size': batch_size,
+            'messages': count,
+            'received': sink.received,
+            'publish_msgs_per_sec': count / t_publish,
+            'publish_mbytes_per_sec': count * size / t_publish / 1e6,
+            'deliver_msgs_per_sec': sink.received / t_deliver,
+        })
+    return results
+
+
+def pubsub_latency(target, count=5000, size=64, hz=1000.0, timeout=30.0):
+    """End-to-end latency of messages published at a fixed rate.
+
+    Latency is measured from right before `publish()` until the subscriber
+    callback is invoked, in microseconds.
+    """
+    pub, sub, sink = _endpoints(target, 'latency', count)
+    msg = {'t': 0.0, 'data': 'x' * size}
+    period = 1.0 / hz
+    try:
+        deadline = now()
+        for _ in range(count):
+            msg['t'] = now()
+            pub.publish(msg)
+            deadline += period
+            remaining = deadline - now()
+            if remaining > 0:
+                time.sleep(remaining)
+        sink.done.wait(timeout)
+    finally:
+        safe_close(pub, sub)
+    result = {
+        'payload_bytes': size,
+        'rate_hz': hz,
+        'messages': count,
+        'received': sink.received,
+        'latency_us': percentiles(sink.latencies),
+    }
+    return result
@@ -0,0 +1,100 @@
+# -*- coding: utf-8 -*-
+# Copyright (C) 2020  Panayiotou, Konstantinos <klpanagi@gmail.com>
+# Author: Panayiotou, Konstantinos <klpanagi@gmail.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""RPC round-trip latency and concurrency scaling."""
+
+from __future__ import division, print_function
+
+import time
+
+from amqp_common import RpcClient, RpcServer
+
+from common import now, percentiles, safe_close
+
+
+def _echo(msg, meta):
+    return msg
+
+
+def _endpoints(target):
+    rpc_name = target.unique_name('rpc')
+    server = RpcServer(rpc_name, on_request=_echo, **target.endpoint_kwargs())
+    server.run_threaded()
+    client = RpcClient(rpc_name, **target.endpoint_kwargs())
+    # Wait for the server and warm up both ends
+    deadline = time.time() + 10.0
+    while 'error' in client.call({'data': ''}, timeout=0.5):
+        if time.time() > deadline:
+            safe_close(client, server)
+            raise RuntimeError('RPC server did not come up')
+    return client, server
+
+
+def rpc_latency(target, count=2000, size=64):
+    """Round-trip latency of sequential calls, in microseconds."""
+    client, server = _endpoints(target)
+    msg = {'data': 'x' * size}
+    samples = []
+    errors = 0
+    try:
+        for _ in range(count):
+            t0 = now()
+            resp = client.call(msg, timeout=5.0)
+            samples.append(now() - t0)
+            if 'error' in resp:
+                errors += 1
+    finally:
+        safe_close(client, server)
+    return {
+        'payload_bytes': size,
+        'calls': count,
+        'errors': errors,
+        'latency_us': percentiles(samples),
+    }
+
+
+def rpc_concurrency(target, levels=(1, 4, 16, 64, 256), count=4000,
+                    size=64):
+    """Throughput and latency with `level` calls in flight."""
+    client, server = _endpoints(target)
+    msg = {'data': 'x' * size}
+    results = []
+    try:
+        for level in levels:
+            samples = []
+            errors = 0
+            t0 = now()
+            for _ in range(max(1, count // level)):
+                t_batch = now()
+                futures = [client.call_async(msg) for _ in range(level)]
+                done, not_done = client.wait(futures, timeout=5.0)
+                t_done = now() - t_batch
+                samples.extend([t_done] * len(done))
+                errors += len(not_done)
+                for future in not_done:
+                    future.cancel()
+            elapsed = now() - t0
+            results.append({
+                'concurrency': level,
+                'calls': len(samples) + errors,
+                'errors': errors,
+                'calls_per_sec': len(samples) / elapsed,
+                'latency_us': percentiles(samples),
+            })
+    finally:
+        safe_close(client, server)
+    return results
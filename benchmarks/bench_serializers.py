@@ -0,0 +1,78 @@
+# -*- coding: utf-8 -*-
+# Copyright (C) 2020  Panayiotou, Konstantinos <klpanagi@gmail.com>
+# Author: Panayiotou, Konstantinos <klpanagi@gmail.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Encode/decode cost of the registered serializers."""
+
+from __future__ import division, print_function
+
+from amqp_common.serializer import ContentType, serializer_registry
+
+from common import now
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+
+def _payload(content_type, size):
+    if content_type == ContentType.ndarray:
+        return np.zeros(max(1, size // 8), dtype=np.float64)
+    if content_type in (ContentType.text, ContentType.text_plain):
+        return 'x' * size
+    if content_type == ContentType.raw_bytes:
+        return b'x' * size
+    return {'header': {'seq': 1, 'stamp': 1.5, 'frame_id': 'base_link'},
+            'values': list(range(16)),
+            'data': 'x' * size}
+
+
+def _time_per_op(fn, arg, iterations):
+    t0 = now()
+    for _ in range(iterations):
+        fn(arg)
+    return (now() - t0) / iterations
+
+
+def serializer_cost(sizes=(64, 4096, 262144), iterations=2000):
+    """Time per encode and decode call of every registered serializer,
+    in microseconds."""
+    results = []
+    seen = set()
+    for content_type in sorted(serializer_registry.content_types):
+        ser = serializer_registry.get(content_type)
+        # Serializers registered under more than one content type
+        if ser in seen:
+            continue
+        seen.add(ser)
+        for size in sizes:
+            data = _payload(content_type, size)
+            wire = ser.serialize(data)
+            _iter = max(10, iterations * 64 // max(64, size))
+            t_enc = _time_per_op(ser.serialize, data, _iter)
+            t_dec = _time_per_op(ser.deserialize, wire, _iter)
+            results.append({
+                'serializer': ser.__name__,
+                'content_type': content_type,
+                'payload_bytes': size,
+                'wire_bytes': len(wire),
+                'encode_us': t_enc * 1e6,
+                'decode_us': t_dec * 1e6,
+                'encode_mbytes_per_sec': len(wire) / t_enc / 1e6,
+                'decode_mbytes_per_sec': len(wire) / t_dec / 1e6,
+            })
+    return results
@@ -30,6 +30,7 @@ setup(
     maintainer_email='klpanagi@gmail.com',
     license='GNUv3',
     test_suite='tests',
+    tests_require=['pytest'],
     include_package_data=True,
     # A list naming all the packages you want to include
     packages=find_packages(),
@@ -0,0 +1,42 @@
+import logging
+import sys
+import time
+
+import pytest
+
+from amqp_common import ConnectionParameters, InMemoryBroker, SharedConnection
+
+
+@pytest.fixture
+def broker():
+    return InMemoryBroker()
+
+
+@pytest.fixture
+def shared(broker):
+    """A SharedConnection to the in-memory broker. Endpoints on it are
+    served by its I/O thread and can be closed from the test thread."""
+    conn = SharedConnection(ConnectionParameters(),
+                            connection_factory=broker.connect)
+    yield conn
+    conn.close()
+
+
+@pytest.fixture
+def wait_until():
+    def _wait_until(predicate, timeout=3.0, interval=0.01):
+        deadline = time.time() + timeout
+        while not predicate():
+            if time.time() > deadline:
+                return False
+            time.sleep(interval)
+        return True
+    return _wait_until
+
+
+def pytest_unconfigure(config):
+    # Endpoints are finalized at interpreter exit, after the captured output
+    # the log handler was created with is closed
+    for handler in logging.getLogger().handlers:
+        if isinstance(handler, logging.StreamHandler):
+            handler.setStream(sys.__stderr__)
@@ -0,0 +1,150 @@
+import asyncio
+import sys
+
+import pytest
+
+if sys.version_info < (3, 7):
+    pytest.skip('asyncio endpoints require Python >= 3.7',
+                allow_module_level=True)
+
+from amqp_common import (AsyncPublisher, AsyncRpcClient, AsyncRpcServer,
+                         AsyncSubscriber, PublisherSync)
+
+
+def run(coro):
+    return asyncio.run(asyncio.wait_for(coro, 5))
+
+
+def test_publish_subscribe(broker):
+    async def main():
+        received = asyncio.Queue()
+
+        async def on_message(msg, meta):
+            await received.put((msg, meta.properties.content_type))
+
+        sub = AsyncSubscriber('sensors.*', on_message=on_message,
+                              connection_factory=broker.connect_async)
+        pub = AsyncPublisher('sensors.imu',
+                             connection_factory=broker.connect_async)
+        async with sub, pub:
+            sub.start()
+            for i in range(5):
+                pub.publish({'i': i})
+            return [await received.get() for _ in range(5)]
+
+    assert run(main()) == [({'i': i}, 'application/json') for i in range(5)]
+
+
+def test_iterate_messages_from_sync_publisher(broker):
+    async def main():
+        sub = AsyncSubscriber('sensors.imu', queue_size=100,
+                              connection_factory=broker.connect_async)
+        await sub.connect()
+        pub = PublisherSync('sensors.imu', connection_factory=broker.connect)
+        # Published from another thread, delivered on the event loop
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(
+            None, lambda: [pub.publish({'i': i}) for i in range(10)])
+        received = []
+        async for msg, meta in sub:
+            received.append(msg['i'])
+            if len(received) == 10:
+                break
+        await sub.close()
+        return received
+
+    assert run(main()) == list(range(10))
+
+
+def test_rpc(broker):
+    async def double(msg, meta):
+        await asyncio.sleep(0.01)
+        return {'result': msg['x'] * 2}
+
+    async def main():
+        server = AsyncRpcServer('calc.double', on_request=double,
+                                connection_factory=broker.connect_async)
+        client = AsyncRpcClient('calc.double',
+                                connection_factory=broker.connect_async)
+        async with server, client:
+            return await asyncio.gather(
+                *[client.call({'x': i}) for i in range(100)])
+
+    assert run(main()) == [{'result': i * 2} for i in range(100)]
+
+
+def test_rpc_handler_error(broker):
+    def fail(msg, meta):
+        raise RuntimeError('boom')
+
+    async def main():
+        server = AsyncRpcServer('calc.fail', on_request=fail,
+                                connection_factory=broker.connect_async)
+        client = AsyncRpcClient('calc.fail',
+                                connection_factory=broker.connect_async)
+        async with server, client:
+            return await client.call({'x': 1})
+
+    assert run(main())['status'] == 500
+
+
+def test_rpc_timeout(broker):
+    async def main():
+        client = AsyncRpcClient('calc.nobody',
+                                connection_factory=broker.connect_async)
+        async with client:
+            resp = await client.call({'x': 1}, timeout=0.05)
+            return resp, client._calls
+
+    assert run(main()) == ({'error': 'RPC Response timeout'}, {})
+
+
+def test_close_cancels_handler_tasks(broker):
+    async def main():
+        started = asyncio.Event()
+        cancelled = []
+
+        async def hang(msg, meta):
+            started.set()
+            try:
+                await asyncio.sleep(60)
+            except asyncio.CancelledError:
+                cancelled.append(msg)
+                raise
+
+        server = AsyncRpcServer('calc.hang', on_request=hang,
+                                connection_factory=broker.connect_async)
+        client = AsyncRpcClient('calc.hang',
+                                connection_factory=broker.connect_async)
+        async with client:
+            await server.connect()
+            call = asyncio.ensure_future(client.call({'x': 1}, timeout=1))
+            await started.wait()
+            await server.close()
+            call.cancel()
+        return cancelled, server._tasks
+
+    assert run(main()) == ([{'x': 1}], set())
+
+
+def test_close_from_handler_task(broker):
+    async def main():
+        done = asyncio.Event()
+
+        async def on_message(msg, meta):
+            await sub.close()
+            done.set()
+
+        sub = AsyncSubscriber('sensors.imu', on_message=on_message,
+                              connection_factory=broker.connect_async)
+        pub = AsyncPublisher('sensors.imu',
+                             connection_factory=broker.connect_async)
+        async with pub:
+            await sub.connect()
+            sub.start()
+            pub.publish({})
+            # The task closing the subscriber is not cancelled by close()
+            await done.wait()
+        return sub.is_open
+
+    assert run(main()) is False
@@ -0,0 +1,251 @@
+import json
+import threading
+import time
+from concurrent.futures import Future
+
+import pika
+import pytest
+
+from amqp_common import ReplayCache, ResponseCache, RpcClient, RpcServer
+
+
+class Counter(object):
+    """RPC handler counting its calls."""
+
+    def __init__(self, delay=0.0):
+        self.calls = 0
+        self.delay = delay
+        self._lock = threading.Lock()
+
+    def __call__(self, msg, meta):
+        with self._lock:
+            self.calls += 1
+        time.sleep(self.delay)
+        return {'result': msg['x'] * 2}
+
+
+class RawCaller(object):
+    """Sends requests with hand-picked message ids over a bare channel."""
+
+    def __init__(self, broker):
+        self._conn = broker.connect()
+        self._channel = self._conn.channel()
+        self.replies = {}
+        self._channel.basic_consume('amq.rabbitmq.reply-to', self._on_reply,
+                                    auto_ack=True)
+
+    def _on_reply(self, ch, method, properties, body):
+        self.replies.setdefault(properties.correlation_id, []).append(
+            json.loads(body))
+
+    def send(self, rpc_name, msg, corr_id, message_id):
+        self._channel.basic_publish(
+            exchange='', routing_key=rpc_name, body=json.dumps(msg),
+            properties=pika.BasicProperties(
+                content_type='application/json', content_encoding='utf8',
+                reply_to='amq.rabbitmq.reply-to', correlation_id=corr_id,
+                message_id=message_id))
+
+    def wait(self, count, timeout=3.0):
+        deadline = time.time() + timeout
+        while sum(len(r) for r in self.replies.values()) < count and \
+                time.time() < deadline:
+            self._conn.process_data_events(time_limit=0.01)
+
+
+class TestReplayCache(object):
+
+    def test_put_get(self):
+        cache = ReplayCache()
+        cache.put('a', (b'{}', 'application/json', 'utf8'))
+        assert cache.get('a') == (b'{}', 'application/json', 'utf8')
+        assert 'a' in cache
+        assert cache.get('b') is None
+        assert cache.stats()['hits'] == 1
+
+    def test_expiry(self):
+        cache = ReplayCache(ttl=0.05)
+        cache.put('a', (b'x', None, None))
+        time.sleep(0.1)
+        assert cache.get('a') is None
+        assert len(cache) == 0
+
+    def test_bounds(self):
+        cache = ReplayCache(max_entries=3, max_bytes=10)
+        for i in range(5):
+            cache.put(i, (b'x', None, None))
+        assert len(cache) == 3
+        assert 0 not in cache and 4 in cache
+        cache.put('big', (b'y' * 9, None, None))
+        assert cache.nbytes <= 10
+        cache.put('huge', (b'z' * 11, None, None))
+        assert 'huge' not in cache
+
+
+class TestServerReplay(object):
+
+    @pytest.fixture
+    def handler(self):
+        return Counter()
+
+    @pytest.fixture
+    def server(self, shared, handler):
+        srv = RpcServer('calc.replay', on_request=handler, connection=shared,
+                        replay_cache=True)
+        srv.run_threaded()
+        yield srv
+        srv.close()
+
+    def test_duplicates_are_replayed(self, broker, server, handler):
+        caller = RawCaller(broker)
+        caller.send('calc.replay', {'x': 1}, 'c1', 'req-1')
+        caller.wait(1)
+        caller.send('calc.replay', {'x': 1}, 'c1', 'req-1')
+        caller.wait(2)
+        assert caller.replies['c1'] == [{'result': 2}, {'result': 2}]
+        assert handler.calls == 1
+
+    def test_message_id_zero_is_not_a_key(self, broker, server, handler):
+        caller = RawCaller(broker)
+        for i in range(3):
+            caller.send('calc.replay', {'x': i}, 'c{}'.format(i), '0')
+        caller.wait(3)
+        assert [caller.replies['c{}'.format(i)] for i in range(3)] == [
+            [{'result': 0}], [{'result': 2}], [{'result': 4}]]
+        assert handler.calls == 3
+
+    def test_client_calls_are_distinct(self, broker, server, handler):
+        client = RpcClient('calc.replay', connection_factory=broker.connect)
+        assert client.call_many(
+            [(None, {'x': i}) for i in range(10)]) == [
+                {'result': i * 2} for i in range(10)]
+        assert handler.calls == 10
+
+
+class TestResponseCache(object):
+
+    def test_hit(self):
+        cache = ResponseCache()
+        future, leader = cache.acquire(('rpc', b'1'), Future)
+        assert leader
+        future.meta = None
+        future.set_result({'r': 1})
+        hit, leader = cache.acquire(('rpc', b'1'), Future)
+        assert not leader and hit.result(0) == {'r': 1}
+        assert cache.stats()['hits'] == 1
+
+    def test_errors_are_not_cached(self):
+        cache = ResponseCache()
+        future, _ = cache.acquire(('rpc', b'1'), Future)
+        future.meta = None
+        future.set_result({'error': 'boom'})
+        assert len(cache) == 0
+
+    def test_ttl(self):
+        cache = ResponseCache(ttl=0.05, ttls={'off': 0})
+        assert cache.ttl_for('off') == 0
+        future, _ = cache.acquire(('rpc', b'1'), Future)
+        future.meta = None
+        future.set_result({'r': 1})
+        time.sleep(0.1)
+        _, leader = cache.acquire(('rpc', b'1'), Future)
+        assert leader
+
+    def test_lru_eviction(self):
+        cache = ResponseCache(max_entries=2)
+        for key in (b'a', b'b'):
+            future, _ = cache.acquire(('rpc', key), Future)
+            future.meta = None
+            future.set_result({})
+        cache.acquire(('rpc', b'a'), Future)
+        future, _ = cache.acquire(('rpc', b'c'), Future)
+        future.meta = None
+        future.set_result({})
+        assert cache.stats()['evictions'] == 1
+        assert not cache.acquire(('rpc', b'a'), Future)[1]
+        assert cache.acquire(('rpc', b'b'), Future)[1]
+
+    def test_coalesced_futures_are_distinct(self):
+        cache = ResponseCache()
+        leader, _ = cache.acquire(('rpc', b'1'), Future)
+        follower, is_leader = cache.acquire(('rpc', b'1'), Future)
+        assert not is_leader and follower is not leader
+        leader.meta = 'meta'
+        leader.set_result({'r': 1})
+        assert follower.result(0) == {'r': 1}
+        assert follower.meta == 'meta'
+
+    def test_release(self):
+        cache = ResponseCache()
+        leader, _ = cache.acquire(('rpc', b'1'), Future)
+        follower, _ = cache.acquire(('rpc', b'1'), Future)
+        # The call keeps going while a caller waits on it
+        cache.release(('rpc', b'1'), leader)
+        assert not leader.cancelled()
+        cache.release(('rpc', b'1'), follower)
+        assert follower.cancelled() and leader.cancelled()
+
+
+class TestClientCache(object):
+
+    @pytest.fixture
+    def handler(self):
+        return Counter(delay=0.2)
+
+    @pytest.fixture(autouse=True)
+    def server(self, shared, handler):
+        srv = RpcServer('calc.cached', on_request=handler, connection=shared,
+                        workers=4)
+        srv.run_threaded()
+        yield srv
+        srv.close()
+
+    def test_hits(self, broker, handler):
+        client = RpcClient('calc.cached', cache=True,
+                           connection_factory=broker.connect)
+        assert client.call({'x': 1}) == {'result': 2}
+        assert client.call({'x': 1}) == {'result': 2}
+        assert handler.calls == 1
+        assert client.cache.stats()['hits'] == 1
+
+    def test_coalescing_across_clients(self, broker, handler):
+        cache = ResponseCache()
+        clients = [RpcClient('calc.cached', cache=cache,
+                             connection_factory=broker.connect)
+                   for _ in range(3)]
+        results = {}
+        drivers = {}
+
+        def record(n, process):
+            def _process(*args, **kwargs):
+                drivers.setdefault(n, set()).add(threading.current_thread())
+                return process(*args, **kwargs)
+            return _process
+
+        for n, client in enumerate(clients):
+            client.connection.process_data_events = record(
+                n, client.connection.process_data_events)
+
+        def call(n):
+            results[n] = clients[n].call({'x': 5}, timeout=3)
+
+        threads = [threading.Thread(target=call, args=(n,)) for n in range(3)]
+        for t in threads:
+            t.start()
+            time.sleep(0.02)
+        for t in threads:
+            t.join()
+        assert results == {n: {'result': 10} for n in range(3)}
+        assert handler.calls == 1
+        assert cache.stats()['coalesced'] == 2
+        # Each connection is only driven by the thread of its client
+        for n, thread in enumerate(threads):
+            assert drivers[n] == {thread}
+
+    def test_coalesced_timeout(self, broker, handler):
+        client = RpcClient('calc.cached', cache=True,
+                           connection_factory=broker.connect)
+        first = client.call_async({'x': 7})
+        assert client.call({'x': 7}, timeout=0.01) == {
+            'error': 'RPC Response timeout'}
+        assert first.result(3) == {'result': 14}
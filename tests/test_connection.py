@@ -0,0 +1,73 @@
+import pika
+import pytest
+
+from amqp_common import (ConnectionParameters, ConnectionPool, PublisherSync,
+                         SharedConnection, SubscriberSync)
+
+
+@pytest.fixture
+def conn(broker):
+    conn = SharedConnection(ConnectionParameters(), max_channels=3,
+                            connection_factory=broker.connect)
+    yield conn
+    conn.close()
+
+
+def test_channel_limit(conn):
+    channels = [conn.acquire_channel()[1] for _ in range(3)]
+    assert conn.num_channels == 3 and not conn.has_capacity
+    with pytest.raises(pika.exceptions.NoFreeChannels):
+        conn.acquire_channel()
+    conn.release_channel(channels[0])
+    assert conn.has_capacity
+    conn.acquire_channel()
+
+
+def test_channel_limit_is_bounded_by_negotiated(broker):
+    conn = SharedConnection(ConnectionParameters(channel_max=2),
+                            max_channels=10,
+                            connection_factory=broker.connect)
+    try:
+        assert conn.channel_max == 2
+    finally:
+        conn.close()
+
+
+def test_run_sync_runs_on_io_thread(conn):
+    assert not conn.in_io_thread()
+    assert conn.run_sync(conn.in_io_thread)
+
+
+def test_endpoints_share_the_connection(broker, conn, wait_until):
+    received = []
+    sub = SubscriberSync('sensors.imu', connection=conn,
+                         on_message=lambda msg, meta: received.append(msg))
+    sub.run_threaded()
+    pub = PublisherSync('sensors.imu', connection=conn)
+    try:
+        assert sub.connection is pub.connection is conn.connection
+        assert sub.shared and pub.shared
+        pub.publish({'i': 1})
+        assert wait_until(lambda: received == [{'i': 1}])
+    finally:
+        sub.close()
+        pub.close()
+    assert conn.num_channels == 0
+
+
+def test_pool_opens_connections_on_demand(broker):
+    pool = ConnectionPool(max_connections=2, channels_per_connection=2,
+                          connection_factory=broker.connect)
+    try:
+        acquired = [pool.acquire_channel() for _ in range(4)]
+        assert len(pool.connections) == 2
+        assert sorted(c.num_channels for c in pool.connections) == [2, 2]
+        with pytest.raises(pika.exceptions.NoFreeChannels):
+            pool.acquire_channel()
+        # Channels are handed out from the least loaded connection
+        shared, channel = acquired[0]
+        shared.release_channel(channel)
+        assert pool.acquire_channel()[0] is shared
+    finally:
+        pool.close()
+    assert pool.connections == []
@@ -0,0 +1,68 @@
+import pickle
+
+import pika
+import pytest
+
+from amqp_common import PublisherSync, SubscriberSync
+from amqp_common.amqp_transport import DeliveryMeta
+
+
+@pytest.fixture
+def meta():
+    method = pika.spec.Basic.Deliver('ctag', 7, False, 'amq.topic', 'a.b')
+    properties = pika.BasicProperties(
+        content_type='application/json', content_encoding='utf8',
+        timestamp=123, delivery_mode=2, correlation_id='c1',
+        headers={'timestamp_in_ms': 456})
+    return DeliveryMeta(object(), method, properties)
+
+
+def test_attribute_access(meta):
+    assert meta.method.delivery_tag == 7
+    assert meta.properties.content_type == 'application/json'
+    assert meta.properties.timestamp_broker == 456
+    assert meta.properties.timestamp_producer == 123
+    assert meta.properties.raw.delivery_mode == 2
+
+
+def test_dict_access(meta):
+    assert meta['method'] is meta.method
+    assert meta['properties']['content_type'] == 'application/json'
+    assert meta['properties']['correlation_id'] == 'c1'
+    assert 'properties' in meta and 'body' not in meta
+    assert meta.get('body', 1) == 1
+    assert sorted(meta.keys()) == ['channel', 'method', 'properties']
+    assert meta['properties'].to_dict()['timestamp_broker'] == 456
+    with pytest.raises(KeyError):
+        meta['body']
+    with pytest.raises(KeyError):
+        meta['properties']['body']
+
+
+def test_no_per_instance_dict(meta):
+    with pytest.raises(AttributeError):
+        meta.extra = 1
+    assert not hasattr(meta, '__dict__')
+
+
+def test_pickle(meta):
+    copy = pickle.loads(pickle.dumps(meta))
+    # Channels can not cross process boundaries
+    assert copy.channel is None
+    assert copy.method.delivery_tag == 7
+    assert copy.properties.content_type == 'application/json'
+    assert copy['properties']['timestamp_broker'] == 456
+
+
+def test_passed_to_callbacks(broker, shared, wait_until):
+    metas = []
+    sub = SubscriberSync('a.b', connection=shared,
+                         on_message=lambda msg, meta: metas.append(meta))
+    sub.run_threaded()
+    try:
+        PublisherSync('a.b', connection_factory=broker.connect).publish({})
+        assert wait_until(lambda: metas)
+        assert isinstance(metas[0], DeliveryMeta)
+        assert metas[0]['method'].routing_key == 'a.b'
+    finally:
+        sub.close()
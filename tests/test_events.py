@@ -0,0 +1,54 @@
+import threading
+import time
+
+from amqp_common import (Event, EventEmitter, EventEmitterOptions,
+                         SubscriberSync)
+
+
+def test_confirms(broker, shared):
+    emitter = EventEmitter(
+        EventEmitterOptions(confirm=True, confirm_window=4),
+        connection=shared)
+    futures = []
+
+    def worker():
+        for i in range(25):
+            futures.append(emitter.send_event(
+                Event('robot.moved', payload={'i': i})))
+
+    # Hold the I/O thread, so that messages queue up for publishing
+    gate = threading.Event()
+    shared.add_callback_threadsafe(lambda: gate.wait(5))
+    threads = [threading.Thread(target=worker) for _ in range(4)]
+    for t in threads:
+        t.start()
+    time.sleep(0.1)
+    # Events waiting for the I/O thread count against the window
+    assert len(shared.connection._dispatch_events) <= 4
+    gate.set()
+    for t in threads:
+        t.join()
+    assert emitter.wait_for_confirms(5)
+    assert len(futures) == 100 and all(f.result(1) for f in futures)
+
+
+def test_content_type(broker, shared, wait_until):
+    emitter = EventEmitter(
+        EventEmitterOptions(content_encoding='latin1'),
+        connection_factory=broker.connect)
+    received = []
+    sub = SubscriberSync(
+        'robot.*', exchange='events', connection=shared,
+        on_message=lambda msg, meta: received.append(
+            (msg, meta.properties.content_type,
+             meta.properties.content_encoding)))
+    sub.run_threaded()
+    try:
+        emitter.send_event(Event('robot.started', payload={'id': 1}))
+        assert wait_until(lambda: received)
+        msg, content_type, content_encoding = received[0]
+        assert msg['payload'] == {'id': 1}
+        assert (content_type, content_encoding) == (
+            'application/json', 'utf8')
+    finally:
+        sub.close()
@@ -0,0 +1,120 @@
+import time
+
+import pika
+import pytest
+
+from amqp_common import ConnectionParameters, PublisherSync, SubscriberSync
+
+
+@pytest.fixture
+def channel(broker):
+    return broker.connect().channel()
+
+
+def consume(channel, queue, auto_ack=True):
+    received = []
+    channel.basic_consume(
+        queue, lambda ch, method, props, body: received.append(
+            (method, body)), auto_ack=auto_ack)
+    return received
+
+
+def test_topic_routing(broker, channel):
+    for queue, key in (('q.pose', 'robot.*.pose'), ('q.all', 'robot.#')):
+        channel.queue_declare(queue)
+        channel.queue_bind(queue, 'amq.topic', key)
+    for key in ('robot.a.pose', 'robot.a.battery', 'sensors.imu'):
+        channel.basic_publish('amq.topic', key, key)
+    assert broker.queue_depth('q.pose') == 1
+    assert broker.queue_depth('q.all') == 2
+    assert broker.published == 3
+
+
+def test_default_exchange(broker, channel):
+    channel.queue_declare('q')
+    channel.basic_publish('', 'q', b'x')
+    received = consume(channel, 'q')
+    channel.connection.process_data_events()
+    assert [body for _, body in received] == [b'x']
+    assert broker.queue_depth('q') == 0
+
+
+def test_passive_declare_of_missing_queue(broker, channel):
+    with pytest.raises(pika.exceptions.ChannelClosedByBroker) as exc:
+        channel.queue_declare('nobody', passive=True)
+    assert exc.value.reply_code == 404
+    assert channel.is_closed
+
+
+def test_max_length_drops_head(broker, channel):
+    channel.queue_declare('q', arguments={'x-max-length': 2})
+    for i in range(4):
+        channel.basic_publish('', 'q', str(i))
+    received = consume(channel, 'q')
+    channel.connection.process_data_events()
+    assert [body for _, body in received] == [b'2', b'3']
+
+
+def test_nack_requeues_as_redelivered(broker, channel):
+    channel.queue_declare('q')
+    channel.basic_publish('', 'q', b'x')
+    received = consume(channel, 'q', auto_ack=False)
+    channel.connection.process_data_events()
+    channel.basic_nack(received[0][0].delivery_tag)
+    channel.connection.process_data_events()
+    assert [m.redelivered for m, _ in received] == [False, True]
+
+
+def test_prefetch(broker, channel):
+    channel.queue_declare('q')
+    channel.basic_qos(prefetch_count=2)
+    for i in range(5):
+        channel.basic_publish('', 'q', str(i))
+    received = consume(channel, 'q', auto_ack=False)
+    channel.connection.process_data_events()
+    assert len(received) == 2 and broker.queue_depth('q') == 3
+    channel.basic_ack(received[-1][0].delivery_tag, multiple=True)
+    channel.connection.process_data_events()
+    assert len(received) == 4
+
+
+def test_call_later(broker):
+    conn = broker.connect()
+    fired = []
+    conn.call_later(0.05, lambda: fired.append('a'))
+    timer = conn.call_later(0.01, lambda: fired.append('b'))
+    conn.remove_timeout(timer)
+    conn.sleep(0.1)
+    assert fired == ['a']
+
+
+def test_channel_max(broker):
+    conn = broker.connect(ConnectionParameters(channel_max=2))
+    conn.channel()
+    conn.channel()
+    with pytest.raises(pika.exceptions.NoFreeChannels):
+        conn.channel()
+
+
+def test_endpoints(broker, shared, wait_until):
+    received = []
+    sub = SubscriberSync('sensors.*', connection=shared,
+                         on_message=lambda msg, meta: received.append(msg))
+    sub.run_threaded()
+    try:
+        pub = PublisherSync('sensors.imu', connection_factory=broker.connect)
+        for i in range(10):
+            pub.publish({'i': i})
+        assert wait_until(lambda: len(received) == 10)
+        assert received == [{'i': i} for i in range(10)]
+    finally:
+        sub.close()
+
+
+def test_threadsafe_callbacks_wake_up_the_loop(broker):
+    conn = broker.connect()
+    called = []
+    t0 = time.time()
+    conn.add_callback_threadsafe(lambda: called.append(True))
+    conn.process_data_events(time_limit=1)
+    assert called and time.time() - t0 < 0.5
@@ -0,0 +1,171 @@
+import os
+import time
+import zlib
+
+import pika
+import pytest
+
+from amqp_common import FileReceiver, FileSender
+from amqp_common.file_transfer import ChunkHeaders
+
+
+@pytest.fixture
+def receiver(shared, tmp_path):
+    completed = []
+    recv = FileReceiver('files', dest_dir=str(tmp_path / 'out'),
+                        on_complete=completed.append, connection=shared)
+    recv.completed = completed
+    os.mkdir(str(tmp_path / 'out'))
+    recv.run_threaded()
+    yield recv
+    recv.close()
+
+
+@pytest.fixture
+def sender(broker):
+    return FileSender('files', chunk_size=4096,
+                      connection_factory=broker.connect)
+
+
+def write_file(path, size):
+    data = os.urandom(size)
+    with open(str(path), 'wb') as f:
+        f.write(data)
+    return data
+
+
+@pytest.mark.parametrize('size', [0, 1, 4096, 10000, 65536])
+def test_send_file(tmp_path, receiver, sender, wait_until, size):
+    data = write_file(tmp_path / 'map.pgm', size)
+    sender.send_file(str(tmp_path / 'map.pgm'))
+    assert wait_until(lambda: receiver.completed)
+    with open(str(tmp_path / 'out' / 'map.pgm'), 'rb') as f:
+        assert f.read() == data
+    assert not os.path.exists(str(tmp_path / 'out' / 'map.pgm.part.json'))
+
+
+def test_resume(tmp_path, receiver, sender, wait_until):
+    data = write_file(tmp_path / 'map.pgm', 20000)
+    transfer_id = sender.send_file(str(tmp_path / 'map.pgm'),
+                                   chunks=[0, 2, 4])
+    assert wait_until(
+        lambda: receiver.missing_chunks(transfer_id) == [1, 3])
+    sender.send_file(str(tmp_path / 'map.pgm'), transfer_id=transfer_id,
+                     chunks=receiver.missing_chunks(transfer_id))
+    assert wait_until(lambda: receiver.completed)
+    with open(str(tmp_path / 'out' / 'map.pgm'), 'rb') as f:
+        assert f.read() == data
+
+
+def test_resume_after_receiver_restart(tmp_path, broker, receiver, sender,
+                                      wait_until):
+    data = write_file(tmp_path / 'map.pgm', 20000)
+    transfer_id = sender.send_file(str(tmp_path / 'map.pgm'),
+                                   chunks=[0, 2, 4])
+    assert wait_until(
+        lambda: receiver.missing_chunks(transfer_id) == [1, 3])
+    receiver.close()
+    completed = []
+    restarted = FileReceiver('files', dest_dir=str(tmp_path / 'out'),
+                             on_complete=completed.append,
+                             connection_factory=broker.connect)
+    # Known before any chunk of the transfer arrives
+    assert restarted.missing_chunks(transfer_id) == [1, 3]
+    restarted.run_threaded()
+    try:
+        sender.send_file(str(tmp_path / 'map.pgm'), transfer_id=transfer_id,
+                         chunks=restarted.missing_chunks(transfer_id))
+        assert wait_until(lambda: completed)
+        with open(str(tmp_path / 'out' / 'map.pgm'), 'rb') as f:
+            assert f.read() == data
+    finally:
+        restarted.close()
+
+
+class TestInvalidChunks(object):
+
+    @pytest.fixture
+    def forge(self, broker):
+        channel = broker.connect().channel()
+
+        def _forge(seq, offset, body, size=100, chunk_size=64,
+                   chunk_count=2, transfer_id='t1', crc=None,
+                   name='../../evil.bin'):
+            headers = {
+                ChunkHeaders.TRANSFER_ID: transfer_id,
+                ChunkHeaders.FILE_NAME: name,
+                ChunkHeaders.FILE_SIZE: size,
+                ChunkHeaders.CHUNK_SIZE: chunk_size,
+                ChunkHeaders.CHUNK_COUNT: chunk_count,
+                ChunkHeaders.CHUNK_SEQ: seq,
+                ChunkHeaders.CHUNK_OFFSET: offset,
+                ChunkHeaders.CHUNK_CRC32:
+                    zlib.crc32(body) & 0xffffffff if crc is None else crc
+            }
+            channel.basic_publish(
+                exchange='amq.topic', routing_key='files', body=body,
+                properties=pika.BasicProperties(
+                    content_type='application/octet-stream',
+                    headers=headers))
+        return _forge
+
+    def test_out_of_bounds(self, tmp_path, receiver, forge, wait_until):
+        forge(5, 320, b'x' * 64)
+        forge(0, 10 ** 9, b'x' * 64)
+        forge(1, 64, b'x' * 100)
+        forge(0, 0, b'x' * 64, crc=0)
+        assert wait_until(
+            lambda: 't1' in receiver.transfers and
+            receiver.transfers['t1'].corrupted == 4)
+        assert receiver.missing_chunks('t1') == [0, 1]
+        # The partial file keeps the announced size, in the destination dir
+        part = tmp_path / 'out' / 'evil.bin.part'
+        assert os.path.getsize(str(part)) == 100
+        forge(0, 0, b'a' * 64)
+        forge(1, 64, b'b' * 36)
+        assert wait_until(lambda: receiver.completed)
+        with open(str(tmp_path / 'out' / 'evil.bin'), 'rb') as f:
+            assert f.read() == b'a' * 64 + b'b' * 36
+
+    def test_chunks_after_completion(self, tmp_path, receiver, forge,
+                                     wait_until):
+        forge(0, 0, b'a' * 64)
+        forge(1, 64, b'b' * 36)
+        assert wait_until(lambda: receiver.completed)
+        # A re-sent chunk does not reopen the transfer
+        forge(1, 64, b'b' * 36)
+        forge(0, 0, b'a' * 64, transfer_id='t2', name='other.bin')
+        assert wait_until(lambda: 't2' in receiver.transfers)
+        assert 't1' not in receiver.transfers
+        assert receiver.missing_chunks('t1') == []
+        assert not os.path.exists(str(tmp_path / 'out' / 'evil.bin.part'))
+        assert len(receiver.completed) == 1
+
+    def test_inconsistent_sizes(self, receiver, forge, wait_until):
+        forge(0, 0, b'x', size=10, chunk_size=0, chunk_count=1)
+        forge(0, 0, b'x', size=10, chunk_size=4, chunk_count=1,
+              transfer_id='t2')
+        forge(0, 0, b'x', size=-1, chunk_size=4, chunk_count=1,
+              transfer_id='t3')
+        # A valid transfer, delivered after the forged chunks
+        forge(0, 0, b'', size=0, chunk_size=4, chunk_count=1,
+              transfer_id='t4')
+        assert wait_until(lambda: receiver.completed)
+        assert [t.transfer_id for t in receiver.completed] == ['t4']
+        assert receiver.transfers == {}
+
+
+def test_retry_backoff(tmp_path, broker):
+    sender = FileSender('files.full', chunk_size=1000, max_retries=2,
+                        retry_delay=0.1, max_retry_delay=0.15,
+                        connection_factory=broker.connect)
+    assert [sender.retry_delay(a) for a in range(4)] == [
+        0.1, 0.15, 0.15, 0.15]
+    # A receiver queue that rejects the chunks, which are then nacked
+    FileReceiver('files.full', dest_dir=str(tmp_path), queue_size=1,
+                 connection_factory=broker.connect)
+    write_file(tmp_path / 'big.bin', 5000)
+    t0 = time.time()
+    with pytest.raises(IOError):
+        sender.send_file(str(tmp_path / 'big.bin'))
+    assert time.time() - t0 >= 0.25
@@ -0,0 +1,133 @@
+import threading
+import time
+
+import pytest
+
+from amqp_common import PublisherSync, SubscriberSync
+
+
+@pytest.fixture
+def received(shared):
+    """Messages of topic `data.x`, with their content type."""
+    msgs = []
+    sub = SubscriberSync(
+        'data.x', connection=shared, queue_size=1000,
+        on_message=lambda msg, meta: msgs.append(
+            (msg, time.time(), meta.properties.content_type)))
+    sub.run_threaded()
+    yield msgs
+    sub.close()
+
+
+def track_unconfirmed(endpoint):
+    """Record the number of unconfirmed messages of an endpoint after each
+    publish."""
+    peak = []
+    register = endpoint._confirms.register
+
+    def _register(future):
+        register(future)
+        peak.append(endpoint._confirms.unconfirmed)
+    endpoint._confirms.register = _register
+    return peak
+
+
+def test_publish_many(broker, received, wait_until):
+    pub = PublisherSync('data.x', connection_factory=broker.connect)
+    pub.publish_many([{'i': i} for i in range(100)])
+    assert wait_until(lambda: len(received) == 100)
+    assert [msg['i'] for msg, _, _ in received] == list(range(100))
+
+
+def test_batch_size(broker, received, wait_until):
+    pub = PublisherSync('data.x', batch_size=5,
+                        connection_factory=broker.connect)
+    for i in range(4):
+        pub.publish({'i': i})
+    assert pub.pending == 4
+    pub.publish({'i': 4})
+    assert pub.pending == 0
+    assert wait_until(lambda: len(received) == 5)
+
+
+def test_batch_interval_restarts_per_batch(broker, received, wait_until):
+    pub = PublisherSync('data.x', batch_size=5, batch_interval=0.3,
+                        connection_factory=broker.connect)
+
+    def drive(duration):
+        deadline = time.time() + duration
+        while time.time() < deadline:
+            pub.process_amqp_events()
+            time.sleep(0.01)
+
+    for i in range(5):
+        pub.publish({'i': i})
+    drive(0.15)
+    t0 = time.time()
+    pub.publish({'i': 5})
+    drive(0.6)
+    assert wait_until(lambda: len(received) == 6)
+    # The timer of the first, full, batch must not flush the second early
+    assert received[-1][1] - t0 >= 0.25
+    live = [t for t in pub.connection._timers if t[2] is not None]
+    assert not live
+
+
+def test_flush(broker, received, wait_until):
+    pub = PublisherSync('data.x', batch_interval=10,
+                        connection_factory=broker.connect)
+    pub.publish({'i': 0})
+    pub.flush()
+    assert wait_until(lambda: len(received) == 1)
+
+
+def test_publish_many_confirms(broker, received, wait_until):
+    pub = PublisherSync('data.x', confirm=True, confirm_window=50,
+                        connection_factory=broker.connect)
+    peak = track_unconfirmed(pub)
+    futures = pub.publish_many([{'i': i} for i in range(500)])
+    assert pub.wait_for_confirms(5)
+    assert all(f.result(0) for f in futures)
+    # Never more messages in flight than the confirm window
+    assert max(peak) <= 50
+    assert wait_until(lambda: len(received) == 500)
+    assert [msg['i'] for msg, _, _ in received] == list(range(500))
+
+
+def test_batched_publish_confirms(broker, received, wait_until):
+    pub = PublisherSync('data.x', confirm=True, confirm_window=10,
+                        batch_size=20, connection_factory=broker.connect)
+    peak = track_unconfirmed(pub)
+    futures = [pub.publish({'i': i}) for i in range(100)]
+    pub.flush()
+    assert pub.wait_for_confirms(5)
+    assert all(f.result(0) for f in futures)
+    # Buffered messages count against the window
+    assert max(peak) <= 10
+    assert wait_until(lambda: len(received) == 100)
+
+
+def test_publish_confirms_from_threads(broker, shared, received,
+                                       wait_until):
+    pub = PublisherSync('data.x', confirm=True, confirm_window=8,
+                        connection=shared)
+
+    def worker():
+        for i in range(50):
+            pub.publish({'i': i})
+
+    # Hold the I/O thread, so that messages queue up for publishing
+    gate = threading.Event()
+    shared.add_callback_threadsafe(lambda: gate.wait(5))
+    threads = [threading.Thread(target=worker) for _ in range(4)]
+    for t in threads:
+        t.start()
+    time.sleep(0.1)
+    # Messages waiting for the I/O thread count against the window
+    assert len(shared.connection._dispatch_events) <= 8
+    gate.set()
+    for t in threads:
+        t.join()
+    assert pub.wait_for_confirms(5)
+    assert wait_until(lambda: len(received) == 200)
+    pub.close()
@@ -0,0 +1,156 @@
+import pytest
+
+from amqp_common import PublisherSync, SubscriberSync
+from amqp_common import rate as rate_module
+from amqp_common.rate import Rate, RateEstimator
+
+
+class FakeClock(object):
+    """Monotonic clock advanced by sleeps and simulated work."""
+
+    def __init__(self):
+        self.now = 1000.0
+        self.sleeps = []
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, duration):
+        self.sleeps.append(duration)
+        self.now += duration
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(rate_module, 'monotonic', clock)
+    return clock
+
+
+def test_invalid_rate():
+    with pytest.raises(ValueError):
+        Rate(0)
+
+
+def test_no_drift(clock):
+    r = Rate(10, sleep_fn=clock.sleep)
+    start = clock.now
+    for i in range(1, 101):
+        # Loop body taking 30% of the period
+        clock.now += 0.03
+        assert r.sleep()
+        assert clock.now == pytest.approx(start + i * 0.1)
+    assert clock.sleeps == pytest.approx([0.07] * 100)
+    assert r.overruns == 0 and r.missed == 0
+    assert r.achieved_hz == pytest.approx(10)
+
+
+def test_overrun_skips_missed_cycles(clock):
+    r = Rate(10, sleep_fn=clock.sleep)
+    start = clock.now
+    # A body taking 2.5 periods overruns two deadlines. The cycle wakes up
+    # for the latest one; the earlier one is skipped.
+    clock.now += 0.25
+    assert not r.sleep()
+    assert (r.overruns, r.missed) == (1, 1)
+    assert r.last_deadline == pytest.approx(start + 0.2)
+    # The loop stays in phase with its original schedule
+    assert r.deadline == pytest.approx(start + 0.3)
+    assert r.sleep()
+    assert clock.now == pytest.approx(start + 0.3)
+    assert r.cycles == 2
+
+
+def test_lateness_stats(clock):
+    def late_sleep(duration):
+        # Wake up 2 ms late
+        clock.sleep(duration + 0.002)
+
+    r = Rate(100, sleep_fn=late_sleep)
+    for _ in range(10):
+        r.sleep()
+    stats = r.stats()
+    assert stats['jitter_mean'] == pytest.approx(0.002)
+    assert stats['jitter_max'] == pytest.approx(0.002)
+    assert stats['jitter_std'] == pytest.approx(0, abs=1e-9)
+    assert stats['cycles'] == 10 and stats['overruns'] == 0
+
+
+def test_reset(clock):
+    r = Rate(10, sleep_fn=clock.sleep)
+    clock.now += 1
+    r.sleep()
+    r.reset()
+    assert (r.cycles, r.overruns, r.missed) == (0, 0, 0)
+    assert r.remaining() == pytest.approx(0.1)
+
+
+class TestRateEstimator(object):
+
+    def test_window_wraps(self, clock):
+        est = RateEstimator(window=4)
+        ts = clock.now
+        for dt in (0.1, 0.1, 0.1, 0.1, 0.2, 0.3, 0.2, 0.3, 0.2):
+            est.update(10, ts=ts)
+            ts += dt
+        est.update(20, ts=ts)
+        clock.now = ts
+        # Only the last 4 inter-arrival times are averaged
+        assert est.mean_interval == pytest.approx(0.25)
+        assert est.hz == pytest.approx(4.0)
+        assert est.jitter == pytest.approx(0.0577350, rel=1e-4)
+        assert est.byte_rate == pytest.approx(50 / 1.0)
+        assert (est.count, est.bytes) == (10, 110)
+
+    def test_hz_decays_when_events_stop(self, clock):
+        est = RateEstimator(window=10)
+        for i in range(11):
+            est.update(ts=clock.now + i * 0.1)
+        clock.now += 1.0
+        assert est.hz == pytest.approx(10)
+        clock.now += 1.0
+        # 10 intervals over 2s, of which 0.9s is silence beyond the mean
+        assert est.hz == pytest.approx(10 / 1.9)
+
+    def test_buckets(self, clock):
+        clock.now = 1000.5
+        est = RateEstimator(buckets=3)
+        for sec, count in ((1000, 2), (1001, 3), (1002, 4)):
+            for _ in range(count):
+                est.update(5, ts=sec + 0.5)
+        clock.now = 1002.5
+        assert est.count_last(1) == (4, 20)
+        assert est.count_last(2) == (7, 35)
+        # More seconds than buckets are capped
+        assert est.count_last(10) == (9, 45)
+        # Second 1003 reuses the bucket of second 1000
+        est.update(5, ts=1003.5)
+        clock.now = 1003.5
+        assert est.count_last(3) == (8, 40)
+        # Buckets left behind by a silence are not counted
+        clock.now = 1010.5
+        assert est.count_last(3) == (0, 0)
+
+    def test_reset(self, clock):
+        est = RateEstimator(window=4, buckets=5)
+        est.update(1, ts=clock.now)
+        est.update(1, ts=clock.now + 0.1)
+        est.reset()
+        assert (est.count, est.bytes, est.hz) == (0, 0, 0.0)
+        assert est.count_last(5) == (0, 0)
+
+
+def test_subscriber_stats(broker, shared, wait_until):
+    sub = SubscriberSync('sensors.imu', connection=shared,
+                         on_message=lambda msg, meta: None)
+    sub.run_threaded()
+    try:
+        pub = PublisherSync('sensors.imu', connection_factory=broker.connect)
+        for i in range(20):
+            pub.publish(b'x' * 100)
+        assert wait_until(lambda: sub.stats['count'] == 20)
+        stats = sub.stats
+        assert stats['bytes'] == 2000 and stats['count_10s'] == 20
+        assert sub.hz > 0
+    finally:
+        sub.close()
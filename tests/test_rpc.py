@@ -0,0 +1,292 @@
+import threading
+import time
+
+import pytest
+
+from amqp_common import (ConnectionParameters, RpcClient, RpcServer,
+                         RpcServiceHost, SharedConnection)
+
+
+def double(msg, meta):
+    return {'result': msg['x'] * 2}
+
+
+@pytest.fixture
+def server(broker, shared):
+    srv = RpcServer('calc.double', on_request=double, connection=shared)
+    srv.run_threaded()
+    yield srv
+    srv.close()
+
+
+@pytest.fixture
+def client(broker, server):
+    return RpcClient('calc.double', connection_factory=broker.connect)
+
+
+def test_call(client):
+    assert client.call({'x': 21}) == {'result': 42}
+
+
+def test_call_timeout(broker):
+    client = RpcClient('calc.nobody', connection_factory=broker.connect)
+    assert client.call({'x': 1}, timeout=0.1) == {
+        'error': 'RPC Response timeout'}
+    assert client.pending == 0
+
+
+def test_many_calls_in_flight(client):
+    futures = [client.call_async({'x': i}) for i in range(500)]
+    done, not_done = client.wait(futures, timeout=10)
+    assert not not_done
+    assert [f.result() for f in futures] == [
+        {'result': i * 2} for i in range(500)]
+
+
+def test_call_many(client):
+    resps = client.call_many(
+        [(None, {'x': i}) for i in range(300)], timeout=10)
+    assert resps == [{'result': i * 2} for i in range(300)]
+
+
+def test_queue_size_drops_oldest(broker, shared):
+    release = threading.Event()
+
+    def blocked_double(msg, meta):
+        release.wait(5)
+        return double(msg, meta)
+
+    srv = RpcServer('calc.sized', on_request=blocked_double,
+                    connection=shared, workers=1, prefetch_count=1,
+                    queue_size=20)
+    srv.run_threaded()
+    try:
+        client = RpcClient('calc.sized', connection_factory=broker.connect)
+        futures = [client.call_async({'x': i}) for i in range(30)]
+        client.wait(futures, timeout=0.2)
+        release.set()
+        client.wait(futures, timeout=5)
+        answered = [i for i, f in enumerate(futures) if f.done()]
+        # The request being handled and the newest 20 queued ones
+        assert answered == [0] + list(range(10, 30))
+    finally:
+        release.set()
+        srv.close()
+
+
+def test_thread_workers(broker, shared):
+    def slow_double(msg, meta):
+        time.sleep(0.05)
+        return double(msg, meta)
+
+    srv = RpcServer('calc.slow', on_request=slow_double, connection=shared,
+                    workers=8)
+    srv.run_threaded()
+    try:
+        client = RpcClient('calc.slow', connection_factory=broker.connect)
+        t0 = time.time()
+        resps = client.call_many(
+            [(None, {'x': i}) for i in range(16)], timeout=5)
+        assert resps == [{'result': i * 2} for i in range(16)]
+        # 16 requests on 8 workers take two rounds, not sixteen
+        assert time.time() - t0 < 0.6
+    finally:
+        srv.close()
+
+
+def test_prefetch_follows_workers(broker, shared, wait_until):
+    release = threading.Event()
+    running = []
+
+    def blocked_double(msg, meta):
+        running.append(msg['x'])
+        release.wait(5)
+        return double(msg, meta)
+
+    srv = RpcServer('calc.prefetch', on_request=blocked_double,
+                    connection=shared, workers=3)
+    srv.run_threaded()
+    try:
+        client = RpcClient('calc.prefetch',
+                           connection_factory=broker.connect)
+        futures = [client.call_async({'x': i}) for i in range(10)]
+        assert wait_until(lambda: len(running) == 3)
+        # Requests beyond the busy workers stay on the broker
+        assert broker.queue_depth('calc.prefetch') == 7
+        release.set()
+        client.wait(futures, timeout=5)
+        assert [f.result() for f in futures] == [
+            {'result': i * 2} for i in range(10)]
+    finally:
+        release.set()
+        srv.close()
+
+
+def test_process_workers(broker, shared):
+    srv = RpcServer('calc.proc', on_request=double, connection=shared,
+                    workers=2, executor='process')
+    srv.run_threaded()
+    try:
+        client = RpcClient('calc.proc', connection_factory=broker.connect)
+        assert client.call_many(
+            [(None, {'x': i}) for i in range(10)], timeout=10) == [
+                {'result': i * 2} for i in range(10)]
+    finally:
+        srv.close()
+
+
+def test_close_releases_shared_channel(broker):
+    conn = SharedConnection(ConnectionParameters(), max_channels=3,
+                            connection_factory=broker.connect)
+    try:
+        for i in range(10):
+            srv = RpcServer('calc.cycle', on_request=double, connection=conn)
+            srv.run_threaded()
+            srv.close()
+            host = RpcServiceHost({'calc.cycle': double}, connection=conn)
+            host.run_threaded()
+            host.close()
+        assert conn.num_channels == 0
+    finally:
+        conn.close()
+
+
+def test_call_stream(broker, shared):
+    def count(msg, meta):
+        for i in range(msg['n']):
+            yield {'i': i}
+
+    srv = RpcServer('calc.count', on_request=count, connection=shared)
+    srv.run_threaded()
+    try:
+        client = RpcClient('calc.count', connection_factory=broker.connect)
+        chunks = list(client.call_stream({'n': 50}, timeout=2))
+        assert chunks == [{'i': i} for i in range(50)]
+    finally:
+        srv.close()
+
+
+def test_broadcast(broker, shared):
+    servers = [
+        RpcServer('calc.node{}'.format(i), connection=shared,
+                  on_request=lambda msg, meta, i=i: {'node': i},
+                  broadcast_exchange='calc.all')
+        for i in range(3)
+    ]
+    for srv in servers:
+        srv.run_threaded()
+    try:
+        client = RpcClient('calc.node0', connection_factory=broker.connect)
+        resps = client.broadcast({}, exchange='calc.all', count=3)
+        assert sorted(msg['node'] for msg, meta in resps) == [0, 1, 2]
+    finally:
+        for srv in servers:
+            srv.close()
+
+
+class TestServiceHost(object):
+
+    @pytest.fixture
+    def host(self, shared):
+        host = RpcServiceHost({'svc.double': double}, connection=shared)
+        host.run_threaded()
+        yield host
+        host.close()
+
+    def test_dispatch_by_rpc(self, broker, host):
+        host.register('svc.negate', lambda msg, meta: {'result': -msg['x']})
+        client = RpcClient('svc.double', connection_factory=broker.connect)
+        assert client.call({'x': 2}) == {'result': 4}
+        assert client.call_many([('svc.negate', {'x': 2})]) == [
+            {'result': -2}]
+        assert set(host.procedures) == {'svc.double', 'svc.negate'}
+
+    def test_register_taken_rpc(self, broker, shared, host):
+        other = RpcServer('svc.taken', on_request=double, connection=shared)
+        other.run_threaded()
+        try:
+            with pytest.raises(ValueError):
+                host.register('svc.taken', double)
+            assert 'svc.taken' not in host.procedures
+            # The host keeps serving its other RPCs
+            client = RpcClient('svc.double',
+                               connection_factory=broker.connect)
+            assert client.call({'x': 3}) == {'result': 6}
+        finally:
+            other.close()
+
+    def test_unregister(self, broker, host):
+        host.register('svc.tmp', double)
+        host.unregister('svc.tmp')
+        client = RpcClient('svc.tmp', connection_factory=broker.connect)
+        assert client.call({'x': 1}, timeout=0.1) == {
+            'error': 'RPC Response timeout'}
+
+    def test_initial_rpc_taken(self, broker, shared):
+        other = RpcServer('svc.taken', on_request=double, connection=shared)
+        other.run_threaded()
+        try:
+            host = RpcServiceHost({'svc.free': double, 'svc.taken': double},
+                                  connection=shared)
+            with pytest.raises(ValueError):
+                host.run_threaded()
+            assert 'svc.free' not in broker.queues
+        finally:
+            other.close()
+
+    def test_run_async(self, broker):
+        host = RpcServiceHost({'svc.double': double},
+                              connection_factory=broker.connect)
+        host.run_async()
+        client = RpcClient('svc.double', connection_factory=broker.connect)
+        future = client.call_async({'x': 4})
+        deadline = time.time() + 3
+        while not future.done() and time.time() < deadline:
+            # The caller drives the connection of the host
+            host.connection.process_data_events(time_limit=0.01)
+            client.wait([future], 0.01)
+        assert future.result(0) == {'result': 8}
+        host.close()
+
+    def test_register_while_running_blocking(self, broker):
+        host = RpcServiceHost({'svc.double': double},
+                              connection_factory=broker.connect)
+        served_by = []
+        serve = host._serve
+
+        def record(rpc_name):
+            served_by.append(threading.current_thread())
+            serve(rpc_name)
+
+        host._serve = record
+        runner = threading.Thread(target=host.run)
+        runner.daemon = True
+        runner.start()
+        deadline = time.time() + 3
+        while not host._running and time.time() < deadline:
+            time.sleep(0.01)
+        host.register('svc.negate', lambda msg, meta: {'result': -msg['x']})
+        client = RpcClient('svc.negate', connection_factory=broker.connect)
+        assert client.call({'x': 2}) == {'result': -2}
+        # Queues are declared by the thread running the host
+        assert served_by == [runner, runner]
+        host.connection.add_callback_threadsafe(host.close)
+        runner.join(3)
+        assert not runner.is_alive()
+
+
+def test_shared_client_from_threads(broker, server, shared):
+    client = RpcClient('calc.double', connection=shared)
+    results = {}
+
+    def worker(n):
+        results[n] = [client.call({'x': n * 100 + i}) for i in range(20)]
+
+    threads = [threading.Thread(target=worker, args=(n,)) for n in range(4)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    for n in range(4):
+        assert results[n] == [
+            {'result': (n * 100 + i) * 2} for i in range(20)]
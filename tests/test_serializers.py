@@ -0,0 +1,99 @@
+import pytest
+
+from amqp_common.serializer import (CBORSerializer, JSONSerializer,
+                                    MsgpackSerializer, NDArraySerializer,
+                                    ORJSONSerializer, SerializerRegistry,
+                                    serializer_registry)
+
+DOC = {'name': 'imu', 'seq': 3, 'values': [0.5, -1.25], 'ok': True,
+       'nested': {'unicode': u'αβ', 'none': None}}
+
+
+def roundtrip(data, serializer=None, registry=serializer_registry):
+    payload, content_type, content_encoding = registry.serialize(
+        data, serializer)
+    assert isinstance(payload, bytes)
+    return registry.deserialize(payload, content_type, content_encoding), \
+        content_type
+
+
+def test_json():
+    assert roundtrip(DOC) == (DOC, 'application/json')
+
+
+def test_json_rejects_non_dict():
+    with pytest.raises(TypeError):
+        JSONSerializer.serialize([1, 2])
+
+
+def test_text():
+    assert roundtrip(u'hello α') == (u'hello α', 'text/plain')
+
+
+def test_bytes():
+    assert roundtrip(b'\x00\xff') == (b'\x00\xff',
+                                      'application/octet-stream')
+
+
+def test_unknown_content_type_is_passed_as_is():
+    assert serializer_registry.deserialize(b'raw', 'application/x-foo') == \
+        b'raw'
+
+
+def test_resolve_by_content_type():
+    assert serializer_registry.resolve('application/json') is \
+        JSONSerializer
+    with pytest.raises(ValueError):
+        serializer_registry.resolve('application/x-foo')
+
+
+def test_orjson():
+    pytest.importorskip('orjson')
+    registry = SerializerRegistry(default=ORJSONSerializer)
+    registry.register(ORJSONSerializer)
+    assert roundtrip(DOC, registry=registry) == (DOC, 'application/json')
+
+
+def test_msgpack():
+    pytest.importorskip('msgpack')
+    assert roundtrip(DOC, MsgpackSerializer) == (DOC, 'application/msgpack')
+
+
+def test_cbor():
+    pytest.importorskip('cbor2')
+    assert roundtrip(DOC, CBORSerializer) == (DOC, 'application/cbor')
+
+
+@pytest.mark.parametrize('dtype', ['<f4', '>f8', 'u1', '<i8', '?'])
+def test_ndarray(dtype):
+    np = pytest.importorskip('numpy')
+    arr = (np.arange(24).reshape(2, 3, 4) % 2).astype(dtype)
+    out, content_type = roundtrip(arr)
+    assert content_type == 'application/x-ndarray'
+    assert out.dtype == arr.dtype and out.shape == arr.shape
+    assert np.array_equal(out, arr)
+
+
+def test_ndarray_non_contiguous():
+    np = pytest.importorskip('numpy')
+    arr = np.arange(20.0).reshape(4, 5)[:, ::2]
+    out, _ = roundtrip(arr)
+    assert np.array_equal(out, arr)
+
+
+def test_ndarray_scalar_and_empty():
+    np = pytest.importorskip('numpy')
+    for arr in (np.array(3.5), np.zeros((0, 3), dtype='<i4')):
+        out, _ = roundtrip(arr)
+        assert out.shape == arr.shape and np.array_equal(out, arr)
+
+
+def test_ndarray_is_a_view_of_the_body():
+    np = pytest.importorskip('numpy')
+    payload = NDArraySerializer.serialize(np.arange(1000.0))
+    out = NDArraySerializer.deserialize(payload)
+    assert not out.flags.owndata and not out.flags.writeable
+    # The data is 16-byte aligned within the body
+    assert (out.__array_interface__['data'][0] -
+            np.frombuffer(payload, 'u1').__array_interface__['data'][0]) \
+        % 16 == 0
@@ -0,0 +1,231 @@
+import threading
+import time
+
+import pytest
+
+from amqp_common import MultiSubscriber, PublisherSync, SubscriberSync
+
+
+@pytest.fixture
+def publisher(broker):
+    return PublisherSync('sensors.imu', connection_factory=broker.connect)
+
+
+@pytest.fixture
+def subscribers():
+    """Closes the subscribers of a test."""
+    subs = []
+    yield subs
+    for sub in subs:
+        sub.close()
+
+
+def test_conflate(broker, shared, subscribers, wait_until):
+    received = []
+    sub = SubscriberSync('robot.*.pose', connection=shared, queue_size=100,
+                         conflate=True, conflate_hz=2,
+                         on_message=lambda msg, meta: received.append(msg))
+    subscribers.append(sub)
+    pubs = [PublisherSync('robot.{}.pose'.format(name),
+                          connection_factory=broker.connect)
+            for name in ('a', 'b')]
+    # Queued before the consumer starts, so that they arrive in a burst
+    for i in range(50):
+        for pub in pubs:
+            pub.publish({'i': i, 'robot': pub._topic})
+    acks = []
+    basic_ack = sub.channel.basic_ack
+
+    def _basic_ack(*args, **kwargs):
+        acks.append(kwargs)
+        return basic_ack(*args, **kwargs)
+    sub.channel.basic_ack = _basic_ack
+    sub.run_threaded()
+    assert wait_until(lambda: {'i': 49, 'robot': 'robot.a.pose'} in received
+                      and {'i': 49, 'robot': 'robot.b.pose'} in received)
+    assert len(received) < 20
+    assert broker.queue_depth(sub._queue_name) == 0
+    # Deliveries are acked in bulk
+    assert 0 < len(acks) < 10
+    assert all(ack['multiple'] for ack in acks)
+
+
+def test_conflate_requires_prefetch(broker):
+    with pytest.raises(ValueError):
+        SubscriberSync('robot.*.pose', conflate=True, prefetch_count=0,
+                       connection_factory=broker.connect)
+
+
+def test_workers_preserve_order_per_key(broker, shared, subscribers,
+                                        wait_until):
+    received = {}
+    lock = threading.Lock()
+
+    def on_message(msg, meta):
+        time.sleep(0.001)
+        with lock:
+            received.setdefault(msg['key'], []).append(msg['i'])
+
+    sub = SubscriberSync('jobs.*', connection=shared, queue_size=1000,
+                         workers=4, on_message=on_message)
+    subscribers.append(sub)
+    sub.run_threaded()
+    pubs = [PublisherSync('jobs.{}'.format(k),
+                          connection_factory=broker.connect)
+            for k in range(4)]
+    for i in range(50):
+        for k, pub in enumerate(pubs):
+            pub.publish({'key': k, 'i': i})
+    assert wait_until(
+        lambda: sum(len(v) for v in received.values()) == 200)
+    assert received == {k: list(range(50)) for k in range(4)}
+
+
+def test_batch(shared, publisher, subscribers, wait_until):
+    batches = []
+    sub = SubscriberSync('sensors.imu', connection=shared, queue_size=100,
+                         on_batch=lambda msgs, metas: batches.append(msgs),
+                         batch_size=10, batch_interval=0.1)
+    subscribers.append(sub)
+    sub.run_threaded()
+    publisher.publish_many([{'i': i} for i in range(25)])
+    assert wait_until(lambda: sum(len(b) for b in batches) == 25)
+    assert [len(b) for b in batches] == [10, 10, 5]
+    assert [m['i'] for b in batches for m in b] == list(range(25))
+
+
+def test_batch_error_nacks(shared, publisher, subscribers, wait_until):
+    seen = []
+
+    def on_batch(msgs, metas):
+        seen.append([meta.method.redelivered for meta in metas])
+        if not metas[0].method.redelivered:
+            raise RuntimeError('fail once')
+
+    sub = SubscriberSync('sensors.imu', connection=shared, queue_size=100,
+                         on_batch=on_batch, batch_size=5)
+    subscribers.append(sub)
+    sub.run_threaded()
+    publisher.publish_many([{'i': i} for i in range(5)])
+    assert wait_until(lambda: len(seen) == 2)
+    assert seen == [[False] * 5, [True] * 5]
+
+
+def test_reliable_requeues_on_error(shared, publisher, subscribers,
+                                    wait_until):
+    received = []
+
+    def on_message(msg, meta):
+        received.append((msg['i'], meta.method.redelivered))
+        if msg['i'] == 3 and not meta.method.redelivered:
+            raise RuntimeError('fail once')
+
+    sub = SubscriberSync('sensors.imu', connection=shared, reliable=True,
+                         on_message=on_message)
+    subscribers.append(sub)
+    sub.run_threaded()
+    for i in range(5):
+        publisher.publish({'i': i})
+    assert wait_until(lambda: (3, True) in received)
+    assert sorted(i for i, _ in received) == [0, 1, 2, 3, 3, 4]
+
+
+def test_manual_ack_from_other_thread(broker, shared, publisher, subscribers,
+                                      wait_until):
+    metas = []
+    sub = SubscriberSync('sensors.imu', connection=shared, manual_ack=True,
+                         on_message=lambda msg, meta: metas.append(meta))
+    subscribers.append(sub)
+    sub.run_threaded()
+    for i in range(10):
+        publisher.publish({'i': i})
+    assert wait_until(lambda: len(metas) == 10)
+    acker = threading.Thread(
+        target=lambda: [sub.ack(meta) for meta in metas])
+    acker.start()
+    acker.join()
+    assert wait_until(lambda: not sub._pending_acks)
+
+
+def test_manual_ack_callback_error_nacks(shared, publisher, subscribers,
+                                         wait_until):
+    received = []
+
+    def on_message(msg, meta):
+        received.append(meta.method.redelivered)
+        if not meta.method.redelivered:
+            raise RuntimeError('fail once')
+        sub.ack(meta)
+
+    sub = SubscriberSync('sensors.imu', connection=shared, manual_ack=True,
+                         on_message=on_message)
+    subscribers.append(sub)
+    sub.run_threaded()
+    publisher.publish({'i': 0})
+    assert wait_until(lambda: received == [False, True])
+    assert wait_until(lambda: not sub._pending_acks)
+
+
+@pytest.mark.parametrize('batch_size,batch_interval', [
+    (0, 0.1), (10, None), (10, 0), (10, -1)])
+def test_invalid_batch_parameters(broker, batch_size, batch_interval):
+    with pytest.raises(ValueError):
+        SubscriberSync('sensors.imu', on_batch=print, batch_size=batch_size,
+                       batch_interval=batch_interval,
+                       connection_factory=broker.connect)
+
+
+class TestMultiSubscriber(object):
+
+    def test_dispatch(self, broker, shared, subscribers, wait_until):
+        received = []
+        sub = MultiSubscriber({
+            'robot.*.pose': lambda msg, meta: received.append(('pose', msg)),
+            'robot.#': lambda msg, meta: received.append(('any', msg)),
+        }, connection=shared)
+        subscribers.append(sub)
+        sub.run_threaded()
+        PublisherSync('robot.a.pose',
+                      connection_factory=broker.connect).publish({'p': 1})
+        PublisherSync('robot.a.battery',
+                      connection_factory=broker.connect).publish({'b': 1})
+        assert wait_until(lambda: len(received) == 3)
+        assert sorted(received, key=repr) == sorted(
+            [('pose', {'p': 1}), ('any', {'p': 1}), ('any', {'b': 1})],
+            key=repr)
+
+    def test_unsubscribe(self, broker, shared, subscribers, wait_until):
+        received = []
+        sub = MultiSubscriber(
+            {'a.b': lambda msg, meta: received.append(msg)},
+            connection=shared)
+        subscribers.append(sub)
+        sub.run_threaded()
+        sub.unsubscribe('a.b')
+        PublisherSync('a.b', connection_factory=broker.connect).publish({})
+        time.sleep(0.1)
+        assert received == []
+        assert sub.topics == []
+
+    def test_subscribe_while_running(self, broker, shared, subscribers,
+                                     wait_until):
+        received = []
+        sub = MultiSubscriber(
+            {'a.b': lambda msg, meta: received.append(('a', msg))},
+            connection=shared)
+        subscribers.append(sub)
+        sub.run_threaded()
+        queues = len(broker.queues)
+        sub.subscribe('c.*', lambda msg, meta: received.append(('c', msg)))
+        PublisherSync('c.d', connection_factory=broker.connect).publish({})
+        assert wait_until(lambda: received == [('c', {})])
+        # Topics share the queue of the subscriber
+        assert len(broker.queues) == queues
+        assert sorted(sub.topics) == ['a.b', 'c.*']
+
+    def test_process_workers_rejected(self, broker):
+        queues = broker.queues
+        with pytest.raises(ValueError):
+            MultiSubscriber({'a.b': print}, workers=2, executor='process',
+                            connection_factory=broker.connect)
+        assert broker.queues == queues
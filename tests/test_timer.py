@@ -0,0 +1,100 @@
+import threading
+import time
+
+import pytest
+
+from amqp_common import Timer, TimerScheduler
+
+
+@pytest.fixture
+def scheduler():
+    scheduler = TimerScheduler()
+    yield scheduler
+    scheduler.stop()
+
+
+def test_fires_in_deadline_order(scheduler, wait_until):
+    fired = []
+    for name, delay in (('c', 0.06), ('a', 0.02), ('b', 0.04)):
+        scheduler.call_later(delay, lambda ev, name=name: fired.append(name))
+    assert wait_until(lambda: len(fired) == 3)
+    assert fired == ['a', 'b', 'c']
+    assert scheduler.num_timers == 0
+
+
+def test_periodic_timer_does_not_drift(scheduler, wait_until):
+    events = []
+    timer = scheduler.add(0.02, events.append)
+    assert wait_until(lambda: len(events) >= 10)
+    timer.cancel()
+    expected = [ev.current_expected for ev in events[:10]]
+    periods = [b - a for a, b in zip(expected, expected[1:])]
+    assert periods == pytest.approx([0.02] * 9, abs=1e-6)
+    assert events[1].last_expected == events[0].current_expected
+
+
+def test_cancel(scheduler, wait_until):
+    fired = []
+    timers = []
+
+    def on_timer(ev):
+        fired.append(ev)
+        if len(fired) == 3:
+            # Cancelling from the callback itself
+            timers[0].cancel()
+
+    timers.append(scheduler.add(0.01, on_timer))
+    other = scheduler.add(0.01, lambda ev: None)
+    assert wait_until(lambda: len(fired) == 3)
+    time.sleep(0.05)
+    assert len(fired) == 3
+    assert not timers[0].active and scheduler.num_timers == 1
+    other.cancel()
+    assert scheduler.num_timers == 0
+
+
+def test_late_fire_stats(scheduler):
+    fired = threading.Event()
+    # A slow callback delays the timer due right after it
+    scheduler.call_later(0.01, lambda ev: time.sleep(0.05))
+    late = scheduler.call_later(0.02, lambda ev: fired.set())
+    assert fired.wait(1)
+    stats = late.stats()
+    assert stats['fires'] == 1 and stats['late_fires'] == 1
+    assert stats['max_lateness'] >= 0.03
+    assert scheduler.stats()['late_fires'] >= 1
+
+
+def test_periodic_timer_skips_missed_cycles(scheduler, wait_until):
+    calls = []
+
+    def slow(ev):
+        calls.append(ev)
+        if len(calls) == 1:
+            time.sleep(0.055)
+
+    timer = scheduler.add(0.02, slow)
+    assert wait_until(lambda: len(calls) >= 3)
+    timer.cancel()
+    assert timer.missed >= 2
+    # Still on the original schedule
+    offset = calls[1].current_expected - calls[0].current_expected
+    assert offset == pytest.approx((timer.missed + 1) * 0.02, abs=1e-6)
+
+
+def test_callback_errors_do_not_stop_the_scheduler(scheduler, wait_until):
+    fired = []
+    scheduler.call_later(0.01, lambda ev: 1 / 0)
+    scheduler.call_later(0.02, fired.append)
+    assert wait_until(lambda: fired)
+
+
+def test_timer_on_scheduler(scheduler, wait_until):
+    fired = []
+    timer = Timer(0.01, fired.append, scheduler=scheduler)
+    timer.start()
+    assert wait_until(lambda: len(fired) >= 3)
+    timer.shutdown()
+    count = len(fired)
+    time.sleep(0.05)
+    assert len(fired) == count
@@ -0,0 +1,69 @@
+import pytest
+
+from amqp_common.topics import TopicTrie, topic_matches
+
+
+@pytest.mark.parametrize('pattern,key,matches', [
+    ('a.b.c', 'a.b.c', True),
+    ('a.b.c', 'a.b', False),
+    ('a.*.c', 'a.b.c', True),
+    ('a.*.c', 'a.c', False),
+    ('a.*', 'a.b.c', False),
+    ('a.#', 'a', True),
+    ('a.#', 'a.b.c', True),
+    ('#', 'a.b', True),
+    ('#.c', 'a.b.c', True),
+    ('#.c', 'c', True),
+    ('a.#.c', 'a.c', True),
+    ('a.#.c', 'a.b.d.c', True),
+    ('a.#.c', 'a.b.d', False),
+    ('*.#', 'a', True),
+    ('*', '', True),
+    ('*.*', 'a', False),
+])
+def test_topic_matches(pattern, key, matches):
+    assert topic_matches(pattern, key) is matches
+
+
+def test_match_all_patterns():
+    trie = TopicTrie()
+    trie.add('robot.*.pose', 'pose')
+    trie.add('robot.#', 'any')
+    trie.add('robot.r1.pose', 'r1')
+    assert sorted(trie.match('robot.r1.pose')) == ['any', 'pose', 'r1']
+    assert trie.match('robot.r2.battery') == ['any']
+    assert trie.match('sensors.imu') == []
+
+
+def test_values_are_not_duplicated():
+    trie = TopicTrie()
+    callback = object()
+    trie.add('a.#', callback)
+    trie.add('#.b', callback)
+    assert trie.match('a.b') == [callback]
+
+
+def test_add_remove():
+    trie = TopicTrie()
+    assert trie.add('a.b', 1)
+    assert not trie.add('a.b', 2)
+    assert 'a.b' in trie and len(trie) == 1
+    assert sorted(trie.match('a.b')) == [1, 2]
+    assert not trie.remove('a.b', 1)
+    assert trie.match('a.b') == [2]
+    assert trie.remove('a.b')
+    assert 'a.b' not in trie and trie.patterns == []
+    assert trie.match('a.b') == []
+    # Removed patterns leave no nodes behind
+    assert trie._root.children == {}
+
+
+def test_cache_is_invalidated():
+    trie = TopicTrie(cache_size=2)
+    assert trie.match('a.b') == []
+    trie.add('a.*', 1)
+    assert trie.match('a.b') == [1]
+    for key in ('a.c', 'a.d', 'a.e'):
+        assert trie.match(key) == [1]
+    trie.remove('a.*')
+    assert trie.match('a.b') == []